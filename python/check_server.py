@@ -0,0 +1,290 @@
+import contextlib
+import io
+import json
+import os
+import sys
+
+import stack_trace
+from display import remove_color
+from enums import EnumType
+from imported_error import ImportedError
+from scope import get_imports, type_check_file
+from type import (
+    NType,
+    NGenericType,
+    NAliasType,
+    NTypeVars,
+    NModule,
+    NClass,
+    shared_types,
+)
+
+"""
+A type checking server for editors and CI that would otherwise run
+`n.py --check` over and over. It reads requests like `{"file": "run.n"}` from
+stdin, one per line, and writes the file's errors and warnings as a line of
+JSON to stdout. Each error or warning is an object with the file it's in, the
+line and column where it starts and ends, and the message.
+
+The parsed and type checked files are kept between requests. Before each
+request, the modification times of the files are checked, and a file that has
+changed is checked again. The files that import it, directly or not, are only
+checked again if its public types, errors or warnings have changed, since the
+importing files show its errors and warnings too.
+"""
+
+
+def get_mtime(file_path):
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_diagnostics(diagnostics, file):
+    """
+    Lists errors or warnings, including the ones from imported files, as
+    dictionaries that can be serialized as JSON.
+    """
+    entries = []
+    for diagnostic in diagnostics:
+        if isinstance(diagnostic, ImportedError):
+            entries += get_diagnostics(diagnostic.err, diagnostic.file)
+            continue
+        datum = diagnostic.datum
+        entries.append(
+            {
+                "file": file.path,
+                "line": datum.line,
+                "column": datum.column,
+                "end_line": datum.end_line,
+                "end_column": datum.end_column,
+                "message": remove_color(diagnostic.message),
+            }
+        )
+    return entries
+
+
+def types_match(old, new, matched):
+    """
+    Returns whether a type from before a file was checked again is the same as
+    the type from after. Checking a file creates new enum types and generics,
+    so types with a key are compared by their key and generics by where they
+    are used. `matched` maps the old generics and keyed types that have been
+    compared so far to the new ones.
+    """
+    if old is new:
+        return True
+    elif isinstance(old, NGenericType):
+        if not isinstance(new, NGenericType):
+            return False
+        if old.key is not None or new.key is not None:
+            return old.key == new.key
+        return matched.setdefault(old, new) is new
+    elif isinstance(old, NTypeVars):
+        if type(old) is not type(new):
+            return False
+        if old.base_type is not old or new.base_type is not new:
+            return types_match(old.base_type, new.base_type, matched) and types_match(
+                old.typevars, new.typevars, matched
+            )
+        if old.key is None or old.key != new.key:
+            return False
+        if old in matched:
+            # Enums can contain themselves
+            return matched[old] is new
+        matched[old] = new
+        return types_match(old.typevars, new.typevars, matched) and (
+            not isinstance(old, EnumType)
+            or types_match(old.variants, new.variants, matched)
+        )
+    elif isinstance(old, NAliasType):
+        return (
+            isinstance(new, NAliasType)
+            and old.name == new.name
+            and types_match(old.typevars, new.typevars, matched)
+            and types_match(old.type, new.type, matched)
+        )
+    elif isinstance(old, NType) or isinstance(old, NModule):
+        # Other types are only the same if they're the same object
+        return False
+    elif isinstance(old, dict):
+        if isinstance(old, NClass) and (
+            not isinstance(new, NClass) or old.class_name != new.class_name
+        ):
+            return False
+        return (
+            isinstance(new, dict)
+            and not isinstance(new, NModule)
+            and list(old.keys()) == list(new.keys())
+            and all(types_match(old[key], new[key], matched) for key in old)
+        )
+    elif isinstance(old, list) or isinstance(old, tuple):
+        return (
+            type(old) is type(new)
+            and len(old) == len(new)
+            and all(
+                types_match(old_item, new_item, matched)
+                for old_item, new_item in zip(old, new)
+            )
+        )
+    return old == new
+
+
+def module_matches(old, new):
+    """
+    Returns whether the files importing a file that was checked again would be
+    unchanged. If so, the new module keeps the old public types, which the
+    files importing it were checked with.
+    """
+    matched = {}
+    if not (
+        get_diagnostics(old.errors, old.file) == get_diagnostics(new.errors, new.file)
+        and get_diagnostics(old.warnings, old.file)
+        == get_diagnostics(new.warnings, new.file)
+        and types_match(old.public_types, new.public_types, matched)
+        and types_match(old.public_variable_types, new.public_variable_types, matched)
+    ):
+        return False
+    new.public_types = old.public_types
+    new.public_variable_types = old.public_variable_types
+    for old_type in matched:
+        if old_type.key is None:
+            continue
+        shared_types[old_type.key] = old_type
+        for typevar in old_type.typevars:
+            if isinstance(typevar, NGenericType) and typevar.key is not None:
+                shared_types[typevar.key] = typevar
+    return True
+
+
+class CheckServer:
+    def __init__(self):
+        # The checked modules by normalized path for each base path, since
+        # the names shown for files are relative to the base path
+        self.modules = {}
+        # The modification time of each checked file from before it was read
+        self.mtimes = {}
+        # The normalized paths of the files each checked file imports
+        self.imports = {}
+
+    def forget(self, file_path):
+        """
+        Forgets a checked file, returning its modules by base path.
+        """
+        del self.mtimes[file_path]
+        del self.imports[file_path]
+        forgotten = {}
+        for base_path, modules in self.modules.items():
+            module = modules.pop(file_path, None)
+            if module is not None:
+                forgotten[base_path] = module
+        return forgotten
+
+    def check_module(self, file_path, base_path):
+        """
+        Type checks a file and the files it imports that haven't been checked
+        yet, returning the module, or a string if there was an error that
+        stopped the file from being checked.
+        """
+        modules = self.modules.setdefault(base_path, {})
+
+        # Syntax errors in the file or its imports are printed before exiting
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                module = type_check_file(file_path, base_path, [], modules)
+        except (SystemExit, Exception) as err:
+            # Forget the files that were parsed but not fully checked
+            for path in [path for path in modules if path not in self.mtimes]:
+                del modules[path]
+            if isinstance(err, SystemExit):
+                return output.getvalue().strip()
+            elif os.environ.get("N_ST_DEBUG") == "dev":
+                raise err
+            else:
+                return stack_trace.display([], False)
+
+        for path, checked_module in modules.items():
+            if path not in self.mtimes:
+                self.mtimes[path] = checked_module.mtime
+                self.imports[path] = get_imports(checked_module.tree, path)
+        return module
+
+    def invalidate(self):
+        """
+        Checks the files that have changed since they were checked again, and
+        forgets the files that import them if that changes them too.
+        """
+        changed = [
+            file_path
+            for file_path, mtime in self.mtimes.items()
+            if get_mtime(file_path) != mtime
+        ]
+        if not changed:
+            return
+        unchanged = set(self.mtimes).difference(changed)
+        # Forget every changed file before checking any of them so that a
+        # changed file isn't checked against another one's old types
+        old_modules = {file_path: self.forget(file_path) for file_path in changed}
+        stale = set()
+        for file_path in changed:
+            if not os.path.isfile(file_path):
+                stale.add(file_path)
+                continue
+            for base_path, old_module in old_modules[file_path].items():
+                module = self.check_module(file_path, base_path)
+                if isinstance(module, str) or not module_matches(old_module, module):
+                    stale.add(file_path)
+
+        # The unchanged files that import a stale file have to be checked again
+        # when they're next needed
+        importers_found = True
+        while importers_found:
+            importers_found = False
+            for file_path, imports in list(self.imports.items()):
+                if (
+                    file_path in unchanged
+                    and file_path not in stale
+                    and not stale.isdisjoint(imports)
+                ):
+                    stale.add(file_path)
+                    self.forget(file_path)
+                    importers_found = True
+
+    def check(self, filename):
+        """
+        Type checks a file, returning its diagnostics as a dictionary that can
+        be serialized as JSON.
+        """
+        self.invalidate()
+        file_path = os.path.normpath(os.path.abspath(filename))
+        if not os.path.isfile(file_path):
+            return {"file": filename, "error": "Unable to read file %s" % filename}
+        module = self.check_module(file_path, os.path.dirname(file_path))
+        if isinstance(module, str):
+            return {"file": filename, "error": module}
+
+        errors = get_diagnostics(module.errors, module.file)
+        warnings = get_diagnostics(module.warnings, module.file)
+        return {
+            "file": filename,
+            "errors": errors,
+            "warnings": warnings,
+            "error_count": len(errors),
+            "warning_count": len(warnings),
+        }
+
+
+def serve(requests=sys.stdin, responses=sys.stdout):
+    server = CheckServer()
+    for line in requests:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            response = server.check(request["file"])
+        except (ValueError, KeyError, TypeError):
+            response = {"error": 'Requests should look like {"file": "run.n"}.'}
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
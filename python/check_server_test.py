@@ -0,0 +1,112 @@
+# python -m unittest check_server_test.py
+
+import unittest
+import os
+import tempfile
+
+import check_server
+import scope
+
+library = """type pub shape = pub circle(int) | pub square(int)
+let pub area = (s: shape) -> int {
+  return 1
+}
+let pub unit = circle(1)
+"""
+
+main = """let lib = imp "./lib.n"
+let a: int = lib.area(lib.unit)
+let b: str = lib.area(lib.square(2))
+"""
+
+
+class CheckServerTestCases(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = check_server.CheckServer()
+        self.checked = []
+        self.type_check = scope.type_check
+
+        def type_check(tree, import_scope):
+            self.checked.append(os.path.basename(import_scope.file_path))
+            return self.type_check(tree, import_scope)
+
+        scope.type_check = type_check
+        self.write("lib.n", library)
+        self.write("main.n", main)
+
+    def tearDown(self):
+        scope.type_check = self.type_check
+        self.directory.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        # Make sure the modification time changes even on coarse file systems
+        os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    def check(self, name):
+        self.checked = []
+        return self.server.check(os.path.join(self.directory.name, name))
+
+    def test_diagnostics(self):
+        response = self.check("main.n")
+        self.assertEqual(response["error_count"], 1)
+        self.assertEqual(
+            response["errors"],
+            [
+                {
+                    "file": os.path.join(self.directory.name, "main.n"),
+                    "line": 3,
+                    "column": 14,
+                    "end_line": 3,
+                    "end_column": 37,
+                    "message": "You set b, which is defined to be a str, to what evaluates to a int.",
+                }
+            ],
+        )
+
+    def test_unchanged_files(self):
+        self.check("main.n")
+        self.assertEqual(self.check("main.n")["error_count"], 1)
+        self.assertEqual(self.checked, [])
+
+    def test_same_public_types(self):
+        self.check("main.n")
+        self.write("lib.n", library.replace("return 1", "return 2"))
+        self.assertEqual(self.check("main.n")["error_count"], 1)
+        self.assertEqual(self.checked, ["lib.n"])
+
+        # Files checked afterwards still get the types the importers have
+        self.write("other.n", main)
+        self.assertEqual(self.check("other.n")["error_count"], 1)
+
+    def test_changed_public_types(self):
+        self.check("main.n")
+        self.write(
+            "lib.n",
+            library.replace("-> int", "-> str").replace("return 1", 'return "1"'),
+        )
+        self.assertEqual(self.check("main.n")["error_count"], 1)
+        self.assertEqual(self.checked, ["lib.n", "main.n"])
+        self.assertEqual(self.check("main.n")["errors"][0]["line"], 2)
+
+    def test_changed_while_checking(self):
+        type_check = scope.type_check
+
+        def edit_while_checking(tree, import_scope):
+            if import_scope.file_path.endswith("lib.n"):
+                self.write("lib.n", library + "let pub extra = 1\n")
+            return type_check(tree, import_scope)
+
+        scope.type_check = edit_while_checking
+        self.check("main.n")
+        scope.type_check = type_check
+        self.check("main.n")
+        self.assertEqual(self.checked, ["lib.n", "main.n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
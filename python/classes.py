@@ -1,9 +1,12 @@
-from function import Function
+from function import Function, run_synchronously
+from frame import Frame
 
 
 class NConstructor(Function):
+    __slots__ = ("argument_cache",)
+
     def __init__(self, scope, args, body, public=False, argument_cache=None):
-        super().__init__(scope, args, None, body, public=public)
+        super().__init__(scope, args, None, body, public=public, uses_await=False)
         self.argument_cache = argument_cache or []
 
     async def run(self, arguments):
@@ -19,10 +22,67 @@ class NConstructor(Function):
 
         scope = self.scope.new_scope(parent_function=None)
         for value, (arg_pattern, _) in zip(arguments, self.arguments):
-            scope.assign_to_pattern(arg_pattern, value)
+            scope.bind_pattern(arg_pattern, value)
         await scope.eval_command(self.codeblock)
         class_instance = {}
         for prop_name, var in scope.variables.items():
             if var.public:
                 class_instance[prop_name] = var.value
         return class_instance
+
+    def run_sync(self, arguments):
+        return run_synchronously(self.run(arguments))
+
+
+class CompiledConstructor(NConstructor):
+    """
+    A class whose body was compiled by the closure engine. `public_slots` lists
+    the name and Frame index of each public variable of the class body, which
+    become the fields of the instance.
+    """
+
+    __slots__ = ("frame", "size", "bind_arguments", "compiled", "public_slots")
+
+    def __init__(
+        self,
+        frame,
+        args,
+        body,
+        size,
+        bind_arguments,
+        compiled,
+        public_slots,
+        public=False,
+        argument_cache=None,
+    ):
+        super().__init__(
+            frame.scope, args, body, public=public, argument_cache=argument_cache
+        )
+        self.frame = frame
+        self.size = size
+        self.bind_arguments = bind_arguments
+        self.compiled = compiled
+        self.public_slots = public_slots
+
+    async def run(self, arguments):
+        return self.run_sync(arguments)
+
+    def run_sync(self, arguments):
+        arguments = self.argument_cache + arguments
+        if len(arguments) < len(self.arguments):
+            return CompiledConstructor(
+                self.frame,
+                self.arguments,
+                self.codeblock,
+                self.size,
+                self.bind_arguments,
+                self.compiled,
+                self.public_slots,
+                self.public,
+                argument_cache=arguments,
+            )
+
+        frame = Frame(self.frame, self.size)
+        self.bind_arguments(frame, arguments)
+        self.compiled(frame)
+        return {name: frame.values[slot] for name, slot in self.public_slots}
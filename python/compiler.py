@@ -0,0 +1,2208 @@
+import math
+import operator
+import os
+
+import lark
+
+import scope as n_scope
+from variable import Variable
+from function import CompiledFunction, TailCall, pause_call, run_synchronously
+from native_function import NativeFunction
+from classes import CompiledConstructor
+from frame import Frame
+from type import NType, NModule
+from enums import EnumValue, EnumPattern
+from native_types import none, yes, NList
+from ncmd import Cmd
+from operation_types import assignment_types, assignment_expression_types
+from modules import libraries
+import transpiler
+import vm
+
+"""
+Compiles the parsed syntax tree of a type checked N file into a tree of Python
+closures, so that the interpreter only has to look at `tree.data` once per
+node rather than every time the node is evaluated.
+
+A compiled expression is a function that takes the Frame to evaluate in and
+returns the value. A compiled command returns an `(exit, value)` tuple, like
+`Scope.eval_command`.
+
+Variables declared inside functions, loops, and other blocks are resolved while
+compiling to an index in a Frame (see `Environment`), so they can be found
+without looking up their names. Top level variables are kept in the Scope of
+the file because other files and `n.py` look them up by name. Expressions that
+only involve literals are evaluated once before compiling (see
+`fold_constants`).
+
+Only the code blocks of functions that use the await operator need the event
+loop, so everything else is compiled to plain synchronous functions. In those
+code blocks, the parts that contain the await operator are compiled to async
+functions instead (see `compile_async_expr`).
+
+The engines that can be used to evaluate N files:
+
+- closure - Compile each file to closures before running it.
+- tree - Walk the syntax tree with `Scope.eval_expr` and `Scope.eval_command`.
+- vm - Compile each file to bytecode for a stack based virtual machine, using
+  closures for the rarer commands and expressions (see `vm.py`).
+- python - Transpile each file to a Python module, using closures for the top
+  level instructions it can't transpile (see `transpiler.py`).
+
+Set the N_ENGINE environment variable or use `n.py --engine` to pick one.
+"""
+
+engines = ["closure", "tree", "vm", "python"]
+engine = os.environ.get("N_ENGINE", "closure")
+
+
+def compile_program(tree, file=None):
+    """
+    Returns an `(instruction, command)` tuple for each top level instruction of
+    a parsed file, where `command` is an async function that takes a Scope and
+    runs the instruction with the selected engine. The python engine caches the
+    module it generates for the File, if given.
+    """
+    if tree.data != "start":
+        raise SyntaxError("Unable to compile a non-starting branch")
+    if engine == "tree":
+        names = n_scope.NameCache(tree)
+        return [(child, run_tree_command(child, names)) for child in tree.children]
+    fold_constants(tree)
+    if engine == "python":
+        commands = transpiler.load_commands(tree, file)
+        return [
+            (
+                child,
+                as_async(commands[index])
+                if index in commands
+                else run_top_level(compile_closure_command(child, None)),
+            )
+            for index, child in enumerate(tree.children)
+        ]
+    # The await operator can't be used outside of a function
+    return [
+        (child, run_top_level(compile_command(child, None))) for child in tree.children
+    ]
+
+
+def run_tree_command(child, names):
+    # The scopes made from the Scope of the file share its NameCache
+    def run_in_scope(scope):
+        scope.names = names
+        return scope.eval_command(child)
+
+    return run_in_scope
+
+
+def run_top_level(run):
+    async def run_in_scope(scope):
+        return run(Frame.top(scope))
+
+    return run_in_scope
+
+
+def as_async(evaluate):
+    async def evaluate_async(frame):
+        return evaluate(frame)
+
+    return evaluate_async
+
+
+class Environment:
+    """
+    The variables of a Frame while compiling, which are given an index in the
+    Frame in the order that they're declared. The type checker doesn't let
+    variables be used before they're declared, so names can be resolved as soon
+    as they're compiled.
+    """
+
+    def __init__(self, parent, kind="block"):
+        self.parent = parent
+        # Either "block", "function", "async function" for functions that use
+        # the await operator, or "class"
+        self.kind = kind
+        self.slots = {}
+        # The name and index of each public variable, in order, which become
+        # the fields of class instances
+        self.public = []
+
+    def declare(self, name, public=False):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.slots)
+            if public:
+                self.public.append((name, slot))
+        return slot
+
+    def resolve(self, name):
+        """
+        Returns how many Frames up the variable is and its index in that Frame,
+        or None if it's a top level or global variable.
+        """
+        depth = 0
+        env = self
+        while env is not None:
+            slot = env.slots.get(name)
+            if slot is not None:
+                return depth, slot
+            env = env.parent
+            depth += 1
+        return None
+
+
+def in_function(env):
+    """
+    Whether a return command compiled in the Environment returns from a
+    function that doesn't use the await operator.
+    """
+    while env is not None and env.kind == "block":
+        env = env.parent
+    return env is not None and env.kind == "function"
+
+
+# Commands that add variables to the scope that they're in
+declaring_commands = {
+    "declare",
+    "imp",
+    "enum_definition",
+    "alias_definition",
+    "class_definition",
+}
+
+
+def declares_variables(tree):
+    command = get_command(tree)
+    instructions = command.children if command.data == "code_block" else [tree]
+    return any(
+        get_command(instruction).data in declaring_commands
+        for instruction in instructions
+    )
+
+
+def has_names(pattern_and_src):
+    pattern, _ = pattern_and_src
+    if isinstance(pattern, dict):
+        return any(has_names(sub_pattern) for sub_pattern in pattern.values())
+    elif isinstance(pattern, (tuple, list)):
+        return any(has_names(sub_pattern) for sub_pattern in pattern)
+    elif isinstance(pattern, EnumPattern):
+        return any(has_names(sub_pattern) for sub_pattern in pattern.patterns)
+    return pattern is not None
+
+
+def get_block_environment(env, body=None, pattern=None):
+    """
+    Returns a new Environment for a block that the tree engine evaluates in a
+    new Scope. If the block doesn't declare any variables, it doesn't need its
+    own Frame, so the enclosing Environment is returned instead.
+    """
+    if (pattern is not None and has_names(pattern)) or (
+        body is not None and declares_variables(body)
+    ):
+        return Environment(env)
+    return env
+
+
+def get_frame_size(block_env, env):
+    """
+    The size of the Frame to create for a block, or None if the block uses the
+    enclosing Frame.
+    """
+    return None if block_env is env else len(block_env.slots)
+
+
+def contains_await(tree):
+    """
+    Whether evaluating the tree might use the await operator. Functions defined
+    inside the tree don't count because they're called separately.
+    """
+    if not isinstance(tree, lark.Tree) or tree.data == "function_def":
+        return False
+    if tree.data == "await_expression":
+        return True
+    return any(contains_await(child) for child in tree.children)
+
+
+def is_public(modifiers):
+    return any(modifier.type == "PUBLIC" for modifier in modifiers.children)
+
+
+def get_name_pattern(name_type):
+    # Types are removed at runtime, like `Scope.get_name_type` with
+    # get_type=False.
+    pattern = n_scope.get_destructure_pattern(name_type.children[0])
+    return pattern, "infer" if len(name_type.children) == 1 else "whatever"
+
+
+def is_spread(tree):
+    return isinstance(tree, lark.Tree) and tree.data == "spread"
+
+
+def is_default_value(value):
+    return (
+        isinstance(value, lark.Tree)
+        and len(value.children) == 1
+        and isinstance(value.children[0], lark.Token)
+        and value.children[0].type == "NAME"
+        and value.children[0].value == "_"
+    )
+
+
+def n_or(left, right):
+    if isinstance(left, int):
+        return left | right
+    if isinstance(left, bool):
+        return left or right
+    if left.variant == "yes":
+        return left.values[0]
+    else:
+        return right
+
+
+def n_and(left, right):
+    if isinstance(left, int):
+        return left & right
+    return left and right
+
+
+def n_divide(dividend, divisor):
+    if divisor == 0:
+        if isinstance(divisor, int):
+            # Division by zero for ints will safely return 0, like Elm.
+            return 0
+        # Conform with float standards for float division by zero.
+        if dividend == 0:
+            return float("nan")
+        # Distinguish between negative and positive zero
+        # https://stackoverflow.com/a/25338224
+        elif math.copysign(1, divisor) == -1:
+            return float("-inf")
+        else:
+            return float("inf")
+    if isinstance(divisor, int):
+        return math.floor(dividend / divisor)
+    return dividend / divisor
+
+
+def n_exponent(left, right):
+    return float(left ** right)
+
+
+def n_not(value):
+    if isinstance(value, bool):
+        return not value
+    elif isinstance(value, int):
+        return ~value
+    return value == none
+
+
+def n_in(left, right):
+    return left in right
+
+
+comparison_operations = {
+    "EQUALS": operator.eq,
+    "GORE": operator.ge,
+    "LORE": operator.le,
+    "LESS": operator.lt,
+    "GREATER": operator.gt,
+    "NEQUALS": operator.ne,
+}
+
+# Binary operations by their operator token type
+arithmetic_operations = {
+    "ADD": operator.add,
+    "SUBTRACT": operator.sub,
+    "MULTIPLY": operator.mul,
+    "DIVIDE": n_divide,
+    "MODULO": operator.mod,
+    "SHIFTL": operator.lshift,
+    "SHIFTR": operator.rshift,
+}
+
+unary_operations = {
+    "SUBTRACT": operator.neg,
+    "NOT": n_not,
+}
+
+
+def get_binary_operation(expr):
+    """
+    Returns the Python function for a binary operation tree.
+    """
+    if expr.data == "or_expression":
+        return n_or
+    elif expr.data == "and_expression":
+        return n_and
+    elif expr.data == "xor_expression":
+        return operator.xor
+    elif expr.data == "in_expression":
+        return n_in
+    elif expr.data == "exponent_expression":
+        return n_exponent
+    operation = arithmetic_operations.get(expr.children[1].type)
+    if operation is None:
+        raise SyntaxError(
+            "Unexpected operation for %s: %s" % (expr.data, expr.children[1])
+        )
+    return operation
+
+
+def get_comparison(expr):
+    comparison = expr.children[1].type
+    compare = comparison_operations.get(comparison)
+    if compare is None:
+        raise SyntaxError(
+            "Unexpected operation for compare_expression: %s" % comparison
+        )
+    return compare
+
+
+def get_unary_operation(expr):
+    operation = unary_operations.get(expr.children[0].type)
+    if operation is None:
+        raise SyntaxError(
+            "Unexpected operation for unary_expression: %s" % expr.children[0]
+        )
+    return operation
+
+
+def get_call_parts(expr):
+    """
+    Returns the function and arguments of a function call or pipe.
+    """
+    if expr.data == "function_callback":
+        function, *arguments = expr.children[0].children
+    else:
+        mainarg = expr.children[0]
+        function, *arguments = expr.children[1].children
+        arguments.append(mainarg)
+    return function, arguments
+
+
+def get_char(expr):
+    val = expr.children[0]
+    if isinstance(val, lark.Tree):
+        if val.data == "hex_pattern":
+            return chr(int(val.children[0].value, 16))
+        code = val.children[0].value
+        if code not in "ntrv0fb":
+            raise SyntaxError("Unexpected escape code: %s" % code)
+        return n_scope.escapes[code]
+    return val.value
+
+
+def get_impn_path(expr):
+    if expr.children[0].type == "STRING":
+        return n_scope.unescape(expr.children[0].value[1:-1])
+    else:
+        # Support old syntax
+        return expr.children[0].value + ".n"
+
+
+async def import_file(scope, expr, rel_file_path):
+    file_path = os.path.join(os.path.dirname(scope.file_path), rel_file_path)
+    scope.stack_trace.append((expr, scope.trace_file))
+    module = await n_scope.eval_file(
+        file_path,
+        scope.base_path,
+        scope.parent_imports + [os.path.normpath(scope.file_path)],
+        scope.modules,
+    )
+    n_scope.unit_test_results[rel_file_path] = module.unit_tests[:]
+    scope.stack_trace.pop()
+    return NModule(rel_file_path, module.public_values)
+
+
+def get_value_at(left, key):
+    try:
+        if isinstance(left, EnumValue):
+            left = left.values[0]
+        return yes(left[key])
+    except (IndexError, KeyError):
+        return none
+
+
+def get_record(spreads, non_spread):
+    # Explicit entries take precedence over spread ones
+    record = {}
+    for spread in spreads:
+        record.update(spread)
+    record.update(non_spread)
+    return record
+
+
+def get_alias_constructor(keys):
+    return lambda *args: dict(zip(keys, args))
+
+
+def get_assign_value_tree(command):
+    var, assign_operator, val = command.children
+    operator_type = assign_operator.children[0].type
+    if operator_type == "ASSIGN_EQUAL":
+        return val
+    # `a += b` is evaluated as `a = a + b`
+    return lark.Tree(
+        assignment_expression_types[operator_type],
+        [
+            lark.Tree("value", [var]),
+            lark.Token(assignment_types[operator_type], ""),
+            val,
+        ],
+    )
+
+
+def get_unit_test(command, passed):
+    return {
+        "hasPassed": passed,
+        "fileLine": command.line,
+        "unitTestType": "value",
+        "possibleTypes": none,
+    }
+
+
+# The value of a tree that isn't known until the program runs
+not_constant = object()
+
+# Expressions whose value can be worked out before running the program if
+# their operands can be
+foldable_binary_expressions = {
+    "or_expression",
+    "and_expression",
+    "xor_expression",
+    "sum_expression",
+    "product_expression",
+    "exponent_expression",
+}
+
+# Folding shouldn't make the compiled program hold on to huge values that it
+# might never need, like `1 << 100000000`
+max_folded_size = 4096
+
+
+def get_constant(expr):
+    if isinstance(expr, lark.Token):
+        if expr.type == "NAME":
+            return not_constant
+        return n_scope.get_literal_value(expr)
+    return getattr(expr.meta, "constant", not_constant)
+
+
+def is_foldable_value(value):
+    if isinstance(value, (bool, float)) or value == ():
+        return True
+    if isinstance(value, int):
+        return value.bit_length() <= max_folded_size
+    if isinstance(value, str):
+        return len(value) <= max_folded_size
+    return False
+
+
+def fits_folded_size(expr, left, right):
+    """
+    Returns whether the result of a binary operation on two folded operands
+    can be small enough to fold. This is checked before the operation runs,
+    so values like `1 << 4000000000` are never worked out at compile time.
+    """
+    if not isinstance(left, int) or not isinstance(right, int):
+        return True
+    if expr.data == "exponent_expression":
+        return right <= 0 or left.bit_length() * right <= max_folded_size
+    if expr.children[1].type == "SHIFTL":
+        return right <= 0 or left.bit_length() + right <= max_folded_size
+    return True
+
+
+def fold_expression(expr):
+    """
+    Returns the value of an expression whose operands have been folded, or
+    `not_constant`.
+    """
+    if expr.data == "value":
+        return get_constant(expr.children[0])
+    elif expr.data == "char":
+        return get_char(expr)
+    elif expr.data in foldable_binary_expressions:
+        left, _, right = expr.children
+        left, right = get_constant(left), get_constant(right)
+        if left is not_constant or right is not_constant:
+            return not_constant
+        if expr.data == "or_expression" and not isinstance(left, (int, bool)):
+            # `or` also works on maybe values, which aren't folded
+            return not_constant
+        if not fits_folded_size(expr, left, right):
+            return not_constant
+        return get_binary_operation(expr)(left, right)
+    elif expr.data == "compare_expression":
+        left, _, right = expr.children
+        right = get_constant(right)
+        if isinstance(left, lark.Tree) and left.data == "compare_expression":
+            if get_constant(left) is not_constant:
+                return not_constant
+            chain, left = get_constant(left), get_constant(left.children[2])
+            if not chain:
+                return False
+        else:
+            left = get_constant(left)
+        if left is not_constant or right is not_constant:
+            return not_constant
+        return get_comparison(expr)(left, right)
+    elif expr.data == "unary_expression":
+        value = get_constant(expr.children[1])
+        if value is not_constant:
+            return not_constant
+        return get_unary_operation(expr)(value)
+    elif expr.data == "not_expression":
+        value = get_constant(expr.children[1])
+        if value is not_constant:
+            return not_constant
+        return not value
+    elif expr.data == "tupleval":
+        values = tuple(get_constant(item) for item in expr.children)
+        if not_constant in values:
+            return not_constant
+        return values
+    return not_constant
+
+
+def fold_constants(tree):
+    """
+    Works out the values of expressions that only involve literals, such as
+    `1 << 4` or `"a" + "b"`, once after type checking rather than every time
+    they're evaluated. The value is stored in `tree.meta.constant`, which the
+    compilers use instead of compiling the expression.
+    """
+    # Subtrees are iterated over before the trees that contain them
+    for subtree in tree.iter_subtrees():
+        try:
+            value = fold_expression(subtree)
+        except (ArithmeticError, ValueError, TypeError, MemoryError):
+            # Leave the error for when the program runs, if it gets there
+            continue
+        if value is not not_constant and (
+            is_foldable_value(value)
+            or isinstance(value, tuple)
+            and all(is_foldable_value(item) for item in value)
+        ):
+            subtree.meta.constant = value
+
+
+def compile_constant(value):
+    return lambda frame: value
+
+
+def compile_name(name, env):
+    location = env.resolve(name) if env is not None else None
+    if location is None:
+        return lambda frame: frame.scope.get_variable(name).value
+    depth, slot = location
+    if depth == 0:
+        return lambda frame: frame.values[slot]
+    if depth == 1:
+        return lambda frame: frame.parent.values[slot]
+    if depth == 2:
+        return lambda frame: frame.parent.parent.values[slot]
+
+    def get_value(frame):
+        for _ in range(depth):
+            frame = frame.parent
+        return frame.values[slot]
+
+    return get_value
+
+
+def compile_token(token, env):
+    if token.type == "NAME":
+        return compile_name(token.value, env)
+    # The other tokens are literals, so their value can be worked out now
+    return compile_constant(n_scope.get_literal_value(token))
+
+
+def compile_expr(expr, env):
+    if isinstance(expr, lark.Token):
+        return compile_token(expr, env)
+    value = getattr(expr.meta, "constant", not_constant)
+    if value is not not_constant:
+        return compile_constant(value)
+    compile_function = expression_compilers.get(expr.data)
+    if compile_function is None:
+        raise SyntaxError("Unexpected command/expression type %s" % expr.data)
+    return compile_function(expr, env)
+
+
+def compile_store(name, env, public=False):
+    """
+    Returns a function that takes a Frame and the Variable to declare as `name`.
+    Top level Variables are added to the Scope, while the values of other
+    Variables are put in the Frame.
+    """
+    if env is None:
+
+        def store_variable(frame, variable):
+            frame.scope.variables[name] = variable
+
+        return store_variable
+    slot = env.declare(name, public)
+
+    def store_value(frame, variable):
+        frame.values[slot] = variable.value
+
+    return store_value
+
+
+def compile_binder(pattern_and_src, env, public=False):
+    """
+    Compiles a destructuring pattern to a function that takes a Frame and a
+    value, assigns the variables in the pattern, and returns whether the value
+    matches the pattern, like `Scope.bind_pattern` at runtime.
+    """
+    pattern, _ = pattern_and_src
+    if isinstance(pattern, dict):
+        entries = [
+            (key, compile_binder(sub_pattern, env, public))
+            for key, sub_pattern in pattern.items()
+        ]
+
+        def bind_record(frame, value):
+            if not isinstance(value, dict):
+                raise TypeError("Destructuring non-record as record.")
+            for key, bind in entries:
+                entry = value.get(key)
+                if entry is None:
+                    raise TypeError("Given record doesn't have a key %s." % key)
+                if not bind(frame, entry):
+                    return False
+            return True
+
+        return bind_record
+    elif isinstance(pattern, tuple):
+        binders = [compile_binder(sub_pattern, env, public) for sub_pattern in pattern]
+
+        def bind_tuple(frame, value):
+            if not isinstance(value, tuple):
+                raise TypeError("Destructuring non-record as record.")
+            if len(binders) != len(value):
+                raise TypeError(
+                    "Number of destructured values from tuple doesn't match tuple length."
+                )
+            for bind, item in zip(binders, value):
+                if not bind(frame, item):
+                    return False
+            return True
+
+        return bind_tuple
+    elif isinstance(pattern, EnumPattern):
+        variant = pattern.variant
+        binders = [
+            compile_binder(sub_pattern, env, public) for sub_pattern in pattern.patterns
+        ]
+
+        def bind_enum(frame, value):
+            if not isinstance(value, EnumValue):
+                raise TypeError("Destructuring non-enum as enum.")
+            elif variant != value.variant:
+                return False
+            for bind, item in zip(binders, value.values):
+                if not bind(frame, item):
+                    return False
+            return True
+
+        return bind_enum
+    elif isinstance(pattern, list):
+        binders = [compile_binder(sub_pattern, env, public) for sub_pattern in pattern]
+
+        def bind_list(frame, value):
+            if not isinstance(value, (list, NList)):
+                raise TypeError("Destructuring non-list as list.")
+            if len(value) != len(binders):
+                return False
+            for bind, item in zip(binders, value):
+                if not bind(frame, item):
+                    return False
+            return True
+
+        return bind_list
+    elif pattern is None:
+        return lambda frame, value: True
+
+    name = pattern
+    if env is None:
+
+        def bind_variable(frame, value):
+            frame.scope.variables[name] = Variable(value, value, public)
+            return True
+
+        return bind_variable
+    slot = env.declare(name, public)
+
+    def bind_value(frame, value):
+        frame.values[slot] = value
+        return True
+
+    return bind_value
+
+
+def get_name_slot(pattern, env, public=False):
+    """
+    Declares a pattern that is just a name, like `let x`, and returns its slot,
+    so the value can be stored without a binder. Returns None for any other
+    pattern or at the top level.
+    """
+    if env is None or not isinstance(pattern[0], str):
+        return None
+    return env.declare(pattern[0], public)
+
+
+def compile_argument_binder(arguments, env):
+    """
+    Returns a function that takes the Frame of a function call and the
+    arguments, and assigns them to the argument patterns.
+    """
+    binders = [compile_binder(pattern, env) for pattern, _ in arguments]
+    if all(
+        isinstance(pattern, str) and env.slots.get(pattern) == i
+        for i, ((pattern, _), _) in enumerate(arguments)
+    ):
+        # The arguments are plain names, so they go in the first slots
+        count = len(arguments)
+
+        def bind_names(frame, values):
+            frame.values[:count] = values[:count]
+
+        return bind_names
+
+    def bind_arguments(frame, values):
+        for bind, value in zip(binders, values):
+            bind(frame, value)
+
+    return bind_arguments
+
+
+def compile_condition(condition, env, branch_env):
+    """
+    Returns a function that takes the enclosing Frame and the Frame for the
+    branch and returns whether the condition is met. Conditional lets assign
+    their variables to the Frame for the branch.
+    """
+    if condition.data == "conditional_let":
+        pattern_tree, value = condition.children
+        evaluate_value = compile_expr(value, env)
+        bind = compile_binder(n_scope.get_destructure_pattern(pattern_tree), branch_env)
+
+        def evaluate_let(frame, branch_frame):
+            return bind(branch_frame, evaluate_value(frame))
+
+        return evaluate_let
+    evaluate_condition = compile_expr(condition, env)
+    return lambda frame, branch_frame: evaluate_condition(frame)
+
+
+def get_condition_pattern(condition):
+    if condition.data == "conditional_let":
+        return n_scope.get_destructure_pattern(condition.children[0])
+    return None
+
+
+def compile_ifelse_expr(expr, env):
+    condition, if_true, if_false = expr.children
+    if condition.data == "conditional_let":
+        branch_env = get_block_environment(
+            env, pattern=get_condition_pattern(condition)
+        )
+        evaluate_let = compile_condition(condition, env, branch_env)
+        # Like the tree engine, both branches are evaluated in the new scope
+        evaluate_if_true = compile_expr(if_true, branch_env)
+        evaluate_if_false = compile_expr(if_false, branch_env)
+        size = get_frame_size(branch_env, env)
+
+        def evaluate_branch(frame):
+            branch_frame = frame if size is None else Frame(frame, size)
+            if evaluate_let(frame, branch_frame):
+                return evaluate_if_true(branch_frame)
+            else:
+                return evaluate_if_false(branch_frame)
+
+        return evaluate_branch
+    evaluate_condition = compile_expr(condition, env)
+    evaluate_if_true = compile_expr(if_true, env)
+    evaluate_if_false = compile_expr(if_false, env)
+
+    def evaluate(frame):
+        if evaluate_condition(frame):
+            return evaluate_if_true(frame)
+        else:
+            return evaluate_if_false(frame)
+
+    return evaluate
+
+
+def get_function_parts(expr):
+    if len(expr.children) == 3:
+        arguments, returntype, codeblock = expr.children
+    else:
+        arguments, codeblock = expr.children
+        returntype = lark.Token("UNIT", "()")
+    arguments = arguments.children
+    # Remove generic declarations
+    if (
+        len(arguments) >= 1
+        and isinstance(arguments[0], lark.Tree)
+        and arguments[0].data == "generic_declaration"
+    ):
+        arguments = arguments[1:]
+    return [get_name_pattern(arg) for arg in arguments], returntype, codeblock
+
+
+def function_uses_await(expr):
+    """
+    Whether a function definition uses the await operator, which the type
+    checker sets on the tree. Imported files whose interface was cached aren't
+    type checked, so their code blocks are searched for the operator instead.
+    """
+    uses_await = getattr(expr.meta, "uses_await", None)
+    if uses_await is None:
+        uses_await = contains_await(expr.children[-1])
+        expr.meta.uses_await = uses_await
+    return uses_await
+
+
+def compile_function_def(expr, env):
+    arguments, returntype, codeblock = get_function_parts(expr)
+    uses_await = function_uses_await(expr)
+    function_env = Environment(env, "async function" if uses_await else "function")
+    bind_arguments = compile_argument_binder(arguments, function_env)
+    if uses_await:
+        compiled = compile_async_command(codeblock, function_env)
+    else:
+        compiled = compile_command(codeblock, function_env)
+    size = len(function_env.slots)
+
+    def evaluate(frame):
+        return CompiledFunction(
+            frame,
+            arguments,
+            returntype,
+            codeblock,
+            size,
+            bind_arguments,
+            compiled,
+            uses_await=uses_await,
+        )
+
+    return evaluate
+
+
+def compile_arguments(arguments, env):
+    """
+    Returns a function that takes a Frame and returns the values of the
+    arguments of a function call.
+    """
+    evaluate_args = [
+        (True, compile_expr(arg.children[0], env))
+        if is_spread(arg)
+        else (False, compile_expr(arg, env))
+        for arg in arguments
+    ]
+
+    if any(spread for spread, _ in evaluate_args):
+
+        def get_arg_values(frame):
+            arg_values = []
+            for spread, evaluate_arg in evaluate_args:
+                if spread:
+                    arg_values.extend(list(evaluate_arg(frame)))
+                else:
+                    arg_values.append(evaluate_arg(frame))
+            return arg_values if len(arg_values) > 0 else [()]
+
+    elif len(evaluate_args) > 0:
+        evaluate_args = [evaluate_arg for _, evaluate_arg in evaluate_args]
+
+        def get_arg_values(frame):
+            return [evaluate_arg(frame) for evaluate_arg in evaluate_args]
+
+    else:
+
+        def get_arg_values(frame):
+            return [()]
+
+    return get_arg_values
+
+
+def compile_function_callback(expr, env):
+    function, arguments = get_call_parts(expr)
+    evaluate_function = compile_expr(function, env)
+    get_arg_values = compile_arguments(arguments, env)
+
+    def evaluate(frame):
+        arg_values = get_arg_values(frame)
+        func = evaluate_function(frame)
+        scope = frame.scope
+        scope.stack_trace.append((expr, scope.trace_file))
+        out = func.run_sync(arg_values)
+        scope.stack_trace.pop()
+        return out
+
+    return evaluate
+
+
+def compile_tail_call(expr, env):
+    """
+    Compiles a function call returned by a function. Rather than calling the
+    function, the return command returns a TailCall, and
+    `CompiledFunction.run_sync` makes the call in a loop, so recursion doesn't
+    use up Python's stack.
+    """
+    function, arguments = get_call_parts(expr)
+    evaluate_function = compile_expr(function, env)
+    get_arg_values = compile_arguments(arguments, env)
+
+    def run(frame):
+        arg_values = get_arg_values(frame)
+        return (True, TailCall(evaluate_function(frame), arg_values, expr, frame.scope))
+
+    return run
+
+
+def compile_binary(expr, env):
+    operation = get_binary_operation(expr)
+    left, _, right = expr.children
+    evaluate_left = compile_expr(left, env)
+    evaluate_right = compile_expr(right, env)
+    return lambda frame: operation(evaluate_left(frame), evaluate_right(frame))
+
+
+def compile_not_expression(expr, env):
+    _, value = expr.children
+    evaluate_value = compile_expr(value, env)
+    return lambda frame: not evaluate_value(frame)
+
+
+def compile_compare_expression(expr, env):
+    # compare_expression chains leftwards, so for `1 = 2 = 3`, `1 = 2` also
+    # needs to be true, and `2` is compared with `3`.
+    compare = get_comparison(expr)
+    left, _, right = expr.children
+    evaluate_right = compile_expr(right, env)
+    if isinstance(left, lark.Tree) and left.data == "compare_expression":
+        evaluate_chain = compile_expr(left, env)
+        evaluate_left = compile_expr(left.children[2], env)
+
+        def evaluate_chained(frame):
+            if not evaluate_chain(frame):
+                return False
+            return compare(evaluate_left(frame), evaluate_right(frame))
+
+        return evaluate_chained
+    evaluate_left = compile_expr(left, env)
+    return lambda frame: compare(evaluate_left(frame), evaluate_right(frame))
+
+
+def compile_unary_expression(expr, env):
+    operation = get_unary_operation(expr)
+    evaluate_value = compile_expr(expr.children[1], env)
+    return lambda frame: operation(evaluate_value(frame))
+
+
+def compile_value_access(expr, env):
+    left, _, right = expr.children
+    evaluate_left = compile_expr(left, env)
+    evaluate_right = compile_expr(right, env)
+
+    def evaluate(frame):
+        eval_left = evaluate_left(frame)
+        if isinstance(eval_left, EnumValue) and eval_left == none:
+            return none
+        return get_value_at(eval_left, evaluate_right(frame))
+
+    return evaluate
+
+
+def compile_char(expr, env):
+    return compile_constant(get_char(expr))
+
+
+def compile_value(expr, env):
+    return compile_expr(expr.children[0], env)
+
+
+def compile_impn(expr, env):
+    rel_file_path = get_impn_path(expr)
+    # Imported files are evaluated at the top level, so they never wait on
+    # the event loop.
+    return lambda frame: run_synchronously(
+        import_file(frame.scope, expr, rel_file_path)
+    )
+
+
+def compile_record_access(expr, env):
+    evaluate_value = compile_expr(expr.children[0], env)
+    field = expr.children[1].value
+
+    def evaluate(frame):
+        dict_value = evaluate_value(frame)
+        if not isinstance(dict_value, dict):
+            internal_traits = frame.scope.get_value_internal_traits(dict_value)
+            return internal_traits[field].run_sync([dict_value])
+        return dict_value[field]
+
+    return evaluate
+
+
+def compile_tupleval(expr, env):
+    evaluate_items = [compile_expr(item, env) for item in expr.children]
+    return lambda frame: tuple(
+        [evaluate_item(frame) for evaluate_item in evaluate_items]
+    )
+
+
+def compile_listval(expr, env):
+    evaluate_items = [
+        (True, compile_expr(item.children[0], env))
+        if is_spread(item)
+        else (False, compile_expr(item, env))
+        for item in expr.children
+    ]
+
+    def evaluate(frame):
+        values = []
+        for spread, evaluate_item in evaluate_items:
+            if spread:
+                values.extend(evaluate_item(frame))
+            else:
+                values.append(evaluate_item(frame))
+        return values
+
+    if len(evaluate_items) > 0 and evaluate_items[0][0]:
+        # Add to the end of the first spread list without copying it
+        _, evaluate_first = evaluate_items.pop(0)
+        evaluate_rest = evaluate
+
+        def evaluate(frame):
+            first = evaluate_first(frame)
+            return NList.of(first).extended(evaluate_rest(frame))
+
+    return evaluate
+
+
+def compile_record_entries(expr, compile_function, env):
+    """
+    Returns a `(key, evaluate)` tuple for each record entry, where the key is
+    None for spreads.
+    """
+    evaluate_entries = []
+    for entry in expr.children:
+        if isinstance(entry, lark.Token):
+            evaluate_entries.append((entry.value, compile_function(entry, env)))
+        elif entry.data == "spread":
+            evaluate_entries.append((None, compile_function(entry.children[0], env)))
+        else:
+            key, value = entry.children
+            evaluate_entries.append((key.value, compile_function(value, env)))
+    return evaluate_entries
+
+
+def compile_recordval(expr, env):
+    evaluate_entries = compile_record_entries(expr, compile_expr, env)
+
+    def evaluate(frame):
+        spreads = []
+        non_spread = {}
+        for key, evaluate_entry in evaluate_entries:
+            if key is None:
+                spreads.append(evaluate_entry(frame))
+            else:
+                non_spread[key] = evaluate_entry(frame)
+        return get_record(spreads, non_spread)
+
+    return evaluate
+
+
+def compile_match_arms(match_block, compile_function, env):
+    """
+    Returns an `(is default, bind pattern or evaluate value, evaluate output,
+    Frame size, key)` tuple for each arm of a match expression. The Frame size
+    is None if the arm doesn't need its own Frame. The key is the constant or
+    enum variant that the arm matches, None if the arm matches anything, or
+    `not_constant` if it isn't known before running the program.
+    """
+    arms = []
+    for match in match_block.children:
+        i, o = match.children
+        if match_block.data == "match_block":
+            if is_default_value(i):
+                arms.append((True, None, compile_function(o, env), None, None))
+            else:
+                arms.append(
+                    (
+                        False,
+                        compile_function(i, env),
+                        compile_function(o, env),
+                        None,
+                        get_constant(i),
+                    )
+                )
+        elif isinstance(i, lark.Token) and i.value == "_":
+            arms.append((True, None, compile_function(o, env), None, None))
+        else:
+            pattern = n_scope.get_destructure_pattern(i)
+            arm_env = get_block_environment(env, pattern=pattern)
+            bind = compile_binder(pattern, arm_env)
+            evaluate_output = compile_function(o, arm_env)
+            if isinstance(pattern[0], EnumPattern):
+                key = pattern[0].variant
+            elif isinstance(pattern[0], str):
+                key = None
+            else:
+                key = not_constant
+            arms.append(
+                (False, bind, evaluate_output, get_frame_size(arm_env, env), key)
+            )
+    return arms
+
+
+def is_hashable_constant(value):
+    # NaN isn't equal to itself, so it can't be looked up
+    return isinstance(value, (bool, int, float, str, tuple)) and value == value
+
+
+def get_jump_table(arms, by_value):
+    """
+    Groups the arms of a match expression by the constant or enum variant that
+    they match, so that the arms to try can be found with one dictionary
+    lookup. Returns a `(table, fallback, defaults)` tuple, where `fallback` has
+    the arms to try for keys that aren't in the table. Returns None if the arms
+    have to be tried in order, such as when a default arm comes before other
+    arms, because default arms are evaluated as soon as they're reached.
+    """
+    table = {}
+    fallback = []
+    defaults = []
+    for is_default, test, evaluate_output, size, key in arms:
+        if is_default:
+            defaults.append(evaluate_output)
+            continue
+        if defaults or key is not_constant:
+            return None
+        # Values are compared with `==` rather than bound to a pattern
+        arm = (None if by_value else test, evaluate_output, size)
+        if key is None:
+            # The arm matches anything, so it's tried for every key
+            fallback.append(arm)
+            for table_arms in table.values():
+                table_arms.append(arm)
+        elif by_value and not is_hashable_constant(key):
+            return None
+        else:
+            if key not in table:
+                table[key] = fallback[:]
+            table[key].append(arm)
+    if len(table) == 0:
+        return None
+    return table, fallback, defaults
+
+
+def compile_match(expr, env):
+    input_value, match_block = expr.children
+    evaluate_input = compile_expr(input_value, env)
+    arms = compile_match_arms(match_block, compile_expr, env)
+    by_value = match_block.data == "match_block"
+
+    def match_values(frame, inp):
+        default = None
+        for is_default, evaluate_value, evaluate_output, _, _ in arms:
+            if is_default:
+                default = evaluate_output(frame)
+            elif inp == evaluate_value(frame):
+                return evaluate_output(frame)
+        return default
+
+    def match_patterns(frame, inp):
+        default = None
+        for is_default, bind, evaluate_output, size, _ in arms:
+            if is_default:
+                default = evaluate_output(frame)
+                continue
+            arm_frame = frame if size is None else Frame(frame, size)
+            if bind(arm_frame, inp):
+                return evaluate_output(arm_frame)
+        return default
+
+    match_in_order = match_values if by_value else match_patterns
+    jump_table = get_jump_table(arms, by_value)
+    if jump_table is None:
+        return lambda frame: match_in_order(frame, evaluate_input(frame))
+    table, fallback, defaults = jump_table
+
+    def evaluate_jump(frame):
+        inp = evaluate_input(frame)
+        if by_value:
+            try:
+                table_arms = table.get(inp, fallback)
+            except TypeError:
+                # Unhashable values like lists
+                return match_in_order(frame, inp)
+        elif isinstance(inp, EnumValue):
+            table_arms = table.get(inp.variant, fallback)
+        else:
+            return match_in_order(frame, inp)
+        for bind, evaluate_output, size in table_arms:
+            if bind is None:
+                return evaluate_output(frame)
+            arm_frame = frame if size is None else Frame(frame, size)
+            if bind(arm_frame, inp):
+                return evaluate_output(arm_frame)
+        default = None
+        for evaluate_default in defaults:
+            default = evaluate_default(frame)
+        return default
+
+    return evaluate_jump
+
+
+expression_compilers = {
+    "ifelse_expr": compile_ifelse_expr,
+    "function_def": compile_function_def,
+    "function_callback": compile_function_callback,
+    "function_callback_pipe": compile_function_callback,
+    "or_expression": compile_binary,
+    "and_expression": compile_binary,
+    "xor_expression": compile_binary,
+    "not_expression": compile_not_expression,
+    "in_expression": compile_binary,
+    "compare_expression": compile_compare_expression,
+    "sum_expression": compile_binary,
+    "product_expression": compile_binary,
+    "exponent_expression": compile_binary,
+    "unary_expression": compile_unary_expression,
+    "value_access": compile_value_access,
+    "char": compile_char,
+    "value": compile_value,
+    "impn": compile_impn,
+    "record_access": compile_record_access,
+    "tupleval": compile_tupleval,
+    "listval": compile_listval,
+    "recordval": compile_recordval,
+    "match": compile_match,
+}
+
+
+def get_command(tree):
+    if tree.data == "main_instruction" or tree.data == "last_instruction":
+        tree = tree.children[0]
+    if tree.data == "code_block" or tree.data in ("if", "ifelse", "for", "while"):
+        return tree
+    if tree.data == "instruction":
+        return tree.children[0]
+    raise SyntaxError("Command %s not implemented" % (tree.data))
+
+
+def compile_command(tree, env):
+    if engine == "vm":
+        return vm.compile_command(tree, env)
+    return compile_closure_command(tree, env)
+
+
+def compile_closure_command(tree, env):
+    command = get_command(tree)
+    compile_function = command_compilers.get(command.data)
+    if compile_function is not None:
+        return compile_function(command, env)
+
+    # The command is an expression whose value is discarded
+    evaluate_expr = compile_expr(command, env)
+
+    def run_expression(frame):
+        evaluate_expr(frame)
+        return (False, None)
+
+    return run_expression
+
+
+def compile_code_block(tree, env):
+    commands = [compile_command(instruction, env) for instruction in tree.children]
+
+    def run(frame):
+        for command in commands:
+            exit, value = command(frame)
+            if exit:
+                return exit, value
+        return (False, None)
+
+    return run
+
+
+def compile_imp(command, env):
+    import_name = command.children[0].value
+    store = compile_store(import_name, env)
+
+    def run(frame):
+        scope = frame.scope
+        lib = libraries["libraries." + import_name]
+        scopes = []
+        try:
+            scopes = lib._pass_scope()
+        except AttributeError:
+            pass
+        store(
+            frame,
+            Variable(
+                None,
+                NModule(
+                    import_name,
+                    {
+                        key: NativeFunction.from_imported(
+                            scope, types, getattr(lib, key), key in scopes
+                        )
+                        for key, types in lib._values().items()
+                    },
+                ),
+            ),
+        )
+        try:
+            lib._prepare(scope)
+        except AttributeError:
+            pass
+        return (False, None)
+
+    return run
+
+
+def compile_for(command, env):
+    var, iterable, code = command.children
+    pattern, _ = get_name_pattern(var)
+    evaluate_iterable = compile_expr(iterable, env)
+    loop_env = get_block_environment(env, code, pattern)
+    slot = get_name_slot(pattern, loop_env)
+    bind = compile_binder(pattern, loop_env) if slot is None else None
+    run_code = compile_command(code, loop_env)
+    size = get_frame_size(loop_env, env)
+
+    def run(frame):
+        for i in evaluate_iterable(frame):
+            loop_frame = frame if size is None else Frame(frame, size)
+            if slot is None:
+                bind(loop_frame, i)
+            else:
+                loop_frame.values[slot] = i
+            exit, value = run_code(loop_frame)
+            if exit == "continue":
+                continue
+            if exit == "break":
+                return False, None
+            if exit:
+                return True, value
+        return (False, None)
+
+    return run
+
+
+def compile_while(command, env):
+    condition, code = command.children
+    evaluate_condition = compile_expr(condition, env)
+    loop_env = get_block_environment(env, code)
+    run_code = compile_command(code, loop_env)
+    size = get_frame_size(loop_env, env)
+
+    def run(frame):
+        while evaluate_condition(frame):
+            exit, value = run_code(frame if size is None else Frame(frame, size))
+            if exit == "continue":
+                continue
+            if exit == "break":
+                return False, None
+            if exit:
+                return True, value
+        return (False, None)
+
+    return run
+
+
+def get_tail_call(value):
+    while (
+        isinstance(value, lark.Tree)
+        and value.data == "value"
+        and isinstance(value.children[0], lark.Tree)
+    ):
+        value = value.children[0]
+    if isinstance(value, lark.Tree) and value.data in (
+        "function_callback",
+        "function_callback_pipe",
+    ):
+        return value
+    return None
+
+
+def compile_return(command, env):
+    tail_call = get_tail_call(command.children[0])
+    if tail_call is not None and in_function(env):
+        return compile_tail_call(tail_call, env)
+    evaluate_value = compile_expr(command.children[0], env)
+    return lambda frame: (True, evaluate_value(frame))
+
+
+def compile_exit(exit):
+    return lambda frame: (exit, None)
+
+
+def compile_declare(command, env):
+    modifiers, name_type, value = command.children
+    pattern, _ = get_name_pattern(name_type)
+    # The value is compiled first because it can't use the declared variables
+    evaluate_value = compile_expr(value, env)
+    slot = get_name_slot(pattern, env, is_public(modifiers))
+    if slot is not None:
+
+        def store(frame):
+            frame.values[slot] = evaluate_value(frame)
+            return (False, None)
+
+        return store
+    bind = compile_binder(pattern, env, is_public(modifiers))
+
+    def run(frame):
+        bind(frame, evaluate_value(frame))
+        return (False, None)
+
+    return run
+
+
+def compile_if(command, env):
+    condition, body = command.children
+    branch_env = get_block_environment(env, body, get_condition_pattern(condition))
+    evaluate_condition = compile_condition(condition, env, branch_env)
+    run_body = compile_command(body, branch_env)
+    size = get_frame_size(branch_env, env)
+
+    def run(frame):
+        branch_frame = frame if size is None else Frame(frame, size)
+        if evaluate_condition(frame, branch_frame):
+            exit, value = run_body(branch_frame)
+            if exit:
+                return (exit, value)
+        return (False, None)
+
+    return run
+
+
+def compile_ifelse(command, env):
+    condition, if_true, if_false = command.children
+    true_env = get_block_environment(env, if_true, get_condition_pattern(condition))
+    false_env = get_block_environment(env, if_false)
+    evaluate_condition = compile_condition(condition, env, true_env)
+    run_if_true = compile_command(if_true, true_env)
+    run_if_false = compile_command(if_false, false_env)
+    true_size = get_frame_size(true_env, env)
+    false_size = get_frame_size(false_env, env)
+
+    def run(frame):
+        branch_frame = frame if true_size is None else Frame(frame, true_size)
+        if evaluate_condition(frame, branch_frame):
+            exit, value = run_if_true(branch_frame)
+        else:
+            exit, value = run_if_false(
+                frame if false_size is None else Frame(frame, false_size)
+            )
+        if exit:
+            return (exit, value)
+        return (False, None)
+
+    return run
+
+
+def compile_enum_definition(command, env):
+    _, type_def, constructors = command.children
+    type_name, *_ = type_def.children
+    variants = []
+    for constructor in constructors.children:
+        modifiers, constructor_name, *types = constructor.children
+        public = is_public(modifiers)
+        variants.append(
+            (
+                constructor_name,
+                types,
+                public,
+                compile_store(constructor_name.value, env, public),
+            )
+        )
+
+    def run(frame):
+        scope = frame.scope
+        enum_type = NType(type_name.value)
+        if env is None:
+            scope.types[type_name.value] = enum_type
+        for constructor_name, types, public, store in variants:
+            if len(types) >= 1:
+                store(
+                    frame,
+                    NativeFunction(
+                        scope,
+                        [("idk", arg_type) for arg_type in types],
+                        enum_type,
+                        EnumValue.construct(constructor_name),
+                        public=public,
+                    ),
+                )
+            else:
+                store(
+                    frame,
+                    Variable(enum_type, EnumValue(constructor_name), public=public),
+                )
+        return (False, None)
+
+    return run
+
+
+def compile_alias_definition(command, env):
+    modifiers, alias_def, alias_raw_type = command.children
+    alias_name, *_ = alias_def.children
+    public = is_public(modifiers)
+    if not (
+        isinstance(alias_raw_type, lark.Tree) and alias_raw_type.data == "recorddef"
+    ):
+        return compile_exit(False)
+    keys = [entry.children[0].value for entry in alias_raw_type.children]
+    store = compile_store(alias_name.value, env, public)
+
+    def run(frame):
+        if env is None and alias_name.value in frame.scope.variables:
+            return (False, None)
+        store(
+            frame,
+            NativeFunction(
+                frame.scope,
+                [("idk", "whatever")] * len(keys),
+                "The alias return value, but types are removed at runtime",
+                get_alias_constructor(keys),
+                public=public,
+            ),
+        )
+        return (False, None)
+
+    return run
+
+
+def compile_class_definition(command, env):
+    modifiers, name, class_args, class_body = command.children
+    public = is_public(modifiers)
+    arguments = [get_name_pattern(arg) for arg in class_args.children]
+    store = compile_store(name.value, env, public)
+    class_env = Environment(env, "class")
+    bind_arguments = compile_argument_binder(arguments, class_env)
+    # Class bodies can't use the await operator
+    compiled = compile_command(class_body, class_env)
+    size = len(class_env.slots)
+
+    def run(frame):
+        store(
+            frame,
+            CompiledConstructor(
+                frame,
+                arguments,
+                class_body,
+                size,
+                bind_arguments,
+                compiled,
+                class_env.public,
+                public,
+            ),
+        )
+        return (False, None)
+
+    return run
+
+
+def compile_assert(command, env):
+    assert_type = command.children[0].children[0]
+    if assert_type.data != "assert_val":
+        # Type assertions are only checked by the type checker
+        return compile_exit(False)
+    evaluate_value = compile_expr(assert_type.children[0], env)
+
+    def run(frame):
+        frame.scope.unit_tests.append(get_unit_test(command, evaluate_value(frame)))
+        return (False, None)
+
+    return run
+
+
+def compile_assignment(name, env):
+    """
+    Returns a function that takes a Frame and a new value for the variable.
+    """
+    location = env.resolve(name) if env is not None else None
+    if location is None:
+
+        def set_variable(frame, value):
+            frame.scope.get_variable(name).value = value
+
+        return set_variable
+    depth, slot = location
+
+    def set_value(frame, value):
+        for _ in range(depth):
+            frame = frame.parent
+        frame.values[slot] = value
+
+    return set_value
+
+
+def compile_assign_value(command, env):
+    evaluate_value = compile_expr(get_assign_value_tree(command), env)
+    assign = compile_assignment(command.children[0].value, env)
+
+    def run(frame):
+        assign(frame, evaluate_value(frame))
+        return (False, None)
+
+    return run
+
+
+command_compilers = {
+    "code_block": compile_code_block,
+    "imp": compile_imp,
+    "for": compile_for,
+    "while": compile_while,
+    "return": compile_return,
+    "break": lambda command, env: compile_exit("break"),
+    "continue": lambda command, env: compile_exit("continue"),
+    "declare": compile_declare,
+    "if": compile_if,
+    "ifelse": compile_ifelse,
+    "enum_definition": compile_enum_definition,
+    "alias_definition": compile_alias_definition,
+    "class_definition": compile_class_definition,
+    "assert": compile_assert,
+    "assign_value": compile_assign_value,
+}
+
+"""
+The async versions of the compilers, used for the code blocks of functions
+that use the await operator. Trees that don't contain the await operator are
+still compiled to synchronous functions.
+"""
+
+
+def compile_async_expr(expr, env):
+    if not contains_await(expr):
+        return as_async(compile_expr(expr, env))
+    compile_function = async_expression_compilers.get(expr.data)
+    if compile_function is None:
+        raise SyntaxError("Unexpected command/expression type %s" % expr.data)
+    return compile_function(expr, env)
+
+
+def compile_async_condition(condition, env, branch_env):
+    if condition.data == "conditional_let":
+        pattern_tree, value = condition.children
+        evaluate_value = compile_async_expr(value, env)
+        bind = compile_binder(n_scope.get_destructure_pattern(pattern_tree), branch_env)
+
+        async def evaluate_let(frame, branch_frame):
+            return bind(branch_frame, await evaluate_value(frame))
+
+        return evaluate_let
+    evaluate_condition = compile_async_expr(condition, env)
+
+    async def evaluate(frame, branch_frame):
+        return await evaluate_condition(frame)
+
+    return evaluate
+
+
+def compile_async_ifelse_expr(expr, env):
+    condition, if_true, if_false = expr.children
+    branch_env = get_block_environment(env, pattern=get_condition_pattern(condition))
+    evaluate_condition = compile_async_condition(condition, env, branch_env)
+    evaluate_if_true = compile_async_expr(if_true, branch_env)
+    evaluate_if_false = compile_async_expr(if_false, branch_env)
+    size = get_frame_size(branch_env, env)
+
+    async def evaluate(frame):
+        branch_frame = frame if size is None else Frame(frame, size)
+        if await evaluate_condition(frame, branch_frame):
+            return await evaluate_if_true(branch_frame)
+        else:
+            return await evaluate_if_false(branch_frame)
+
+    return evaluate
+
+
+def compile_async_function_callback(expr, env):
+    function, arguments = get_call_parts(expr)
+    evaluate_function = compile_async_expr(function, env)
+    evaluate_args = [
+        (True, compile_async_expr(arg.children[0], env))
+        if is_spread(arg)
+        else (False, compile_async_expr(arg, env))
+        for arg in arguments
+    ]
+
+    async def evaluate(frame):
+        arg_values = []
+        for spread, evaluate_arg in evaluate_args:
+            if spread:
+                arg_values.extend(list(await evaluate_arg(frame)))
+            else:
+                arg_values.append(await evaluate_arg(frame))
+        if len(arg_values) == 0:
+            arg_values = [()]
+        func = await evaluate_function(frame)
+        scope = frame.scope
+        scope.stack_trace.append((expr, scope.trace_file))
+        out = await func.run(arg_values)
+        scope.stack_trace.pop()
+        return out
+
+    return evaluate
+
+
+def compile_async_binary(expr, env):
+    operation = get_binary_operation(expr)
+    left, _, right = expr.children
+    evaluate_left = compile_async_expr(left, env)
+    evaluate_right = compile_async_expr(right, env)
+
+    async def evaluate(frame):
+        return operation(await evaluate_left(frame), await evaluate_right(frame))
+
+    return evaluate
+
+
+def compile_async_not_expression(expr, env):
+    _, value = expr.children
+    evaluate_value = compile_async_expr(value, env)
+
+    async def evaluate(frame):
+        return not await evaluate_value(frame)
+
+    return evaluate
+
+
+def compile_async_compare_expression(expr, env):
+    compare = get_comparison(expr)
+    left, _, right = expr.children
+    evaluate_right = compile_async_expr(right, env)
+    evaluate_chain = None
+    if isinstance(left, lark.Tree) and left.data == "compare_expression":
+        evaluate_chain = compile_async_expr(left, env)
+        left = left.children[2]
+    evaluate_left = compile_async_expr(left, env)
+
+    async def evaluate(frame):
+        if evaluate_chain is not None and not await evaluate_chain(frame):
+            return False
+        return compare(await evaluate_left(frame), await evaluate_right(frame))
+
+    return evaluate
+
+
+def compile_async_unary_expression(expr, env):
+    operation = get_unary_operation(expr)
+    evaluate_value = compile_async_expr(expr.children[1], env)
+
+    async def evaluate(frame):
+        return operation(await evaluate_value(frame))
+
+    return evaluate
+
+
+def compile_async_value_access(expr, env):
+    left, _, right = expr.children
+    evaluate_left = compile_async_expr(left, env)
+    evaluate_right = compile_async_expr(right, env)
+
+    async def evaluate(frame):
+        eval_left = await evaluate_left(frame)
+        if isinstance(eval_left, EnumValue) and eval_left == none:
+            return none
+        return get_value_at(eval_left, await evaluate_right(frame))
+
+    return evaluate
+
+
+def compile_async_value(expr, env):
+    return compile_async_expr(expr.children[0], env)
+
+
+def compile_async_record_access(expr, env):
+    evaluate_value = compile_async_expr(expr.children[0], env)
+    field = expr.children[1].value
+
+    async def evaluate(frame):
+        dict_value = await evaluate_value(frame)
+        if not isinstance(dict_value, dict):
+            internal_traits = frame.scope.get_value_internal_traits(dict_value)
+            return await internal_traits[field].run([dict_value])
+        return dict_value[field]
+
+    return evaluate
+
+
+def compile_async_tupleval(expr, env):
+    evaluate_items = [compile_async_expr(item, env) for item in expr.children]
+
+    async def evaluate(frame):
+        return tuple([await evaluate_item(frame) for evaluate_item in evaluate_items])
+
+    return evaluate
+
+
+def compile_async_listval(expr, env):
+    evaluate_items = [
+        (True, compile_async_expr(item.children[0], env))
+        if is_spread(item)
+        else (False, compile_async_expr(item, env))
+        for item in expr.children
+    ]
+
+    async def evaluate(frame):
+        values = []
+        for spread, evaluate_item in evaluate_items:
+            if spread:
+                values.extend(await evaluate_item(frame))
+            else:
+                values.append(await evaluate_item(frame))
+        return values
+
+    if len(evaluate_items) > 0 and evaluate_items[0][0]:
+        _, evaluate_first = evaluate_items.pop(0)
+        evaluate_rest = evaluate
+
+        async def evaluate(frame):
+            first = await evaluate_first(frame)
+            return NList.of(first).extended(await evaluate_rest(frame))
+
+    return evaluate
+
+
+def compile_async_recordval(expr, env):
+    evaluate_entries = compile_record_entries(expr, compile_async_expr, env)
+
+    async def evaluate(frame):
+        spreads = []
+        non_spread = {}
+        for key, evaluate_entry in evaluate_entries:
+            if key is None:
+                spreads.append(await evaluate_entry(frame))
+            else:
+                non_spread[key] = await evaluate_entry(frame)
+        return get_record(spreads, non_spread)
+
+    return evaluate
+
+
+async def await_value(frame, command):
+    """
+    Performs the cmd that the await operator is used on in a Frame of a
+    function call.
+    """
+    call = frame.call
+    if not call.awaiting:
+        # Make the function call return a cmd that continues from here
+        call.awaiting = True
+        await pause_call()
+    if isinstance(command, Cmd):
+        return await command.eval()
+    else:
+        # Cmd functions return the contained value if they don't use
+        # await.
+        return command
+
+
+def compile_async_await_expression(expr, env):
+    value, _ = expr.children
+    evaluate_value = compile_async_expr(value, env)
+
+    async def evaluate(frame):
+        return await await_value(frame, await evaluate_value(frame))
+
+    return evaluate
+
+
+def compile_async_match(expr, env):
+    input_value, match_block = expr.children
+    evaluate_input = compile_async_expr(input_value, env)
+    arms = compile_match_arms(match_block, compile_async_expr, env)
+    by_value = match_block.data == "match_block"
+
+    async def match_values(frame, inp):
+        default = None
+        for is_default, evaluate_value, evaluate_output, _, _ in arms:
+            if is_default:
+                default = await evaluate_output(frame)
+            elif inp == await evaluate_value(frame):
+                return await evaluate_output(frame)
+        return default
+
+    async def match_patterns(frame, inp):
+        default = None
+        for is_default, bind, evaluate_output, size, _ in arms:
+            if is_default:
+                default = await evaluate_output(frame)
+                continue
+            arm_frame = frame if size is None else Frame(frame, size)
+            if bind(arm_frame, inp):
+                return await evaluate_output(arm_frame)
+        return default
+
+    match_in_order = match_values if by_value else match_patterns
+    jump_table = get_jump_table(arms, by_value)
+    if jump_table is None:
+
+        async def evaluate_in_order(frame):
+            return await match_in_order(frame, await evaluate_input(frame))
+
+        return evaluate_in_order
+    table, fallback, defaults = jump_table
+
+    async def evaluate_jump(frame):
+        inp = await evaluate_input(frame)
+        if by_value:
+            try:
+                table_arms = table.get(inp, fallback)
+            except TypeError:
+                return await match_in_order(frame, inp)
+        elif isinstance(inp, EnumValue):
+            table_arms = table.get(inp.variant, fallback)
+        else:
+            return await match_in_order(frame, inp)
+        for bind, evaluate_output, size in table_arms:
+            if bind is None:
+                return await evaluate_output(frame)
+            arm_frame = frame if size is None else Frame(frame, size)
+            if bind(arm_frame, inp):
+                return await evaluate_output(arm_frame)
+        default = None
+        for evaluate_default in defaults:
+            default = await evaluate_default(frame)
+        return default
+
+    return evaluate_jump
+
+
+async_expression_compilers = {
+    "ifelse_expr": compile_async_ifelse_expr,
+    "function_callback": compile_async_function_callback,
+    "function_callback_pipe": compile_async_function_callback,
+    "or_expression": compile_async_binary,
+    "and_expression": compile_async_binary,
+    "xor_expression": compile_async_binary,
+    "not_expression": compile_async_not_expression,
+    "in_expression": compile_async_binary,
+    "compare_expression": compile_async_compare_expression,
+    "sum_expression": compile_async_binary,
+    "product_expression": compile_async_binary,
+    "exponent_expression": compile_async_binary,
+    "unary_expression": compile_async_unary_expression,
+    "value_access": compile_async_value_access,
+    "value": compile_async_value,
+    "record_access": compile_async_record_access,
+    "tupleval": compile_async_tupleval,
+    "listval": compile_async_listval,
+    "recordval": compile_async_recordval,
+    "await_expression": compile_async_await_expression,
+    "match": compile_async_match,
+}
+
+
+def compile_async_command(tree, env):
+    if engine == "vm":
+        return vm.compile_async_command(tree, env)
+    return compile_closure_async_command(tree, env)
+
+
+def compile_closure_async_command(tree, env):
+    command = get_command(tree)
+    if not contains_await(command):
+        return as_async(compile_command(tree, env))
+    compile_function = async_command_compilers.get(command.data)
+    if compile_function is not None:
+        return compile_function(command, env)
+
+    evaluate_expr = compile_async_expr(command, env)
+
+    async def run_expression(frame):
+        await evaluate_expr(frame)
+        return (False, None)
+
+    return run_expression
+
+
+def compile_async_code_block(tree, env):
+    commands = [
+        compile_async_command(instruction, env) for instruction in tree.children
+    ]
+
+    async def run(frame):
+        for command in commands:
+            exit, value = await command(frame)
+            if exit:
+                return exit, value
+        return (False, None)
+
+    return run
+
+
+def compile_async_for(command, env):
+    var, iterable, code = command.children
+    pattern, _ = get_name_pattern(var)
+    evaluate_iterable = compile_async_expr(iterable, env)
+    loop_env = get_block_environment(env, code, pattern)
+    slot = get_name_slot(pattern, loop_env)
+    bind = compile_binder(pattern, loop_env) if slot is None else None
+    run_code = compile_async_command(code, loop_env)
+    size = get_frame_size(loop_env, env)
+
+    async def run(frame):
+        for i in await evaluate_iterable(frame):
+            loop_frame = frame if size is None else Frame(frame, size)
+            if slot is None:
+                bind(loop_frame, i)
+            else:
+                loop_frame.values[slot] = i
+            exit, value = await run_code(loop_frame)
+            if exit == "continue":
+                continue
+            if exit == "break":
+                return False, None
+            if exit:
+                return True, value
+        return (False, None)
+
+    return run
+
+
+def compile_async_while(command, env):
+    condition, code = command.children
+    evaluate_condition = compile_async_expr(condition, env)
+    loop_env = get_block_environment(env, code)
+    run_code = compile_async_command(code, loop_env)
+    size = get_frame_size(loop_env, env)
+
+    async def run(frame):
+        while await evaluate_condition(frame):
+            exit, value = await run_code(frame if size is None else Frame(frame, size))
+            if exit == "continue":
+                continue
+            if exit == "break":
+                return False, None
+            if exit:
+                return True, value
+        return (False, None)
+
+    return run
+
+
+def compile_async_return(command, env):
+    evaluate_value = compile_async_expr(command.children[0], env)
+
+    async def run(frame):
+        return (True, await evaluate_value(frame))
+
+    return run
+
+
+def compile_async_declare(command, env):
+    modifiers, name_type, value = command.children
+    pattern, _ = get_name_pattern(name_type)
+    evaluate_value = compile_async_expr(value, env)
+    slot = get_name_slot(pattern, env, is_public(modifiers))
+    if slot is not None:
+
+        async def store(frame):
+            frame.values[slot] = await evaluate_value(frame)
+            return (False, None)
+
+        return store
+    bind = compile_binder(pattern, env, is_public(modifiers))
+
+    async def run(frame):
+        bind(frame, await evaluate_value(frame))
+        return (False, None)
+
+    return run
+
+
+def compile_async_if(command, env):
+    condition, body = command.children
+    branch_env = get_block_environment(env, body, get_condition_pattern(condition))
+    evaluate_condition = compile_async_condition(condition, env, branch_env)
+    run_body = compile_async_command(body, branch_env)
+    size = get_frame_size(branch_env, env)
+
+    async def run(frame):
+        branch_frame = frame if size is None else Frame(frame, size)
+        if await evaluate_condition(frame, branch_frame):
+            exit, value = await run_body(branch_frame)
+            if exit:
+                return (exit, value)
+        return (False, None)
+
+    return run
+
+
+def compile_async_ifelse(command, env):
+    condition, if_true, if_false = command.children
+    true_env = get_block_environment(env, if_true, get_condition_pattern(condition))
+    false_env = get_block_environment(env, if_false)
+    evaluate_condition = compile_async_condition(condition, env, true_env)
+    run_if_true = compile_async_command(if_true, true_env)
+    run_if_false = compile_async_command(if_false, false_env)
+    true_size = get_frame_size(true_env, env)
+    false_size = get_frame_size(false_env, env)
+
+    async def run(frame):
+        branch_frame = frame if true_size is None else Frame(frame, true_size)
+        if await evaluate_condition(frame, branch_frame):
+            exit, value = await run_if_true(branch_frame)
+        else:
+            exit, value = await run_if_false(
+                frame if false_size is None else Frame(frame, false_size)
+            )
+        if exit:
+            return (exit, value)
+        return (False, None)
+
+    return run
+
+
+def compile_async_assert(command, env):
+    assert_type = command.children[0].children[0]
+    if assert_type.data != "assert_val":
+        return as_async(compile_exit(False))
+    evaluate_value = compile_async_expr(assert_type.children[0], env)
+
+    async def run(frame):
+        frame.scope.unit_tests.append(
+            get_unit_test(command, await evaluate_value(frame))
+        )
+        return (False, None)
+
+    return run
+
+
+def compile_async_assign_value(command, env):
+    evaluate_value = compile_async_expr(get_assign_value_tree(command), env)
+    assign = compile_assignment(command.children[0].value, env)
+
+    async def run(frame):
+        assign(frame, await evaluate_value(frame))
+        return (False, None)
+
+    return run
+
+
+# Only commands that can contain the await operator are here
+async_command_compilers = {
+    "code_block": compile_async_code_block,
+    "for": compile_async_for,
+    "while": compile_async_while,
+    "return": compile_async_return,
+    "declare": compile_async_declare,
+    "if": compile_async_if,
+    "ifelse": compile_async_ifelse,
+    "assert": compile_async_assert,
+    "assign_value": compile_async_assign_value,
+}
@@ -4,7 +4,7 @@ from function import Function
 from type import NModule
 from enums import EnumValue
 from ncmd import Cmd
-from native_types import NMap
+from native_types import NMap, NList, NIter
 
 unescape = {"\\": "\\", '"': '"', "\n": "n", "\r": "r", "\t": "t"}
 
@@ -65,8 +65,8 @@ def display_value(
                 output += indent_state + "}"
             else:
                 output = "{ %s }" % ", ".join(parts)
-    elif isinstance(value, list) or isinstance(value, tuple):
-        is_list = isinstance(value, list)
+    elif isinstance(value, (list, NList)) or isinstance(value, tuple):
+        is_list = not isinstance(value, tuple)
         if len(value) == 0:
             output = "[]" if is_list else "()"
         else:
@@ -148,6 +148,10 @@ def display_value(
         output = "[cmd]"
         if color:
             output = Fore.MAGENTA + output + Style.RESET_ALL
+    elif isinstance(value, NIter):
+        output = "[iter]"
+        if color:
+            output = Fore.MAGENTA + output + Style.RESET_ALL
     elif isinstance(value, Function):
         output = "[function]"
         if color:
@@ -0,0 +1,71 @@
+# python -m unittest engine_test.py
+
+import unittest
+from os import walk, path
+import re
+import subprocess
+import sys
+
+import compiler
+from parse import basepath
+
+# The tree engine doesn't run calls in tail position as a loop, so it runs out
+# of Python stack on these files. They're left out for the tree engine, and the
+# other engines are compared to the closure engine instead.
+reference_engines = {"deep-tail-calls.n": "closure"}
+
+
+def run_engine(file_path, engine):
+    """
+    Runs the N file with the given engine in its own process and returns what
+    it printed.
+    """
+    result = subprocess.run(
+        [sys.executable, "n.py", "--engine", engine, "--file", file_path],
+        cwd=basepath,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+        timeout=300,
+    )
+    return result.stdout
+
+
+class EngineTestCases(unittest.TestCase):
+    reference_outputs = {}
+
+    @classmethod
+    def add_engine_test_case(cls, file_name, engine):
+        file_path = path.join(basepath, "../tests/engines/", file_name)
+        reference_engine = reference_engines.get(file_name, "tree")
+
+        def test_method(self):
+            if file_name not in self.reference_outputs:
+                self.reference_outputs[file_name] = run_engine(
+                    file_path, reference_engine
+                )
+            expected = self.reference_outputs[file_name]
+            self.assertNotIn("Error", expected)
+            self.assertEqual(run_engine(file_path, engine), expected)
+
+        # Dynamically add methods to the class
+        # https://stackoverflow.com/a/17930262
+        setattr(
+            cls,
+            "test_" + re.sub(r"\W", "_", file_name[0:-2]) + "_" + engine,
+            test_method,
+        )
+
+
+# Get files in directory https://stackoverflow.com/a/3207973
+_, _, file_names = next(walk(path.join(basepath, "../tests/engines/")))
+for file_name in file_names:
+    if not file_name.endswith(".n"):
+        continue
+    for engine in compiler.engines:
+        if engine in ("tree", reference_engines.get(file_name, "tree")):
+            continue
+        EngineTestCases.add_engine_test_case(file_name, engine)
+
+if __name__ == "__main__":
+    unittest.main()
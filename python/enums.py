@@ -2,8 +2,8 @@ from type import NTypeVars, apply_generics_to
 
 
 class EnumType(NTypeVars):
-    def __init__(self, name, variants, typevars=None, original=None):
-        super(EnumType, self).__init__(name, typevars, original=original)
+    def __init__(self, name, variants, typevars=None, original=None, key=None):
+        super(EnumType, self).__init__(name, typevars, original=original, key=key)
         self.variants = variants
 
     def get_types(self, variant_name):
@@ -19,9 +19,13 @@ class EnumType(NTypeVars):
 
 
 class EnumValue:
+    # Values like `yes(x)` are made often, so they don't get a __dict__
+    __slots__ = ("variant", "values", "cached_hash")
+
     def __init__(self, variant, values=None):
         self.variant = variant
-        self.values = values or []
+        self.values = values or ()
+        self.cached_hash = None
 
     def __repr__(self):
         return (
@@ -32,13 +36,20 @@ class EnumValue:
         )
 
     def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, EnumValue):
+            return NotImplemented
         return self.variant == other.variant and self.values == other.values
-    
+
     def __hash__(self):
-        out = hash(self.variant)
-        for val in self.values:
-            out += hash(val)
-        return out
+        # N values are immutable, so the hash can't change
+        if self.cached_hash is None:
+            out = hash(self.variant)
+            for val in self.values:
+                out += hash(val)
+            self.cached_hash = out
+        return self.cached_hash
 
     @classmethod
     def construct(cls, variant):
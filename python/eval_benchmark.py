@@ -0,0 +1,237 @@
+# python eval_benchmark.py [--engine closure|tree] [--repeat N] [--file FILE] [--memory]
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+import tracemalloc
+from os import path
+
+import compiler
+from native_functions import add_funcs
+from parse import n_parser, basepath
+from scope import Scope
+
+# examples/fizzbuzz.n uses syntax that this interpreter's grammar no longer
+# accepts, so this is the same program written in the current syntax.
+fizzbuzz = """
+for (i in range(0, 100, 1)) {
+  let n = i + 1
+  print(
+    if n % 3 == 0 & n % 5 == 0 {
+      "FizzBuzz"
+    } else if n % 3 == 0 {
+      "Fizz"
+    } else if n % 5 == 0 {
+      "Buzz"
+    } else {
+      n.toString()
+    }
+  )
+}
+"""
+
+# A CPU heavy loop that calls a function and does arithmetic in every iteration
+loop = """
+let collatz = (start: int) -> int {
+  let mut n = start
+  let mut steps = 0
+  while (n ~= 1) {
+    if n % 2 == 0 {
+      n /= 2
+    } else {
+      n = n * 3 + 1
+    }
+    steps += 1
+  }
+  return steps
+}
+
+let mut total = 0
+for (i in range(1, 1000, 1)) {
+  total += collatz(i)
+}
+print(total)
+"""
+
+# A match on an enum with 30 variants in a loop, to measure how arms are found
+variants = ["op%d" % i for i in range(30)]
+match = """
+type op = %s
+let run = (acc: int, o: op) -> int {
+  return match (o) {
+%s
+    _ -> acc
+  }
+}
+let ops = [%s]
+let mut total = 0
+for (i in range(0, 200, 1)) {
+  for (o in ops) {
+    total = run(total, o) %% 1000
+  }
+}
+print(total)
+""" % (
+    "\n  | ".join("%s(int)" % variant for variant in variants),
+    "\n".join(
+        "    %s(n%d) -> (acc + n%d)" % (variant, i, i)
+        for i, variant in enumerate(variants)
+    ),
+    ", ".join("%s(%d)" % (variant, i) for i, variant in enumerate(variants)),
+)
+
+# A loop full of literals and top level names that are never reassigned, which
+# the tree engine looks up again in every iteration
+literals = """
+let offset = 7
+let limit = 1000003
+let wrap = (n: int) -> int {
+  return n % limit
+}
+let mut total = 0
+for (i in range(0, 3000, 1)) {
+  total = wrap(total * 31 + i * 17 + offset - 0x1f + 0b101 + 12345)
+  if total > 500000 & i % 3 == 0 {
+    total = total - 250000 + offset
+  }
+}
+print(total)
+"""
+
+# A loop that makes a maybe or a result in almost every expression and matches on
+# them, so most of its time is spent allocating and comparing enum values
+enums = """
+type shape = circle(int) | square(int) | empty
+let digits = "0123456789"
+let words = ["1", "x", "23", ""]
+let counts = mapFrom([("circle", 0), ("square", 1), ("empty", 2)])
+let shapes = [circle(1), square(2), empty, circle(3)]
+let okArea = (a: int) -> result[int, str] {
+  return ok(a)
+}
+let noArea: result[int, str] = err("empty")
+let area = (s: shape) -> result[int, str] {
+  return match (s) {
+    circle(r) -> okArea(3 * r * r)
+    square(w) -> okArea(w * w)
+    _ -> noArea
+  }
+}
+let mut total = 0
+for (i in range(0, 3000, 1)) {
+  if let yes(c) = digits.charAt(i % 12) {
+    total += c.charCode()
+  }
+  if let yes(word) = words.itemAt(i % 4) {
+    if let yes(n) = word.parseInt() {
+      total += n
+    }
+  }
+  if let yes(s) = shapes.itemAt(i % 5) {
+    if let ok(a) = area(s) {
+      total += a
+    }
+    if s == empty {
+      total += getValue("empty", counts).default(0)
+    }
+  }
+  if let yes(n) = shapes[i % 6] {
+    total += if n == circle(1) { 1 } else { 0 }
+  }
+  if let none = shapes.itemAt(i) {
+    total += 1
+  }
+}
+print(total)
+"""
+
+benchmarks = {
+    "fizzbuzz": fizzbuzz,
+    "loop": loop,
+    "match": match,
+    "literals": literals,
+    "enums": enums,
+}
+
+
+def load(name, source):
+    """
+    Parses and type checks a program so that only evaluation is measured.
+    """
+    global_scope = Scope(base_path=basepath, file_path=path.join(basepath, name))
+    add_funcs(global_scope)
+    tree = n_parser.parse(source)
+    scope = global_scope.new_scope(inherit_errors=False)
+    for child in tree.children:
+        scope.type_check_command(child)
+    if len(scope.errors) > 0:
+        raise SyntaxError("%s: %s" % (name, scope.errors[0].message))
+    return global_scope, tree
+
+
+def evaluate(global_scope, tree):
+    async def run():
+        scope = global_scope.new_scope()
+        for _, command in compiler.compile_program(tree):
+            await command(scope)
+
+    # Programs print a lot, which shouldn't be measured
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.get_event_loop().run_until_complete(run())
+
+
+def benchmark_engine(engine, programs, repeat, memory=False):
+    """
+    Evaluates every type checked program `repeat` times with the given engine
+    and prints the average time each took, including compiling it. With
+    `memory`, it also prints the most memory allocated while evaluating each
+    program once, which tracemalloc slows down, so it isn't timed.
+    """
+    compiler.engine = engine
+    print("%s:" % engine)
+    total = 0
+    for name, (global_scope, tree) in programs.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            evaluate(global_scope, tree)
+        elapsed = (time.perf_counter() - start) / repeat
+        total += elapsed
+        if memory:
+            tracemalloc.start()
+            evaluate(global_scope, tree)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("  %-50s %8.4fs %7.1f KiB" % (name, elapsed, peak / 1024))
+        else:
+            print("  %-60s %8.4fs" % (name, elapsed))
+    print("  %-60s %8.4fs" % ("total", total))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures how long each engine takes to evaluate fizzbuzz, a CPU heavy loop, a match on an enum, a loop full of literals, and a loop full of maybe and result values."
+    )
+    parser.add_argument("--engine", choices=compiler.engines, action="append")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--file", action="append", help="Benchmark this N file instead."
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="Also measure the most memory each program allocates.",
+    )
+    args = parser.parse_args()
+
+    sources = benchmarks
+    if args.file:
+        sources = {}
+        for file_path in args.file:
+            with open(file_path, "r", encoding="utf-8") as f:
+                sources[os.path.basename(file_path)] = f.read()
+    programs = {name: load(name, source) for name, source in sources.items()}
+    for engine in args.engine or compiler.engines:
+        benchmark_engine(engine, programs, args.repeat, args.memory)
@@ -1,28 +1,44 @@
+import os
+
 from colorama import Fore, Style
 
+import tree_cache
+
 
 class File:
     def __init__(self, file=None, tab_length=4, name=None):
         # if the file is none then that means it was duplicated
         self.lines = []
         self.name = name or ""
+        # The path of the source file, used to find its cached syntax tree
+        self.path = None
         self.line_num_width = 0
         if file is not None:
             self.lines = [
                 line.rstrip().replace("\t", " " * tab_length) for line in file
             ]
             self.name = file.name if name is None else name
+            self.path = file.name
             self.line_num_width = len(str(len(self.lines)))
 
     def duplicate(self):
         dup = File()
         dup.lines = self.lines[:]
         dup.name = self.name
+        dup.path = self.path
         dup.line_num_width = self.line_num_width
         return dup
 
     def parse(self, parser):
-        return parser.parse("\n".join(self.lines))
+        text = self.get_text()
+        if self.path is None:
+            return parser.parse(text)
+        key = tree_cache.get_key(parser.grammar, text)
+        tree = tree_cache.load_tree(self.path, key)
+        if tree is None:
+            tree = parser.parse(text)
+            tree_cache.save_tree(self.path, key, tree)
+        return tree
 
     def get_line(self, line):
         try:
@@ -75,3 +91,29 @@ class File:
                     f"{Fore.CYAN}{line_num:>{self.line_num_width}} | {Style.RESET_ALL}{line}"
                 )
         return "\n".join(output)
+
+
+class LazyFile:
+    """
+    Stands in for a File in stack trace frames, which are pushed on every
+    function call, so that the source is only read from disk if a stack trace
+    is actually displayed.
+    """
+
+    def __init__(self, path, base_path):
+        self.path = path
+        self.base_path = base_path
+        self.file = None
+
+    @property
+    def name(self):
+        return os.path.relpath(self.path, start=self.base_path)
+
+    def load(self):
+        if self.file is None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.file = File(f, name=self.name)
+        return self.file
+
+    def display(self, *args, **kwargs):
+        return self.load().display(*args, **kwargs)
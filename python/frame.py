@@ -0,0 +1,32 @@
+class Frame:
+    """
+    The variables of a single run of a block of code compiled by the closure
+    engine, such as a function call or a loop iteration. The compiler resolves
+    each variable to how many frames up it is and its index in `values`, so
+    finding a variable doesn't involve any dictionaries. Top level variables,
+    native functions, and everything else that the interpreter needs from a
+    Scope come from the Scope of the file.
+    """
+
+    __slots__ = ("values", "parent", "scope", "call")
+
+    def __init__(self, parent, size, call=None):
+        self.values = [None] * size
+        self.parent = parent
+        self.scope = parent.scope
+        # The FunctionCall of the surrounding function, used by the await
+        # operator
+        self.call = call or parent.call
+
+    @classmethod
+    def top(cls, scope):
+        """
+        Creates a frame for the top level of a file, whose variables are kept
+        in its Scope so that other files can import them.
+        """
+        frame = cls.__new__(cls)
+        frame.values = []
+        frame.parent = None
+        frame.scope = scope
+        frame.call = None
+        return frame
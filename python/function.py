@@ -1,12 +1,128 @@
-import asyncio
+import types
+
 from variable import Variable
+from frame import Frame
 from ncmd import Cmd
 from type_check_error import display_type
 
+# What the await operator yields to `Function.run` to pause a function call
+# until its cmd is performed
+await_signal = object()
+
+
+@types.coroutine
+def pause_call():
+    yield await_signal
+
+
+@types.coroutine
+def run_until_await(coroutine):
+    """
+    Runs the coroutine of a function call until either it finishes, returning
+    `(False, result)`, or it uses the await operator for the first time,
+    returning `(True, None)`. Anything else the coroutine waits on is passed on
+    to the event loop.
+    """
+    try:
+        signal = coroutine.send(None)
+        while signal is not await_signal:
+            signal = coroutine.send((yield signal))
+    except StopIteration as result:
+        return False, result.value
+    return True, None
+
+
+@types.coroutine
+def resume(coroutine):
+    # `yield from` continues the coroutine from where `run_until_await` left
+    # off and lets the event loop run the rest.
+    return (yield from coroutine)
+
+
+async def run_call(body):
+    """
+    Runs the code block coroutine of a call of a function that uses the await
+    operator. If it awaits, it returns a cmd that runs the rest of the code
+    block when performed.
+    """
+    awaiting, result = await run_until_await(body)
+    if awaiting:
+
+        async def continue_async():
+            _, value = await resume(body)
+            return value
+
+        return Cmd(lambda _: continue_async)
+    else:
+        _, value = result
+        return value
+
+
+def run_synchronously(awaitable):
+    """
+    Gets the result of an awaitable that doesn't need the event loop, such as
+    calling an N function from synchronous code.
+    """
+    iterator = awaitable.__await__()
+    try:
+        iterator.send(None)
+    except StopIteration as result:
+        return result.value
+    iterator.close()
+    raise RuntimeError(
+        "Internal issue: I can't call the function synchronously because it waits on the event loop."
+    )
+
+
+class FunctionCall:
+    """
+    A call of an N function that uses the await operator. The first time it
+    awaits, the function returns a cmd that continues the call when performed.
+    """
+
+    __slots__ = ("function", "awaiting")
+
+    def __init__(self, function):
+        self.function = function
+        self.awaiting = False
+
+
+class TailCall:
+    """
+    Returned by the code block of a compiled function for `return f(x)`, so
+    that `CompiledFunction.run_sync` can call `f` in a loop rather than
+    recursing.
+    """
+
+    __slots__ = ("function", "arguments", "expr", "scope")
+
+    def __init__(self, function, arguments, expr, scope):
+        self.function = function
+        self.arguments = arguments
+        # Where the call is, for the stack trace
+        self.expr = expr
+        self.scope = scope
+
 
 class Function(Variable):
+    __slots__ = (
+        "scope",
+        "arguments",
+        "returntype",
+        "codeblock",
+        "generics",
+        "uses_await",
+    )
+
     def __init__(
-        self, scope, arguments, returntype, codeblock, generics=None, public=False
+        self,
+        scope,
+        arguments,
+        returntype,
+        codeblock,
+        generics=None,
+        public=False,
+        uses_await=True,
     ):
         # Tuples represent function types. (a, b, c) represents a -> b -> c.
         types = tuple([ty for _, ty in arguments] + [returntype])
@@ -24,50 +140,173 @@ class Function(Variable):
         self.returntype = returntype
         self.codeblock = codeblock
         self.generics = generics or []
+        # Whether the code block uses the await operator, as determined by the
+        # type checker. Functions that don't await don't need the event loop.
+        self.uses_await = uses_await
 
-    async def run(self, arguments):
-        # This function suddenly got so complicated because of async.
-        loop = asyncio.get_running_loop()
-        using_await_future = loop.create_future()
-        cmd_resume_future = loop.create_future()
-        scope = self.scope.new_scope(
-            parent_function=(self, using_await_future, cmd_resume_future)
+    def bind(self, arguments, call=None):
+        scope = self.scope.new_scope(parent_function=call)
+        for value, (arg_pattern, _) in zip(arguments, self.arguments):
+            scope.bind_pattern(arg_pattern, value)
+        return scope
+
+    def curry(self, scope, arguments):
+        return Function(
+            scope,
+            self.arguments[len(arguments) :],
+            self.returntype,
+            self.codeblock,
+            uses_await=self.uses_await,
         )
 
-        for value, (arg_pattern, _) in zip(arguments, self.arguments):
-            scope.assign_to_pattern(arg_pattern, value)
+    async def run(self, arguments):
+        call = FunctionCall(self) if self.uses_await else None
+        scope = self.bind(arguments, call)
         if len(arguments) < len(self.arguments):
             # Curry :o
-            return Function(
-                scope, self.arguments[len(arguments) :], self.returntype, self.codeblock
-            )
-
-        async def run_command():
-            try:
-                _, value = await scope.eval_command(self.codeblock)
-                if not using_await_future.done():
-                    using_await_future.set_result((False, value))
-                return value
-            except Exception as err:
-                print("OMG AN ERROR ==>", err)
-                using_await_future.set_exception(err)
-
-        # Run eval_command in a parallel Task because the await operator might
-        # block it.
-        run_task = loop.create_task(run_command())
-        # Wait until either the function encounters the await operator or it
-        # finishes evalling.
-        awaiting, value = await using_await_future
-
-        if awaiting:
-
-            async def continue_async():
-                cmd_resume_future.set_result(True)
-                return await run_task
-
-            return Cmd(lambda _: continue_async)
-        else:
+            return self.curry(scope, arguments)
+        if not self.uses_await:
+            _, value = await scope.eval_command(self.codeblock)
             return value
+        return await run_call(scope.eval_command(self.codeblock))
+
+    def run_sync(self, arguments):
+        """
+        Calls the function without the event loop.
+        """
+        return run_synchronously(self.run(arguments))
 
     def __str__(self):
         return "[function]"
+
+
+class CompiledFunction(Function):
+    """
+    A function whose code block was compiled by the closure engine. Its
+    arguments and variables are kept in a new Frame for each call.
+    """
+
+    __slots__ = ("frame", "size", "bind_arguments", "compiled", "argument_cache")
+
+    def __init__(
+        self,
+        frame,
+        arguments,
+        returntype,
+        codeblock,
+        size,
+        bind_arguments,
+        compiled,
+        uses_await=True,
+        argument_cache=None,
+    ):
+        super().__init__(
+            frame.scope, arguments, returntype, codeblock, uses_await=uses_await
+        )
+        self.frame = frame
+        self.size = size
+        self.bind_arguments = bind_arguments
+        self.compiled = compiled
+        self.argument_cache = argument_cache or []
+
+    def with_cached_arguments(self, arguments):
+        return CompiledFunction(
+            self.frame,
+            self.arguments,
+            self.returntype,
+            self.codeblock,
+            self.size,
+            self.bind_arguments,
+            self.compiled,
+            uses_await=self.uses_await,
+            argument_cache=arguments,
+        )
+
+    async def run(self, arguments):
+        if not self.uses_await:
+            return self.run_sync(arguments)
+        if self.argument_cache:
+            arguments = self.argument_cache + arguments
+        if len(arguments) < len(self.arguments):
+            # Curry :o
+            return self.with_cached_arguments(arguments)
+        frame = Frame(self.frame, self.size, FunctionCall(self))
+        self.bind_arguments(frame, arguments)
+        return await run_call(self.compiled(frame))
+
+    def run_sync(self, arguments):
+        if self.uses_await:
+            return run_synchronously(self.run(arguments))
+        function = self
+        stack_trace = None
+        while True:
+            if function.argument_cache:
+                arguments = function.argument_cache + arguments
+            if len(arguments) < len(function.arguments):
+                value = function.with_cached_arguments(arguments)
+                break
+            frame = Frame(function.frame, function.size)
+            function.bind_arguments(frame, arguments)
+            _, value = function.compiled(frame)
+            if type(value) is not TailCall:
+                break
+            # Only the latest call in tail position is kept in the stack
+            # trace, so it doesn't grow with each iteration.
+            if stack_trace is not None:
+                stack_trace.pop()
+            stack_trace = value.scope.stack_trace
+            stack_trace.append((value.expr, value.scope.trace_file))
+            function, arguments = value.function, value.arguments
+            if not isinstance(function, CompiledFunction) or function.uses_await:
+                value = function.run_sync(arguments)
+                break
+        if stack_trace is not None:
+            stack_trace.pop()
+        return value
+
+
+class TranspiledFunction(Function):
+    """
+    A function whose code block was transpiled to a Python function by the
+    python engine, which takes the arguments.
+    """
+
+    __slots__ = ("body", "arity", "argument_cache")
+
+    def __init__(self, scope, body, arity, argument_cache=None):
+        super().__init__(scope, [(None, None)] * arity, None, None, uses_await=False)
+        self.body = body
+        self.arity = arity
+        self.argument_cache = argument_cache or []
+
+    async def run(self, arguments):
+        return self.run_sync(arguments)
+
+    def run_sync(self, arguments):
+        function = self
+        stack_trace = None
+        while True:
+            if function.argument_cache:
+                arguments = function.argument_cache + arguments
+            if len(arguments) < function.arity:
+                # Curry :o
+                value = TranspiledFunction(
+                    function.scope, function.body, function.arity, arguments
+                )
+                break
+            value = function.body(*arguments[: function.arity])
+            if type(value) is not TailCall:
+                break
+            # Like `CompiledFunction.run_sync`, only the latest call in tail
+            # position is kept in the stack trace.
+            if stack_trace is not None:
+                stack_trace.pop()
+            stack_trace = value.scope.stack_trace
+            stack_trace.append((value.expr, value.scope.trace_file))
+            function, arguments = value.function, value.arguments
+            if not isinstance(function, TranspiledFunction):
+                value = function.run_sync(arguments)
+                break
+        if stack_trace is not None:
+            stack_trace.pop()
+        return value
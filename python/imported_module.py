@@ -0,0 +1,53 @@
+class ImportedModule:
+    """
+    Everything known about an imported N file during a single run, so that a
+    file imported from several places is only parsed, type checked, and
+    evaluated once.
+    """
+
+    def __init__(self, tree, file, mtime=None):
+        self.tree = tree
+        self.file = file
+        # The modification time of the file from before it was read
+        self.mtime = mtime
+
+        # Whether the file has been type checked. The results don't refer to
+        # the scope it was checked in, so they can be sent between processes.
+        self.checked = False
+        self.errors = []
+        self.warnings = []
+        self.public_types = {}
+        # The types of the public variables
+        self.public_variable_types = {}
+        # The key of the file's cached interface, or None if it can't be
+        # cached
+        self.interface_key = None
+
+        # The scope the file was evaluated in. None until it's evaluated.
+        self.evaluated_scope = None
+        # The values of the public variables
+        self.public_values = {}
+
+        # Type assertions from type checking followed by value assertions from
+        # evaluating the file
+        self.unit_tests = []
+
+    def get_interface(self):
+        """
+        Gets the results of type checking the file to cache.
+        """
+        return {
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "public_types": self.public_types,
+            "public_variable_types": self.public_variable_types,
+            "unit_tests": self.unit_tests,
+        }
+
+    def load_interface(self, interface):
+        self.checked = True
+        self.errors = interface["errors"]
+        self.warnings = interface["warnings"]
+        self.public_types = interface["public_types"]
+        self.public_variable_types = interface["public_variable_types"]
+        self.unit_tests = interface["unit_tests"] + self.unit_tests
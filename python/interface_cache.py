@@ -0,0 +1,70 @@
+import glob
+import hashlib
+import os
+
+import tree_cache
+
+"""
+The results of type checking an imported N file, its public types, the types
+of its public variables, and its errors, warnings, and unit tests, are cached
+as an interface in a `.ni` file in the `__ncache__` folder next to it, like
+Haskell's `.hi` files. Then the file doesn't have to be checked again while
+neither it nor the files it imports, directly or not, change.
+
+Each interface is stored along with a hash of the file's source and name, the
+hashes of the files it imports, and the code of the type checker, so a stale
+interface is simply ignored and overwritten. Files in circular imports aren't
+cached because their errors depend on which file imported them first.
+
+Set the N_INTERFACE_CACHE environment variable to "off" to disable the cache.
+"""
+
+extension = ".ni"
+enabled = os.environ.get("N_INTERFACE_CACHE") != "off"
+
+checker_hash = None
+
+
+def get_checker_hash():
+    """
+    Hashes the code that determines the results of type checking, so that
+    interfaces from an older version of N aren't used.
+    """
+    global checker_hash
+    if checker_hash is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for file_path in sorted(
+            glob.glob(os.path.join(directory, "*.py"))
+            + glob.glob(os.path.join(directory, "libraries", "*.py"))
+        ):
+            with open(file_path, "rb") as f:
+                digest.update(f.read())
+        checker_hash = digest.hexdigest()
+    return checker_hash
+
+
+def get_key(name, text, import_keys):
+    digest = hashlib.sha256()
+    for part in (get_checker_hash(), name, text, *import_keys):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def load_interface(source_path, key):
+    """
+    Returns the cached interface for the given source file, or None if there's
+    no cached interface for this exact key.
+    """
+    if not enabled:
+        return None
+    return tree_cache.load_entry(tree_cache.get_cache_path(source_path, extension), key)
+
+
+def save_interface(source_path, key, interface):
+    if not enabled:
+        return
+    tree_cache.save_entry(
+        tree_cache.get_cache_path(source_path, extension), key, interface
+    )
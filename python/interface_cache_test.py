@@ -0,0 +1,76 @@
+# python -m unittest interface_cache_test.py
+
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+
+from parse import basepath
+
+library = """let mut countUp: ({ n: int, acc: int }) -> int = (state: { n: int, acc: int }) -> int {
+  return state.acc
+}
+countUp = ({ n, acc }: { n: int, acc: int }) -> int {
+  if n == 0 {
+    return acc
+  }
+  return countUp({ n: n - 1, acc: acc + n })
+}
+let pub deep = (n: int) -> int {
+  return countUp({ n: n, acc: 0 })
+}
+"""
+
+main = """let lib = imp "./lib.n"
+print(lib.deep(20000))
+"""
+
+
+class InterfaceCacheTestCases(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, text in (("lib.n", library), ("main.n", main)):
+            with open(os.path.join(self.directory.name, name), "w") as file:
+                file.write(text)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_main(self, engine):
+        env = dict(os.environ)
+        env.pop("N_INTERFACE_CACHE", None)
+        result = subprocess.run(
+            [
+                sys.executable,
+                "n.py",
+                "--engine",
+                engine,
+                "--file",
+                os.path.join(self.directory.name, "main.n"),
+            ],
+            cwd=basepath,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding="utf-8",
+            timeout=300,
+        )
+        return result.stdout
+
+    def test_imported_tail_calls(self):
+        # The second run gets lib.n's types from its cached interface instead
+        # of type checking it, and its functions must still run without the
+        # event loop so that calls in tail position run as a loop
+        interface_path = os.path.join(self.directory.name, "__ncache__", "lib.n.ni")
+        for engine in ("closure", "vm", "python"):
+            with self.subTest(engine=engine):
+                if os.path.exists(interface_path):
+                    os.remove(interface_path)
+                self.assertEqual(self.run_main(engine), "200010000\n")
+                self.assertTrue(os.path.exists(interface_path))
+                self.assertEqual(self.run_main(engine), "200010000\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,7 @@ json_value_type = EnumType(
         ("number", ["float"]),
         ("boolean", ["bool"]),
     ],
+    key="json.value",
 )
 # These must be added separately because they're self-referencing
 json_value_type.variants += [
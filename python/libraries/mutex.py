@@ -78,8 +78,8 @@ async def write(value, mutex: Mutex):
     return value
 
 
-locked_type = NTypeVars("locked", [NGenericType("t")])
-unlocked_type = NTypeVars("unlocked", [NGenericType("t")])
+locked_type = NTypeVars("locked", [NGenericType("t")], key="mutex.locked")
+unlocked_type = NTypeVars("unlocked", [NGenericType("t")], key="mutex.unlocked")
 
 
 def _values():
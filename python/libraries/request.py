@@ -84,7 +84,7 @@ async def createServer(port, page_handler):
         return Response(
             w,
             status=out["responseCode"],
-            headers=out["headers"],
+            headers=dict(out["headers"]),
             mimetype=out["mimetype"],
             direct_passthrough=True,
         )
@@ -13,6 +13,7 @@ try:
     from lark import Lark
 
     import stack_trace
+    from check_server import serve
 
     from syntax_error import format_error
     from ncmd import Cmd
@@ -22,6 +23,9 @@ try:
     from native_functions import add_funcs
     from parse import n_parser
     from file import File
+    import compiler
+    import parallel_check
+    import transpiler
 
     init()
 
@@ -73,12 +77,12 @@ def type_check(global_scope, file, tree, check):
 async def parse_tree(global_scope, tree, file):
     if tree.data == "start":
         scope = global_scope.new_scope()
-        for child in tree.children:
+        for child, command in compiler.compile_program(tree, file):
             scope.stack_trace.append(
                 (child,
                 file)
             )
-            await scope.eval_command(child)
+            await command(scope)
             scope.stack_trace.pop()
         for variable in reversed(scope.variables.values()):
             if variable.public and isinstance(variable.value, Cmd):
@@ -89,10 +93,12 @@ async def parse_tree(global_scope, tree, file):
         raise SyntaxError("Unable to run parse_tree on non-starting branch")
 
 
-def run_file(filename, check=False):
+def run_file(filename, check=False, emit_python=False):
     """
     Executes the N file at the given file path. Returns a human-readable string
-    if there was an error or None if everything went well.
+    if there was an error or None if everything went well. With emit_python,
+    the file is transpiled to Python instead of run, and the source code of
+    the module is returned.
     """
 
     file = None
@@ -116,6 +122,10 @@ def run_file(filename, check=False):
         return format_error(e, file)
 
     try:
+        if parallel_check.jobs > 1:
+            parallel_check.check_imports(
+                file_path, global_scope.base_path, global_scope.modules
+            )
         errors, error_count, warning_count = type_check(global_scope, file, tree, check)
     except Exception as err:
         debug = os.environ.get("N_ST_DEBUG") == "dev"
@@ -132,6 +142,10 @@ def run_file(filename, check=False):
             warning_s = "s"
         return f"{errors}\n{Fore.BLUE}Ran with {Fore.RED}{error_count} error{error_s}{Fore.BLUE} and {Fore.YELLOW}{warning_count} warning{warning_s}{Fore.BLUE}.{Style.RESET_ALL}"
 
+    if emit_python:
+        compiler.fold_constants(tree)
+        return transpiler.transpile(tree)
+
     try:
         asyncio.get_event_loop().run_until_complete(parse_tree(global_scope, tree, file))
         return global_scope
@@ -158,6 +172,28 @@ if __name__ == "__main__":
             action="store_true",
             help="This goes through the file and prints out the errors and warnings without running it.",
         )
+        parser.add_argument(
+            "--serve",
+            action="store_true",
+            help='Keeps running to type check files without running them, reading requests like {"file": "run.n"} from stdin, one per line, and writing the errors and warnings as JSON. Files are only checked again once they change, or once the public types, errors or warnings of the files they import change.',
+        )
+        parser.add_argument(
+            "--engine",
+            choices=compiler.engines,
+            default=compiler.engine,
+            help="How to evaluate the file. closure compiles it to Python closures first, tree walks the syntax tree, vm compiles it to bytecode for a stack based virtual machine, and python transpiles it to a Python module. (optional. defaults to the N_ENGINE environment variable or closure)",
+        )
+        parser.add_argument(
+            "--emit-python",
+            action="store_true",
+            help="Type checks the file and prints the Python module that the python engine transpiles it to, without running it. Top level instructions that can't be transpiled are left out and run with the closure engine.",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=parallel_check.jobs,
+            help="How many processes to type check imported files in at the same time. (optional. defaults to the N_JOBS environment variable or 1)",
+        )
         parser.add_argument(
             "--newest", action="store_true", help="Shows the newest version of N."
         )
@@ -209,7 +245,14 @@ if __name__ == "__main__":
             print(response.json()["name"])
             exit()
 
-        errors = run_file(args.file, args.check)
+        compiler.engine = args.engine
+        parallel_check.jobs = args.jobs
+
+        if args.serve:
+            serve()
+            exit()
+
+        errors = run_file(args.file, args.check, args.emit_python)
         if not isinstance(errors, Scope):
             print(errors)
     except KeyboardInterrupt:
@@ -1,12 +1,14 @@
 import inspect
 
-from function import Function
+from function import Function, run_synchronously
 from type_check_error import display_type
 from native_types import n_cmd_type
 from ncmd import Cmd
 
 
 class NativeFunction(Function):
+    __slots__ = ("function", "argument_cache")
+
     def __init__(
         self, scope, arguments, return_type, function, argument_cache=None, public=False
     ):
@@ -32,6 +34,22 @@ class NativeFunction(Function):
         else:
             return maybe_awaitable
 
+    def run_sync(self, arguments):
+        arguments = self.argument_cache + arguments
+        if len(arguments) < len(self.arguments):
+            return NativeFunction(
+                self.scope,
+                self.arguments,
+                self.returntype,
+                self.function,
+                argument_cache=self.argument_cache + arguments,
+            )
+        maybe_awaitable = self.function(*arguments)
+        if inspect.isawaitable(maybe_awaitable):
+            return run_synchronously(maybe_awaitable)
+        else:
+            return maybe_awaitable
+
     def __str__(self):
         return display_type(self.arguments, False)
 
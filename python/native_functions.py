@@ -2,6 +2,7 @@ import asyncio
 import math
 import lark
 import sys
+from itertools import islice
 
 import scope
 
@@ -24,6 +25,9 @@ from native_types import (
     ok,
     err,
     n_module_type,
+    NList,
+    n_iter_type,
+    NIter,
 )
 from ncmd import Cmd
 
@@ -62,6 +66,61 @@ async def filter_map(lis, transformer):
     return new_list
 
 
+"""
+The iter trait functions. Since iterating over an iter is synchronous, they
+call N functions with `run_sync`.
+"""
+
+
+def to_iter(values):
+    return NIter(lambda: iter(values))
+
+
+def iter_map(values, transformer):
+    return NIter(lambda: (transformer.run_sync([item]) for item in values))
+
+
+def iter_filter(values, predicate):
+    return NIter(lambda: (item for item in values if predicate.run_sync([item])))
+
+
+def iter_filter_map(values, transformer):
+    def get_iterator():
+        for item in values:
+            transformed = transformer.run_sync([item])
+            if transformed.variant == "yes":
+                yield transformed.values[0]
+
+    return NIter(get_iterator)
+
+
+def iter_take(values, count):
+    return NIter(lambda: islice(values, max(count, 0)))
+
+
+async def iter_fold(values, initial, reducer):
+    result = initial
+    for item in values:
+        result = await reducer.run([result, item])
+    return result
+
+
+def iter_chunk(values, size):
+    def get_iterator():
+        iterator = iter(values)
+        while True:
+            chunk = list(islice(iterator, max(size, 0)))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    return NIter(get_iterator)
+
+
+def iter_zip(values, other):
+    return NIter(lambda: zip(values, other))
+
+
 def with_default(maybe_value, default_value):
     if maybe_value.variant == "yes":
         return maybe_value.values[0]
@@ -96,8 +155,8 @@ def cmd_parallel(cmd):
 
 
 def map_from(entries):
-    # NMap extends dict so it's basically a dict, but this way we can
-    # distinguish between a record and a map.
+    # NMap is a Mapping but not a dict, so that we can distinguish between a
+    # record and a map.
     return NMap(entries)
 
 
@@ -110,11 +169,29 @@ def map_get(key, map):
 
 
 def entries(n_map):
-    # NMap extends dict so it's basically a dict, but this way we can
-    # distinguish between a record and a map.
     return list(n_map.items())
 
 
+def map_insert(key, value, n_map):
+    return n_map.inserted(key, value)
+
+
+def map_remove(key, n_map):
+    return n_map.removed(key)
+
+
+async def map_update(key, updater, n_map):
+    updated = await updater.run([map_get(key, n_map)])
+    if updated.variant == "yes":
+        return n_map.inserted(key, updated.values[0])
+    else:
+        return n_map.removed(key)
+
+
+def map_keys(n_map):
+    return list(n_map)
+
+
 def special_print(val):
     if isinstance(val, str):
         print(val)
@@ -177,7 +254,7 @@ def ceil_without_error(number):
 
 def range_without_error(start, end, step): 
     try:
-        return list(range(start, end, step))
+        return NList.lazy(range(start, end, step))
     except:
         return []
 
@@ -306,6 +383,82 @@ def add_funcs(global_scope):
         n_list_type.with_typevars([[entries_generic_key, entries_generic_value]]),
         entries,
     )
+    insert_generic_key = NGenericType("k")
+    insert_generic_value = NGenericType("v")
+    global_scope.add_native_function(
+        "insert",
+        [
+            ("key", insert_generic_key),
+            ("value", insert_generic_value),
+            (
+                "map",
+                n_map_type.with_typevars([insert_generic_key, insert_generic_value]),
+            ),
+        ],
+        n_map_type.with_typevars([insert_generic_key, insert_generic_value]),
+        map_insert,
+    )
+    remove_generic_key = NGenericType("k")
+    remove_generic_value = NGenericType("v")
+    global_scope.add_native_function(
+        "remove",
+        [
+            ("key", remove_generic_key),
+            (
+                "map",
+                n_map_type.with_typevars([remove_generic_key, remove_generic_value]),
+            ),
+        ],
+        n_map_type.with_typevars([remove_generic_key, remove_generic_value]),
+        map_remove,
+    )
+    update_generic_key = NGenericType("k")
+    update_generic_value = NGenericType("v")
+    global_scope.add_native_function(
+        "update",
+        [
+            ("key", update_generic_key),
+            (
+                "function",
+                (
+                    n_maybe_type.with_typevars([update_generic_value]),
+                    n_maybe_type.with_typevars([update_generic_value]),
+                ),
+            ),
+            (
+                "map",
+                n_map_type.with_typevars([update_generic_key, update_generic_value]),
+            ),
+        ],
+        n_map_type.with_typevars([update_generic_key, update_generic_value]),
+        map_update,
+    )
+    size_generic_key = NGenericType("k")
+    size_generic_value = NGenericType("v")
+    global_scope.add_native_function(
+        "size",
+        [
+            (
+                "map",
+                n_map_type.with_typevars([size_generic_key, size_generic_value]),
+            )
+        ],
+        "int",
+        len,
+    )
+    keys_generic_key = NGenericType("k")
+    keys_generic_value = NGenericType("v")
+    global_scope.add_native_function(
+        "keys",
+        [
+            (
+                "map",
+                n_map_type.with_typevars([keys_generic_key, keys_generic_value]),
+            )
+        ],
+        n_list_type.with_typevars([keys_generic_key]),
+        map_keys,
+    )
     into_module_generic_value = NGenericType("m")
     global_scope.add_native_function(
         "intoModule",
@@ -327,6 +480,7 @@ def add_funcs(global_scope):
     global_scope.types["float"] = "float"
     global_scope.types["bool"] = "bool"
     global_scope.types["list"] = n_list_type
+    global_scope.types["iter"] = n_iter_type
     global_scope.types["map"] = n_map_type
     global_scope.types["cmd"] = n_cmd_type
     global_scope.types["maybe"] = n_maybe_type
@@ -488,7 +642,7 @@ def add_funcs(global_scope):
             ("item", append_trait_generic),
         ],
         n_list_type.with_typevars([append_trait_generic]),
-        lambda l, i: l + [i],
+        lambda l, i: NList.of(l).appended(i),
     )
 
     subsection_trait_generic = NGenericType("t")
@@ -523,6 +677,130 @@ def add_funcs(global_scope):
         filter_map,
     )
 
+    to_iter_trait_generic = NGenericType("t")
+    global_scope.add_internal_trait(
+        "list",
+        "iter",
+        [("list", n_list_type.with_typevars([to_iter_trait_generic]))],
+        n_iter_type.with_typevars([to_iter_trait_generic]),
+        to_iter,
+    )
+
+    iter_map_trait_generic_a = NGenericType("a")
+    iter_map_trait_generic_b = NGenericType("b")
+    global_scope.add_internal_trait(
+        "iter",
+        "map",
+        [
+            ("iter", n_iter_type.with_typevars([iter_map_trait_generic_a])),
+            ("function", (iter_map_trait_generic_a, iter_map_trait_generic_b)),
+        ],
+        n_iter_type.with_typevars([iter_map_trait_generic_b]),
+        iter_map,
+    )
+
+    iter_filter_trait_generic = NGenericType("t")
+    global_scope.add_internal_trait(
+        "iter",
+        "filter",
+        [
+            ("iter", n_iter_type.with_typevars([iter_filter_trait_generic])),
+            ("function", (iter_filter_trait_generic, "bool")),
+        ],
+        n_iter_type.with_typevars([iter_filter_trait_generic]),
+        iter_filter,
+    )
+
+    iter_filter_map_trait_generic_a = NGenericType("a")
+    iter_filter_map_trait_generic_b = NGenericType("b")
+    global_scope.add_internal_trait(
+        "iter",
+        "filterMap",
+        [
+            ("iter", n_iter_type.with_typevars([iter_filter_map_trait_generic_a])),
+            (
+                "function",
+                (
+                    iter_filter_map_trait_generic_a,
+                    n_maybe_type.with_typevars([iter_filter_map_trait_generic_b]),
+                ),
+            ),
+        ],
+        n_iter_type.with_typevars([iter_filter_map_trait_generic_b]),
+        iter_filter_map,
+    )
+
+    iter_take_trait_generic = NGenericType("t")
+    global_scope.add_internal_trait(
+        "iter",
+        "take",
+        [
+            ("iter", n_iter_type.with_typevars([iter_take_trait_generic])),
+            ("count", "int"),
+        ],
+        n_iter_type.with_typevars([iter_take_trait_generic]),
+        iter_take,
+    )
+
+    iter_fold_trait_generic_a = NGenericType("a")
+    iter_fold_trait_generic_b = NGenericType("b")
+    global_scope.add_internal_trait(
+        "iter",
+        "fold",
+        [
+            ("iter", n_iter_type.with_typevars([iter_fold_trait_generic_a])),
+            ("initial", iter_fold_trait_generic_b),
+            (
+                "function",
+                (
+                    iter_fold_trait_generic_b,
+                    iter_fold_trait_generic_a,
+                    iter_fold_trait_generic_b,
+                ),
+            ),
+        ],
+        iter_fold_trait_generic_b,
+        iter_fold,
+    )
+
+    iter_chunk_trait_generic = NGenericType("t")
+    global_scope.add_internal_trait(
+        "iter",
+        "chunk",
+        [
+            ("iter", n_iter_type.with_typevars([iter_chunk_trait_generic])),
+            ("size", "int"),
+        ],
+        n_iter_type.with_typevars(
+            [n_list_type.with_typevars([iter_chunk_trait_generic])]
+        ),
+        iter_chunk,
+    )
+
+    iter_zip_trait_generic_a = NGenericType("a")
+    iter_zip_trait_generic_b = NGenericType("b")
+    global_scope.add_internal_trait(
+        "iter",
+        "zip",
+        [
+            ("iter", n_iter_type.with_typevars([iter_zip_trait_generic_a])),
+            ("other", n_iter_type.with_typevars([iter_zip_trait_generic_b])),
+        ],
+        n_iter_type.with_typevars(
+            [[iter_zip_trait_generic_a, iter_zip_trait_generic_b]]
+        ),
+        iter_zip,
+    )
+
+    iter_collect_trait_generic = NGenericType("t")
+    global_scope.add_internal_trait(
+        "iter",
+        "collect",
+        [("iter", n_iter_type.with_typevars([iter_collect_trait_generic]))],
+        n_list_type.with_typevars([iter_collect_trait_generic]),
+        NList,
+    )
+
     global_scope.add_internal_trait(
         "module",
         "getUnitTestResults",
@@ -1,23 +1,436 @@
+from collections.abc import Mapping, ItemsView, Sequence
+from itertools import islice
+
 from type import NTypeVars, NGenericType
 from enums import EnumType, EnumValue
 
 list_generic = NGenericType("t")
-n_list_type = NTypeVars("list", [list_generic])
+n_list_type = NTypeVars("list", [list_generic], key="list")
+
+iter_generic = NGenericType("t")
+n_iter_type = NTypeVars("iter", [iter_generic], key="iter")
 
 map_key_generic = NGenericType("k")
 map_value_generic = NGenericType("v")
-n_map_type = NTypeVars("map", [map_key_generic, map_value_generic])
+n_map_type = NTypeVars("map", [map_key_generic, map_value_generic], key="map")
+
+n_module_type = NTypeVars("module", [], key="module")
+
+
+"""
+The nodes of an NMap's trie are dicts from 5 bits of a key's hash to either a
+leaf, which is a (hash, key, value, order) tuple, another node, or a list of the
+leaves of keys with the same hash. A node other than the root always has at
+least two leaves under it. Nodes are never changed once they're in a map.
+"""
+
+
+def get_hash(entry):
+    return entry[0] if type(entry) is tuple else entry[0][0]
+
+
+def is_key(leaf, key):
+    return leaf[1] is key or leaf[1] == key
+
+
+def node_set(node, shift, leaf):
+    """
+    Returns a copy of the node with the leaf added, or replacing the leaf of the
+    same key, and whether the key is new.
+    """
+    key_hash = leaf[0]
+    index = (key_hash >> shift) & 31
+    entry = node.get(index)
+    new_node = dict(node)
+    added = True
+    if entry is None:
+        new_node[index] = leaf
+    elif type(entry) is dict:
+        new_node[index], added = node_set(entry, shift + 5, leaf)
+    elif get_hash(entry) != key_hash:
+        # Move the entry into a new node under this one
+        new_node[index], _ = node_set(
+            {(get_hash(entry) >> (shift + 5)) & 31: entry}, shift + 5, leaf
+        )
+    elif type(entry) is tuple:
+        if is_key(entry, leaf[1]):
+            new_node[index] = leaf
+            added = False
+        else:
+            new_node[index] = [entry, leaf]
+    else:
+        leaves = [other for other in entry if not is_key(other, leaf[1])]
+        added = len(leaves) == len(entry)
+        new_node[index] = leaves + [leaf]
+    return new_node, added
+
+
+def node_remove(node, shift, key_hash, key):
+    """
+    Returns a copy of the node without the key, or the same node if the key
+    isn't in it.
+    """
+    index = (key_hash >> shift) & 31
+    entry = node.get(index)
+    if entry is None:
+        return node
+    if type(entry) is dict:
+        child = node_remove(entry, shift + 5, key_hash, key)
+        if child is entry:
+            return node
+        replacement = child
+        if len(child) == 1:
+            # A single leaf doesn't need a node of its own
+            only = next(iter(child.values()))
+            if type(only) is not dict:
+                replacement = only
+    elif get_hash(entry) != key_hash:
+        return node
+    elif type(entry) is tuple:
+        if not is_key(entry, key):
+            return node
+        replacement = None
+    else:
+        leaves = [leaf for leaf in entry if not is_key(leaf, key)]
+        if len(leaves) == len(entry):
+            return node
+        replacement = leaves[0] if len(leaves) == 1 else leaves
+    new_node = dict(node)
+    if replacement is None:
+        del new_node[index]
+    else:
+        new_node[index] = replacement
+    return new_node
+
+
+"""
+An NMap also keeps its leaves in the order their keys were added in a trie of
+tuples indexed by each leaf's order, 5 bits at a time from the most significant
+end, so that its entries can be listed in order without sorting them. Removed
+keys leave None in their place until the map is rebuilt.
+"""
+
 
-n_module_type = NTypeVars("module", [])
+def order_set(node, shift, index, leaf):
+    """
+    Returns a copy of the order trie node with the leaf at the index, which can
+    be one past the end.
+    """
+    slot = (index >> shift) & 31
+    if shift == 0:
+        child = leaf
+    else:
+        child = order_set(
+            node[slot] if slot < len(node) else (), shift - 5, index, leaf
+        )
+    return node[:slot] + (child,) + node[slot + 1 :]
 
 
-class NMap(dict):
+def order_leaves(node, shift):
+    if shift == 0:
+        for leaf in node:
+            if leaf is not None:
+                yield leaf
+    else:
+        for child in node:
+            yield from order_leaves(child, shift - 5)
+
+
+class NMapItems(ItemsView):
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
+class NMap(Mapping):
+    """
+    An immutable N map, stored as a hash array mapped trie. Adding or removing
+    a key makes a new map that only copies the nodes on the way to its leaf,
+    which there are O(log n) of, and shares the rest with the old map. Like a
+    dict, the keys are in the order they were first added, which a second trie
+    keeps track of the same way.
+    """
+
+    __slots__ = ("root", "size", "next_order", "order", "order_shift")
+
     def __init__(self, *args, **kw):
-        super(NMap, self).__init__(*args, **kw)
+        if len(args) == 1 and not kw and isinstance(args[0], NMap):
+            self.root = args[0].root
+            self.size = args[0].size
+            self.next_order = args[0].next_order
+            self.order = args[0].order
+            self.order_shift = args[0].order_shift
+            return
+        self.root = {}
+        self.size = 0
+        self.next_order = 0
+        self.order = ()
+        self.order_shift = 0
+        for key, value in dict(*args, **kw).items():
+            self.add_new(key, value)
+
+    def add_new(self, key, value):
+        """
+        Adds a key that isn't in the map yet. Only used while making a map.
+        """
+        leaf = (hash(key), key, value, self.next_order)
+        self.root, _ = node_set(self.root, 0, leaf)
+        if self.next_order >> (self.order_shift + 5):
+            # The order trie is full, so it gets a new level
+            self.order = (self.order,)
+            self.order_shift += 5
+        self.order = order_set(self.order, self.order_shift, self.next_order, leaf)
+        self.size += 1
+        self.next_order += 1
+
+    def get_leaf(self, key):
+        key_hash = hash(key)
+        node = self.root
+        shift = 0
+        while True:
+            entry = node.get((key_hash >> shift) & 31)
+            if type(entry) is dict:
+                node = entry
+                shift += 5
+            elif type(entry) is tuple:
+                if entry[0] == key_hash and is_key(entry, key):
+                    return entry
+                return None
+            elif entry is None or entry[0][0] != key_hash:
+                return None
+            else:
+                for leaf in entry:
+                    if is_key(leaf, key):
+                        return leaf
+                return None
+
+    def inserted(self, key, value):
+        """
+        Returns a new map with the key set to the value.
+        """
+        leaf = self.get_leaf(key)
+        n_map = NMap(self)
+        if leaf is None:
+            n_map.add_new(key, value)
+            return n_map
+        # A key that's already in the map keeps its place
+        leaf = (leaf[0], key, value, leaf[3])
+        n_map.root, _ = node_set(self.root, 0, leaf)
+        n_map.order = order_set(self.order, self.order_shift, leaf[3], leaf)
+        return n_map
+
+    def removed(self, key):
+        """
+        Returns a new map without the key, or the same map if it isn't in it.
+        """
+        leaf = self.get_leaf(key)
+        if leaf is None:
+            return self
+        if self.next_order - self.size >= self.size - 1:
+            # Once most of the order trie would be removed keys, the map is
+            # made again without them so that listing its entries stays O(n)
+            n_map = NMap()
+            for other in order_leaves(self.order, self.order_shift):
+                if other is not leaf:
+                    n_map.add_new(other[1], other[2])
+            return n_map
+        n_map = NMap(self)
+        n_map.root = node_remove(self.root, 0, leaf[0], key)
+        n_map.order = order_set(self.order, self.order_shift, leaf[3], None)
+        n_map.size -= 1
+        return n_map
+
+    def iter_items(self):
+        for leaf in order_leaves(self.order, self.order_shift):
+            yield leaf[1], leaf[2]
+
+    def get(self, key, default=None):
+        leaf = self.get_leaf(key)
+        return default if leaf is None else leaf[2]
+
+    def __getitem__(self, key):
+        leaf = self.get_leaf(key)
+        if leaf is None:
+            raise KeyError(key)
+        return leaf[2]
+
+    def __contains__(self, key):
+        return self.get_leaf(key) is not None
+
+    def __len__(self):
+        return self.size
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        return all(
+            key in other and other[key] == value for key, value in self.iter_items()
+        )
+
+    def __iter__(self):
+        return (key for key, _ in self.iter_items())
+
+    def items(self):
+        return NMapItems(self)
+
+    def __repr__(self):
+        return "NMap(%r)" % dict(self.iter_items())
+
+
+class NList(Sequence):
+    """
+    An immutable N list. Lists made by appending to another list share its
+    Python list, which only grows, and each list remembers which slice of it
+    belongs to it. This way appending to the newest list made from a Python
+    list is amortized O(1), and getting a subsection is O(1). Appending to an
+    older list copies its items first, so every list keeps its own items.
+
+    The items can also be another sequence, like a range, so that lists such
+    as those from `range` don't have to be stored until something is added to
+    them. N lists can also be plain Python lists, such as those returned by
+    native functions, so Python code should treat lists as sequences.
+    """
+
+    __slots__ = ("items", "start", "stop")
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.start = 0
+        self.stop = len(self.items)
+
+    @classmethod
+    def view(cls, items, start, stop):
+        n_list = cls.__new__(cls)
+        n_list.items = items
+        n_list.start = start
+        n_list.stop = stop
+        return n_list
+
+    @classmethod
+    def lazy(cls, sequence):
+        """
+        Makes a list of the items of a sequence, like a range, without copying
+        them.
+        """
+        return cls.view(sequence, 0, len(sequence))
+
+    @classmethod
+    def of(cls, values):
+        if isinstance(values, NList):
+            return values
+        return cls(values)
+
+    def appended(self, item):
+        """
+        Returns a new list with the item added to the end.
+        """
+        items = self.items
+        if type(items) is not list or self.stop != len(items):
+            items = self.copy_items()
+            items.append(item)
+            return NList.view(items, 0, len(items))
+        items.append(item)
+        return NList.view(items, self.start, self.stop + 1)
+
+    def extended(self, values):
+        """
+        Returns a new list with the given values added to the end.
+        """
+        items = self.items
+        if type(items) is not list or self.stop != len(items):
+            items = self.copy_items()
+            items.extend(values)
+            return NList.view(items, 0, len(items))
+        items.extend(values)
+        return NList.view(items, self.start, len(items))
+
+    def copy_items(self):
+        """
+        Returns a new Python list of the items in the list.
+        """
+        items = self.items[self.start : self.stop]
+        if type(items) is not list:
+            items = list(items)
+        return items
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(self.start, self.stop)[index]
+            if indices.step == 1:
+                return NList.view(self.items, indices.start, indices.stop)
+            return NList(self.items[i] for i in indices)
+        if index < 0:
+            index += self.stop - self.start
+            if index < 0:
+                raise IndexError("list index out of range")
+        index += self.start
+        if index >= self.stop:
+            raise IndexError("list index out of range")
+        return self.items[index]
+
+    def __iter__(self):
+        # The items after `stop` may belong to another list, so the iterator
+        # must not go past it even if it gets appended to while iterating.
+        return islice(self.items, self.start, self.stop)
+
+    def __contains__(self, value):
+        if type(self.items) is range:
+            return value in self.items[self.start : self.stop]
+        for item in self:
+            if item is value or item == value:
+                return True
+        return False
+
+    def __eq__(self, other):
+        if not isinstance(other, (NList, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            a is b or a == b for a, b in zip(self, other)
+        )
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __add__(self, other):
+        if not isinstance(other, (NList, list)):
+            return NotImplemented
+        return self.extended(other)
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return NList(other).extended(self)
+
+    def __repr__(self):
+        return "NList(%r)" % list(self)
+
+
+class NIter:
+    """
+    A value of the iter[t] type, which lazily produces its items one at a time
+    as it's iterated over, so a chain of iters only goes over its source once
+    without storing the items in between. Since N values are immutable,
+    iterating over it again starts from the beginning.
+    """
+
+    __slots__ = ("get_iterator",)
+
+    def __init__(self, get_iterator):
+        self.get_iterator = get_iterator
+
+    def __iter__(self):
+        return self.get_iterator()
 
 
 cmd_generic = NGenericType("t")
-n_cmd_type = NTypeVars("cmd", [cmd_generic])
+n_cmd_type = NTypeVars("cmd", [cmd_generic], key="cmd")
 
 maybe_generic = NGenericType("t")
 n_maybe_type = EnumType(
@@ -27,12 +440,13 @@ n_maybe_type = EnumType(
         ("none", []),
     ],
     [maybe_generic],
+    key="maybe",
 )
 none = EnumValue("none")
 
 
 def yes(value):
-    return EnumValue("yes", [value])
+    return EnumValue("yes", (value,))
 
 
 result_ok_generic = NGenericType("o")
@@ -44,12 +458,13 @@ n_result_type = EnumType(
         ("err", [result_err_generic]),
     ],
     [result_ok_generic, result_err_generic],
+    key="result",
 )
 
 
 def ok(value):
-    return EnumValue("ok", [value])
+    return EnumValue("ok", (value,))
 
 
 def err(value):
-    return EnumValue("err", [value])
+    return EnumValue("err", (value,))
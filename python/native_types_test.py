@@ -0,0 +1,172 @@
+# python -m unittest native_types_test.py
+
+import unittest
+from itertools import count
+
+from native_function import NativeFunction
+from native_functions import (
+    to_iter,
+    iter_map,
+    iter_filter,
+    iter_take,
+    iter_chunk,
+    iter_zip,
+)
+from native_types import NMap, NIter, NList
+
+
+def native(function):
+    return NativeFunction(None, [(None, None)], None, function)
+
+
+class NMapTestCases(unittest.TestCase):
+    def test_colliding_hashes(self):
+        # -1 and -2 have the same hash in CPython
+        self.assertEqual(hash(-1), hash(-2))
+        n_map = NMap().inserted(-1, "a").inserted(-2, "b").inserted(3, "c")
+        self.assertEqual(len(n_map), 3)
+        self.assertEqual(n_map[-1], "a")
+        self.assertEqual(n_map[-2], "b")
+        self.assertEqual(n_map.inserted(-2, "d")[-2], "d")
+        self.assertEqual(len(n_map.inserted(-2, "d")), 3)
+
+        removed = n_map.removed(-1)
+        self.assertEqual(len(removed), 2)
+        self.assertNotIn(-1, removed)
+        self.assertEqual(removed[-2], "b")
+        self.assertEqual(removed.removed(-1), removed)
+        self.assertIs(removed.removed(-1), removed)
+        self.assertEqual(list(removed.removed(-2).items()), [(3, "c")])
+
+    def test_deep_nodes(self):
+        # Keys that share their lowest bits are stored in nested nodes
+        keys = [i << 5 for i in range(40)] + [i << 10 for i in range(40)]
+        n_map = NMap()
+        expected = {}
+        for key in keys:
+            n_map = n_map.inserted(key, -key)
+            expected[key] = -key
+        self.assertEqual(dict(n_map.items()), expected)
+        for key in keys[::3]:
+            n_map = n_map.removed(key)
+            expected.pop(key, None)
+        self.assertEqual(len(n_map), len(expected))
+        self.assertEqual(dict(n_map.items()), expected)
+        self.assertEqual(list(n_map), list(expected))
+
+    def test_insertion_order(self):
+        n_map = NMap({"a": 1, "b": 2, "c": 3})
+        self.assertEqual(list(n_map), ["a", "b", "c"])
+        # Setting a key that's already in the map keeps its place
+        self.assertEqual(list(n_map.inserted("a", 4)), ["a", "b", "c"])
+        # A key that's removed and added again goes at the end
+        reinserted = n_map.removed("a").inserted("a", 5)
+        self.assertEqual(list(reinserted.items()), [("b", 2), ("c", 3), ("a", 5)])
+        self.assertEqual(list(reinserted.inserted("d", 6)), ["b", "c", "a", "d"])
+
+    def test_order_after_many_changes(self):
+        # Enough keys for several levels in the order trie, with most of them
+        # removed so that the map gets made again without the removed keys
+        n_map = NMap()
+        expected = {}
+        for key in range(2000):
+            n_map = n_map.inserted(key, key)
+            expected[key] = key
+        for key in range(0, 2000, 3):
+            n_map = n_map.inserted(key, -key)
+            expected[key] = -key
+        for key in range(1900):
+            if key % 5 != 0:
+                n_map = n_map.removed(key)
+                del expected[key]
+        for key in range(0, 100, 7):
+            n_map = n_map.inserted(key, "again")
+            expected[key] = "again"
+        self.assertEqual(list(n_map.items()), list(expected.items()))
+        self.assertLess(n_map.next_order, 2 * len(n_map) + 1)
+
+    def test_equality(self):
+        n_map = NMap({"a": 1, "b": 2})
+        self.assertEqual(n_map, NMap({"b": 2, "a": 1}))
+        self.assertEqual(n_map, n_map.inserted("c", 3).removed("c"))
+        self.assertNotEqual(n_map, n_map.inserted("b", 3))
+        self.assertNotEqual(n_map, n_map.inserted("c", 2))
+        self.assertNotEqual(n_map, n_map.removed("a").inserted("c", 1))
+
+    def test_structural_sharing(self):
+        n_map = NMap({i: str(i) for i in range(1000)})
+        inserted = n_map.inserted(1000, "new")
+        removed = n_map.removed(500)
+
+        # The old map is unchanged
+        self.assertEqual(len(n_map), 1000)
+        self.assertNotIn(1000, n_map)
+        self.assertEqual(n_map[500], "500")
+        self.assertEqual(inserted[1000], "new")
+        self.assertNotIn(500, removed)
+
+        # Only the nodes on the way to the changed key are copied
+        for changed, key in ((inserted, 1000), (removed, 500)):
+            different = [
+                index
+                for index, entry in n_map.root.items()
+                if changed.root.get(index) is not entry
+            ]
+            self.assertEqual(different, [key & 31])
+
+
+class NIterTestCases(unittest.TestCase):
+    def test_lazy(self):
+        seen = []
+
+        def record(item):
+            seen.append(item)
+            return item * 10
+
+        n_iter = iter_map(to_iter([1, 2, 3, 4, 5]), native(record))
+        self.assertEqual(seen, [])
+        self.assertEqual(NList(iter_take(n_iter, 2)), [10, 20])
+        self.assertEqual(seen, [1, 2])
+
+    def test_iterate_again(self):
+        n_iter = iter_filter(to_iter([1, 2, 3, 4]), native(lambda item: item % 2 == 0))
+        self.assertEqual(list(n_iter), [2, 4])
+        self.assertEqual(list(n_iter), [2, 4])
+
+    def test_take_infinite(self):
+        naturals = NIter(count)
+        squares = iter_map(naturals, native(lambda item: item * item))
+        self.assertEqual(NList(iter_take(squares, 5)), [0, 1, 4, 9, 16])
+        self.assertEqual(NList(iter_take(naturals, 0)), [])
+        self.assertEqual(NList(iter_take(naturals, -1)), [])
+        chunks = iter_take(iter_chunk(naturals, 2), 2)
+        self.assertEqual(NList(chunks), [[0, 1], [2, 3]])
+
+    def test_chunk_uneven(self):
+        chunks = iter_chunk(to_iter(range(7)), 3)
+        self.assertEqual(NList(chunks), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(
+            NList(iter_chunk(to_iter(range(6)), 3)), [[0, 1, 2], [3, 4, 5]]
+        )
+        self.assertEqual(NList(iter_chunk(to_iter([]), 3)), [])
+        self.assertEqual(NList(iter_chunk(to_iter([1, 2]), 0)), [])
+
+    def test_zip_uneven(self):
+        numbers = to_iter([1, 2, 3])
+        letters = to_iter(["a", "b"])
+        self.assertEqual(NList(iter_zip(numbers, letters)), [(1, "a"), (2, "b")])
+        self.assertEqual(NList(iter_zip(letters, numbers)), [("a", 1), ("b", 2)])
+        self.assertEqual(
+            NList(iter_zip(numbers, NIter(count))), [(1, 0), (2, 1), (3, 2)]
+        )
+
+    def test_collect(self):
+        collected = NList(iter_map(to_iter([1, 2, 3]), native(str)))
+        self.assertIsInstance(collected, NList)
+        self.assertEqual(collected, ["1", "2", "3"])
+        self.assertEqual(collected.appended("4"), ["1", "2", "3", "4"])
+        self.assertEqual(NList(to_iter([])), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,8 @@ effect or is asynchronous.
 
 
 class Cmd:
+    __slots__ = ("performer_getter", "map_functions", "dependent")
+
     def __init__(self, performer_getter, map_functions=None, dependent=None):
         # A non-async function that, when given the result from `dependent`,
         # returns a function (can be async or not) that performs the side
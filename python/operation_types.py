@@ -1,5 +1,12 @@
 from type import NTypeVars, NGenericType
-from native_types import n_list_type, list_generic, n_map_type, n_maybe_type
+from native_types import (
+    n_list_type,
+    list_generic,
+    n_iter_type,
+    iter_generic,
+    n_map_type,
+    n_maybe_type,
+)
 
 # Might move these into Scope one day because these might be scoped due to
 # implementations of traits.
@@ -96,7 +103,7 @@ unary_operation_types = {
 }
 comparable_types = ["int", "float"]
 legacy_iterable_types = [("int", "int")]
-iterable_types = [(n_list_type, list_generic)]
+iterable_types = [(n_list_type, list_generic), (n_iter_type, iter_generic)]
 assignment_types = {
     "ADD_EQUAL": "ADD",
     "DIV_EQUAL": "DIVIDE",
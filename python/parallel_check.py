@@ -0,0 +1,160 @@
+import contextlib
+import copy
+import io
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.reduction import ForkingPickler
+
+import lark
+
+import scope
+import tree_cache
+
+"""
+Type checks the files imported by a file in worker processes before the file
+itself is checked, so that files that don't import each other are checked at
+the same time.
+
+The imports are found up front by scanning the source of each file for `imp`,
+without parsing it. A file is sent to a worker once the files it imports have
+been checked, along with their results, and its own results are added to the
+modules of the run as they come back. Then the file is type checked as usual,
+finding every imported file already checked.
+
+Files in circular imports, and files that fail to check in a worker, such as
+because of a syntax error, are left to be checked as usual so that the errors
+are the same.
+
+Set the N_JOBS environment variable or use the --jobs flag to choose the
+number of worker processes. The default of 1 checks every file in this process.
+"""
+
+jobs = int(os.environ.get("N_JOBS") or 1)
+
+# `imp "file.n"` or the old `imp file`
+import_pattern = re.compile(r'\bimp(?:\s*("(?:[^"\\]|\\.)*")|\s+([A-Za-z_]\w*))')
+
+# Keep the end positions of tokens in the syntax trees and type errors sent
+# between processes, like the syntax tree cache
+ForkingPickler.register(lark.Token, tree_cache.reduce_token)
+
+
+def find_imports(file_path):
+    """
+    Guesses the normalized paths of the files a file imports from its source.
+    Imports in comments and strings are included too, which only means that
+    a file might be checked without being needed.
+    """
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            source = f.read()
+    except OSError:
+        return []
+    imports = []
+    for match in import_pattern.finditer(source):
+        string, name = match.groups()
+        rel_file_path = scope.unescape(string[1:-1]) if string else name + ".n"
+        import_path = os.path.normpath(
+            os.path.join(os.path.dirname(file_path), rel_file_path)
+        )
+        if os.path.isfile(import_path) and import_path not in imports:
+            imports.append(import_path)
+    return imports
+
+
+def get_import_graph(file_path):
+    """
+    Returns the files imported by a file, directly or not, and the files each
+    of them imports.
+    """
+    graph = {}
+    unvisited = find_imports(file_path)
+    while unvisited:
+        import_path = unvisited.pop()
+        if import_path not in graph:
+            graph[import_path] = find_imports(import_path)
+            unvisited += graph[import_path]
+    graph.pop(os.path.normpath(file_path), None)
+    return graph
+
+
+def get_dependencies(graph, file_path, modules):
+    """
+    Gets the checked modules of the files a file imports, directly or not,
+    without their syntax trees, which aren't needed to check the file.
+    """
+    dependencies = {}
+    unvisited = list(graph[file_path])
+    while unvisited:
+        import_path = unvisited.pop()
+        if import_path not in dependencies:
+            dependency = copy.copy(modules[import_path])
+            dependency.tree = None
+            dependencies[import_path] = dependency
+            unvisited += graph[import_path]
+    return dependencies
+
+
+def check_file(file_path, base_path, dependencies):
+    """
+    Type checks a file in a worker process, given the results of the files it
+    imports. Returns every file it checked, which includes imports that
+    `find_imports` missed.
+    """
+    modules = dict(dependencies)
+    # Syntax errors are printed before exiting, but the file will be checked
+    # again as usual to show them
+    with contextlib.redirect_stdout(io.StringIO()):
+        scope.type_check_file(file_path, base_path, [], modules)
+    checked = {
+        import_path: module
+        for import_path, module in modules.items()
+        if import_path not in dependencies
+    }
+    return checked, dict(scope.unit_test_results)
+
+
+def check_imports(file_path, base_path, modules):
+    """
+    Type checks the files imported by a file, directly or not, in worker
+    processes, adding them to `modules`.
+    """
+    graph = get_import_graph(file_path)
+    if len(graph) < 2:
+        return
+    unchecked = {
+        import_path
+        for import_path in graph
+        if not (import_path in modules and modules[import_path].checked)
+    }
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        checking = {}
+        while True:
+            for import_path in sorted(unchecked):
+                if all(
+                    dependency in modules and modules[dependency].checked
+                    for dependency in graph[import_path]
+                ):
+                    unchecked.remove(import_path)
+                    future = executor.submit(
+                        check_file,
+                        import_path,
+                        base_path,
+                        get_dependencies(graph, import_path, modules),
+                    )
+                    checking[future] = import_path
+            if not checking:
+                # The rest are in circular imports or import a file that failed
+                break
+            done, _ = wait(checking, return_when=FIRST_COMPLETED)
+            for future in done:
+                import_path = checking.pop(future)
+                try:
+                    checked, unit_test_results = future.result()
+                except (Exception, SystemExit):
+                    continue
+                for checked_path, module in checked.items():
+                    if checked_path not in modules:
+                        modules[checked_path] = module
+                scope.unit_test_results.update(unit_test_results)
@@ -15,4 +15,23 @@ syntaxpath = path.join(basepath, "syntax.lark")
 with open(syntaxpath, "r") as f:
     parse = f.read()
 
-n_parser = Lark(parse, start="start", propagate_positions=True)
+
+class NParser:
+    def __init__(self, grammar):
+        self.grammar = grammar
+        # The parser is only built when it's first needed because building a
+        # Lark parser isn't free.
+        self.parser = None
+
+    def get_parser(self):
+        if self.parser is None:
+            self.parser = Lark(self.grammar, start="start", propagate_positions=True)
+        return self.parser
+
+    def parse(self, text):
+        return self.get_parser().parse(text)
+
+
+# The parser shared by the main file and every imported file. It only builds
+# the grammar the first time a file actually needs to be parsed.
+n_parser = NParser(parse)
@@ -0,0 +1,106 @@
+# python parse_benchmark.py [--repeat N] [--imports N]
+
+import argparse
+import time
+from os import walk, path
+
+import lark
+
+from parse import NParser, parse, basepath
+
+benchmark_dirs = ["../tests/syntax/", "../examples/"]
+
+
+def get_benchmark_files():
+    file_paths = []
+    for directory in benchmark_dirs:
+        # Get files in directory https://stackoverflow.com/a/3207973
+        _, _, file_names = next(walk(path.join(basepath, directory)))
+        for file_name in sorted(file_names):
+            if file_name.endswith(".n"):
+                file_paths.append(path.join(basepath, directory, file_name))
+    return file_paths
+
+
+def benchmark_parser(file_paths, repeat):
+    """
+    Parses every file `repeat` times with a fresh NParser, printing the time it
+    took to build the parser and to parse each file.
+    """
+    n_parser = NParser(parse)
+    start = time.perf_counter()
+    n_parser.get_parser()
+    build_time = time.perf_counter() - start
+    print("built parser in %.3fs" % build_time)
+
+    total = 0
+    for file_path in file_paths:
+        with open(file_path, "r", encoding="utf-8") as file:
+            text = file.read()
+        start = time.perf_counter()
+        failed = False
+        for _ in range(repeat):
+            try:
+                n_parser.parse(text)
+            except lark.exceptions.UnexpectedInput:
+                failed = True
+        elapsed = (time.perf_counter() - start) / repeat
+        total += elapsed
+        print(
+            "  %-60s %8.4fs%s"
+            % (
+                path.relpath(file_path, basepath),
+                elapsed,
+                " (syntax error)" if failed else "",
+            )
+        )
+    print("  %-60s %8.4fs" % ("total", total))
+    return build_time + total
+
+
+def benchmark_startup(file_paths, imports):
+    """
+    Simulates a program that imports `imports` files by parsing the benchmark
+    files round robin, once building a new parser for every file (how imports
+    used to be parsed) and once sharing a single parser.
+    """
+    texts = []
+    for file_path in file_paths:
+        with open(file_path, "r", encoding="utf-8") as file:
+            texts.append(file.read())
+    texts = [texts[i % len(texts)] for i in range(imports)]
+
+    def parse_all(get_parser):
+        start = time.perf_counter()
+        for text in texts:
+            try:
+                get_parser().parse(text)
+            except lark.exceptions.UnexpectedInput:
+                pass
+        return time.perf_counter() - start
+
+    per_import = parse_all(lambda: NParser(parse))
+    shared_parser = NParser(parse)
+    shared = parse_all(lambda: shared_parser)
+    print("startup with %d imports:" % imports)
+    print("  %-60s %8.4fs" % ("new parser per import", per_import))
+    print("  %-60s %8.4fs" % ("shared parser", shared))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures how long it takes to parse the syntax tests and examples."
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--imports",
+        type=int,
+        help="Instead, compare building one parser per imported file with sharing one parser.",
+    )
+    args = parser.parse_args()
+
+    file_paths = get_benchmark_files()
+    if args.imports is not None:
+        benchmark_startup(file_paths, args.imports)
+    else:
+        benchmark_parser(file_paths, args.repeat)
@@ -5,12 +5,11 @@ from inspect import signature
 
 import lark
 import re
-from lark import Lark
 from colorama import Fore, Style
 import importlib.util
 
 from variable import Variable
-from function import Function
+from function import Function, pause_call
 from native_function import NativeFunction
 from type import (
     NType,
@@ -21,12 +20,22 @@ from type import (
     NModuleWrapper,
     apply_generics,
     apply_generics_to,
+    Generics,
     resolve_equal_types,
     NClass,
 )
 from enums import EnumType, EnumValue, EnumPattern
 from native_function import NativeFunction
-from native_types import n_list_type, n_cmd_type, n_maybe_type, none, yes, NMap
+from native_types import (
+    n_list_type,
+    n_cmd_type,
+    n_maybe_type,
+    none,
+    yes,
+    NMap,
+    NList,
+    NIter,
+)
 from ncmd import Cmd
 from type_check_error import TypeCheckError, display_type
 from display import display_value
@@ -39,34 +48,36 @@ from operation_types import (
     assignment_types,
     assignment_expression_types,
 )
-from file import File
+from file import File, LazyFile
 from imported_error import ImportedError
+from imported_module import ImportedModule
+import interface_cache
 import native_functions
 from syntax_error import format_error
 from classes import NConstructor
 from modules import libraries
+from parse import n_parser
+import compiler
 
 unit_test_results = {}
 
-basepath = ""
-if getattr(sys, "frozen", False):
-    basepath = os.path.dirname(sys.executable)
-elif __file__:
-    basepath = os.path.dirname(__file__)
-
-syntaxpath = os.path.join(basepath, "syntax.lark")
 
-
-def parse_file(file_path, base_path, parent_imports):
+def parse_file(file_path, base_path, parent_imports, modules):
     import_scope = Scope(
-        base_path=base_path, file_path=file_path, parent_imports=parent_imports
+        base_path=base_path,
+        file_path=file_path,
+        parent_imports=parent_imports,
+        modules=modules,
     )
     native_functions.add_funcs(import_scope)
 
-    with open(syntaxpath, "r") as f:
-        parse = f.read()
-    n_parser = Lark(parse, start="start", propagate_positions=True)
+    module = modules.get(os.path.normpath(file_path))
+    if module is not None:
+        return import_scope, module
 
+    # Taken before the file is read, so that a change made while the file is
+    # being checked isn't mistaken for what was checked
+    mtime = os.stat(file_path).st_mtime_ns
     with open(file_path, "r", encoding="utf-8") as f:
         file = File(f, name=os.path.relpath(file_path, start=base_path))
 
@@ -79,28 +90,121 @@ def parse_file(file_path, base_path, parent_imports):
         print(format_error(e, file))
         sys.exit()
 
-    return import_scope, tree, file
+    module = ImportedModule(tree, file, mtime)
+    modules[os.path.normpath(file_path)] = module
+    return import_scope, module
 
 
-async def eval_file(file_path, base_path, parent_imports):
-    import_scope, tree, _ = parse_file(file_path, base_path, parent_imports)
+async def eval_file(file_path, base_path, parent_imports, modules):
+    """
+    Evaluates an imported file, or returns the already evaluated module if the
+    file was already imported during this run.
+    """
+    import_scope, module = parse_file(file_path, base_path, parent_imports, modules)
+    if module.evaluated_scope is not None:
+        return module
 
     import_scope.variables = {
         **import_scope.variables,
-        **(await parse_tree(tree, import_scope)).variables,
+        **(await parse_tree(module.tree, import_scope, module.file)).variables,
+    }
+    module.evaluated_scope = import_scope
+    module.public_values = {
+        key: variable.value
+        for key, variable in import_scope.variables.items()
+        if variable.public
     }
-    return import_scope
+    module.unit_tests += import_scope.unit_tests
+    return module
 
 
-def type_check_file(file_path, base_path, parent_imports):
-    import_scope, tree, text_file = parse_file(file_path, base_path, parent_imports)
+def type_check_file(file_path, base_path, parent_imports, modules):
+    """
+    Type checks an imported file, or returns the already checked module if the
+    file was already imported during this run.
+    """
+    import_scope, module = parse_file(file_path, base_path, parent_imports, modules)
+    if module.checked:
+        return module
 
-    scope = type_check(tree, import_scope)
+    if interface_cache.enabled:
+        module.interface_key = get_interface_key(
+            module, file_path, base_path, parent_imports, modules
+        )
+        if module.interface_key is not None:
+            interface = interface_cache.load_interface(file_path, module.interface_key)
+            if interface is not None:
+                module.load_interface(interface)
+                return module
+
+    scope = type_check(module.tree, import_scope)
     import_scope.variables = {**import_scope.variables, **scope.variables}
-    import_scope.public_types = {**import_scope.public_types, **scope.public_types}
-    import_scope.errors += scope.errors[:]
-    import_scope.warnings += scope.warnings[:]
-    return import_scope, text_file
+    module.checked = True
+    module.public_types = {**import_scope.public_types, **scope.public_types}
+    module.errors = import_scope.errors + scope.errors
+    module.warnings = import_scope.warnings + scope.warnings
+    module.public_variable_types = {
+        key: variable.type
+        for key, variable in import_scope.variables.items()
+        if variable.public
+    }
+    module.unit_tests = import_scope.unit_tests[:] + module.unit_tests
+    if module.interface_key is not None:
+        interface_cache.save_interface(
+            file_path, module.interface_key, module.get_interface()
+        )
+    return module
+
+
+def get_interface_key(module, file_path, base_path, parent_imports, modules):
+    """
+    Gets the key of the cached interface of an imported file, which depends on
+    the interfaces of the files it imports, so they are type checked first.
+    Returns None if the file is in a circular import.
+    """
+    importers = parent_imports + [os.path.normpath(file_path)]
+    import_keys = []
+    for import_path in get_imports(module.tree, file_path):
+        if import_path in importers:
+            return None
+        if not os.path.isfile(import_path):
+            import_keys.append("missing " + os.path.relpath(import_path, base_path))
+            continue
+        imported = type_check_file(import_path, base_path, importers, modules)
+        if imported.interface_key is None:
+            return None
+        import_keys.append(imported.interface_key)
+    return interface_cache.get_key(
+        module.file.name, module.file.get_text(), import_keys
+    )
+
+
+def get_import_path(token):
+    """
+    Gets the path of the file imported by an `imp` expression, relative to the
+    importing file.
+    """
+    if token.type == "STRING":
+        return unescape(token.value[1:-1])
+    else:
+        # Support old syntax
+        return token.value + ".n"
+
+
+def get_imports(tree, file_path):
+    """
+    Finds the normalized paths of the files imported by a syntax tree without
+    type checking it.
+    """
+    return [
+        os.path.normpath(
+            os.path.join(
+                os.path.dirname(file_path), get_import_path(subtree.children[0])
+            )
+        )
+        for subtree in tree.iter_subtrees()
+        if subtree.data == "impn"
+    ]
 
 
 def type_check(tree, import_scope):
@@ -117,11 +221,11 @@ def type_check(tree, import_scope):
     return scope
 
 
-async def parse_tree(tree, import_scope):
+async def parse_tree(tree, import_scope, file=None):
     if tree.data == "start":
         scope = import_scope.new_scope(inherit_errors=False)
-        for child in tree.children:
-            await scope.eval_command(child)
+        for _, command in compiler.compile_program(tree, file):
+            await command(scope)
         return scope
     else:
         raise SyntaxError("Unable to run parse_tree on non-starting branch")
@@ -157,6 +261,124 @@ def get_destructure_pattern(tree):
     return (None if tree.value == "_" else tree.value, tree)
 
 
+def get_pattern_names(pattern_and_src):
+    pattern, _ = pattern_and_src
+    if isinstance(pattern, dict):
+        return [name for sub in pattern.values() for name in get_pattern_names(sub)]
+    elif isinstance(pattern, (tuple, list)):
+        return [name for sub in pattern for name in get_pattern_names(sub)]
+    elif isinstance(pattern, EnumPattern):
+        return [name for sub in pattern.patterns for name in get_pattern_names(sub)]
+    return [] if pattern is None else [pattern]
+
+
+def get_bound_names(tree):
+    """
+    Returns the names that a tree assigns or adds to a scope when evaluated,
+    not counting the trees inside it.
+    """
+    if tree.data in ("declare", "for"):
+        name_type = tree.children[1 if tree.data == "declare" else 0]
+        return get_pattern_names(get_destructure_pattern(name_type.children[0]))
+    elif tree.data in ("conditional_let", "match_enum_entry"):
+        return get_pattern_names(get_destructure_pattern(tree.children[0]))
+    elif tree.data == "arguments":
+        _, arguments = get_arguments(tree)
+        return [
+            name
+            for argument in arguments
+            for name in get_pattern_names(get_destructure_pattern(argument.children[0]))
+        ]
+    elif tree.data in ("imp", "assign_value", "declaration_with_typevars"):
+        return [tree.children[0].value]
+    elif tree.data == "class_definition":
+        return [tree.children[1].value]
+    elif tree.data == "enum_constructors":
+        # Over-approximated with the names of the types of the constructors'
+        # arguments, which only means they aren't cached
+        return [
+            token.value
+            for token in tree.scan_values(lambda value: isinstance(value, lark.Token))
+            if token.type == "NAME"
+        ]
+    return []
+
+
+class NameCache:
+    """
+    The Variables of names in a file that always refer to the same Variable
+    while it's evaluated, so that the tree engine can look them up without
+    going through every parent scope.
+
+    These are names that the file never declares or assigns, such as native
+    functions, and names declared with `let` once at the top level and never
+    bound or assigned anywhere else. The latter are only cached once declared,
+    because before that, the name could refer to a native function.
+    """
+
+    def __init__(self, tree):
+        self.variables = {}
+        counts = {}
+        for subtree in tree.iter_subtrees():
+            for name in get_bound_names(subtree):
+                counts[name] = counts.get(name, 0) + 1
+        # Names that the file binds somewhere, which are only cached if they're
+        # in `declared`
+        self.bound = set(counts)
+        # Names that are only bound by one top level declaration
+        self.declared = set()
+        for child in tree.children:
+            if child.data in ("main_instruction", "last_instruction"):
+                child = child.children[0]
+            if child.data != "instruction" or child.children[0].data != "declare":
+                continue
+            pattern, _ = get_destructure_pattern(
+                child.children[0].children[1].children[0]
+            )
+            if isinstance(pattern, str) and counts[pattern] == 1:
+                self.declared.add(pattern)
+
+    def declare(self, name, variable):
+        if name in self.declared:
+            self.variables[name] = variable
+
+
+# The values of literal tokens by token, so that each literal is only worked out
+# once. Tokens with the same type and text are equal, so they share an entry.
+literal_values = {}
+
+
+def get_literal_value(value):
+    """
+    Returns the value of a literal token, which doesn't depend on the scope.
+    """
+    if value.type == "HEX":
+        return int(value.value, 16)
+    if value.type == "BINARY":
+        return int(value.value, 2)
+    if value.type == "OCTAL":
+        return int(value.value, 8)
+    if value.type == "NUMBER":
+        if "." in str(value.value):
+            return float(value)
+        return int(value)
+    elif value.type == "STRING":
+        return unescape(value[1:-1])
+    elif value.type == "BOOLEAN":
+        if value.value == "false":
+            return False
+        elif value.value == "true":
+            return True
+        else:
+            raise SyntaxError("Unexpected boolean value %s" % value.value)
+    elif value.type == "UNIT":
+        return ()
+    else:
+        raise SyntaxError(
+            "Unexpected value type %s value %s" % (value.type, value.value)
+        )
+
+
 def pattern_to_name(pattern_and_src):
     pattern, _ = pattern_and_src
     if isinstance(pattern, str):
@@ -219,6 +441,9 @@ class Scope:
         unit_tests=None,
         internal_traits=None,
         enum_variants=None,
+        modules=None,
+        trace_file=None,
+        names=None,
     ):
         self.parent = parent
         self.parent_function = parent_function
@@ -237,10 +462,21 @@ class Scope:
         self.parent_type = parent_type
 
         self.stack_trace = stack_trace if stack_trace is not None else []
+        # The file shown in stack trace frames pushed from this scope
+        self.trace_file = (
+            trace_file
+            if trace_file is not None
+            else LazyFile(self.file_path, self.base_path)
+        )
         self.unit_tests = unit_tests if unit_tests is not None else []
 
         self.internal_traits = internal_traits if internal_traits is not None else {}
         self.enum_variants = enum_variants if enum_variants is not None else {}
+        # The N files imported during this run by their normalized path, so
+        # they're only parsed, type checked, and evaluated once
+        self.modules = modules if modules is not None else {}
+        # The NameCache of the file being evaluated by the tree engine
+        self.names = names
 
     def new_scope(
         self,
@@ -265,6 +501,9 @@ class Scope:
             unit_tests=self.unit_tests if inherit_unit_tests else [],
             internal_traits=self.internal_traits if inherit_internal_traits else {},
             enum_variants=self.enum_variants if inherit_enum_variants else {},
+            modules=self.modules,
+            trace_file=self.trace_file,
+            names=self.names,
         )
         
     def get_value_internal_traits(self, value):
@@ -274,8 +513,10 @@ class Scope:
             return self.internal_traits.get("map")
         elif isinstance(value, dict):
             return value
-        elif isinstance(value, list):
+        elif isinstance(value, (list, NList)):
             return self.internal_traits.get("list")
+        elif isinstance(value, NIter):
+            return self.internal_traits.get("iter")
         elif isinstance(value, tuple):
             return self.internal_traits.get("tuple")
         elif isinstance(value, bool):
@@ -561,35 +802,19 @@ class Scope:
             )
 
     """
-    Sets variables from a pattern given a value or a type and returns whether
-    the entire pattern matched.
-
-    This is used by both type-checking (with warn=True) and interpreting
-    (warn=False). During type-checking, `value_or_type` is the type (notably,
-    tuples are lists), so it must determine whether it's even reasonable to
-    destructure the type (for example, it doesn't make sense to destructure a
-    record as a list), and error accordingly. During interpreting,
-    `value_or_type` is the actual value, and thanks to the type-checker, the
-    value should be guaranteed to fit the pattern.
+    Sets variables from a pattern given a type while type checking, and reports
+    errors if the type can't be destructured by the pattern. For example, it
+    doesn't make sense to destructure a record as a list. Note that tuple types
+    are lists.
 
-    - warn=True - Is the pattern valid?
-    - warn=False - Does the pattern match?
-
-    Note that this sets variables while checking the pattern, so it's possible
-    that variables are assigned even if the entire pattern doesn't match.
-    Fortunately, this is only used in cases where the conditional let would
-    create a new scope (such as in an if statement), so the extra variables can
-    be discarded if the pattern ends up not matching.
-
-    NOTE: This must return True if warn=True. (In other words, don't short
-    circuit if a pattern fails to match.)
+    `certain` is whether the pattern must always match, such as in a let
+    declaration, rather than in a conditional let or match.
     """
 
-    def assign_to_pattern(
+    def type_check_pattern(
         self,
         pattern_and_src,
-        value_or_type,
-        warn=False,
+        ty,
         path=None,
         public=False,
         certain=False,
@@ -598,175 +823,138 @@ class Scope:
         path_name = path or "the value"
         pattern, src = pattern_and_src
         if isinstance(pattern, dict):
-            is_dict = isinstance(value_or_type, dict)
+            is_dict = isinstance(ty, dict)
             if is_dict:
                 # Should this be an error? Warning?
-                unused_keys = [
-                    key for key in value_or_type.keys() if key not in pattern
-                ]
+                unused_keys = [key for key in ty.keys() if key not in pattern]
                 if len(unused_keys) > 0:
                     self.errors.append(
                         TypeCheckError(
                             src,
                             "%s (%s) has field(s) %s, but you haven't destructured them. (Hint: use `_` to denote unused fields.)"
                             % (
-                                display_type(value_or_type),
+                                display_type(ty),
                                 path_name,
                                 ", ".join(unused_keys),
                             ),
                         )
                     )
-            else:
-                if warn:
-                    if value_or_type is not None:
-                        self.errors.append(
-                            TypeCheckError(
-                                src,
-                                "I can't destructure %s as a record because %s is not a record."
-                                % (path_name, display_type(value_or_type)),
-                            )
-                        )
-                else:
-                    raise TypeError("Destructuring non-record as record.")
+            elif ty is not None:
+                self.errors.append(
+                    TypeCheckError(
+                        src,
+                        "I can't destructure %s as a record because %s is not a record."
+                        % (path_name, display_type(ty)),
+                    )
+                )
             for key, (sub_pattern, parse_src) in pattern.items():
-                value = value_or_type.get(key) if is_dict else None
+                value = ty.get(key) if is_dict else None
                 if is_dict and value is None:
-                    if warn:
-                        self.errors.append(
-                            TypeCheckError(
-                                parse_src,
-                                "I can't get the field %s from %s because %s doesn't have that field."
-                                % (key, path_name, display_type(value_or_type)),
-                            )
+                    self.errors.append(
+                        TypeCheckError(
+                            parse_src,
+                            "I can't get the field %s from %s because %s doesn't have that field."
+                            % (key, path_name, display_type(ty)),
                         )
-                    else:
-                        raise TypeError("Given record doesn't have a key %s." % key)
-                valid = self.assign_to_pattern(
+                    )
+                self.type_check_pattern(
                     (sub_pattern, parse_src),
                     value,
-                    warn,
                     "%s.%s" % (path or "<record>", key),
                     public,
                     certain=certain,
                     mutable=mutable,
                 )
-                if not valid:
-                    return False
         elif isinstance(pattern, tuple):
             # I believe the interpreter uses actual Python tuples, while the
             # type checker uses lists for tuple types. We should fix that for
             # the type checker.
-            is_tuple = (
-                isinstance(value_or_type, list)
-                if warn
-                else isinstance(value_or_type, tuple)
-            )
-            if not is_tuple:
-                if warn:
-                    if value_or_type is not None:
-                        self.errors.append(
-                            TypeCheckError(
-                                src,
-                                "I can't destructure %s as a tuple because %s is not a tuple."
-                                % (path_name, display_type(value_or_type)),
-                            )
+            is_tuple = isinstance(ty, list)
+            if not is_tuple and ty is not None:
+                self.errors.append(
+                    TypeCheckError(
+                        src,
+                        "I can't destructure %s as a tuple because %s is not a tuple."
+                        % (path_name, display_type(ty)),
+                    )
+                )
+            if is_tuple and len(pattern) != len(ty):
+                if len(pattern) > len(ty):
+                    _, parse_src = pattern[len(ty)]
+                    self.errors.append(
+                        TypeCheckError(
+                            parse_src,
+                            "I can't destructure %d items from a %s."
+                            % (len(pattern), display_type(ty)),
                         )
+                    )
                 else:
-                    raise TypeError("Destructuring non-record as record.")
-            if is_tuple and len(pattern) != len(value_or_type):
-                if warn:
-                    if len(pattern) > len(value_or_type):
-                        _, parse_src = pattern[len(value_or_type)]
-                        self.errors.append(
-                            TypeCheckError(
-                                parse_src,
-                                "I can't destructure %d items from a %s."
-                                % (len(pattern), display_type(value_or_type)),
-                            )
-                        )
-                    else:
-                        self.errors.append(
-                            TypeCheckError(
-                                src,
-                                "I can't destructure only %d items from a %s. (Hint: use `_` to denote unused members of a destructured tuple.)"
-                                % (len(pattern), display_type(value_or_type)),
-                            )
+                    self.errors.append(
+                        TypeCheckError(
+                            src,
+                            "I can't destructure only %d items from a %s. (Hint: use `_` to denote unused members of a destructured tuple.)"
+                            % (len(pattern), display_type(ty)),
                         )
-                else:
-                    raise TypeError(
-                        "Number of destructured values from tuple doesn't match tuple length."
                     )
             for i, (sub_pattern, parse_src) in enumerate(pattern):
-                value = (
-                    value_or_type[i] if is_tuple and i < len(value_or_type) else None
-                )
-                valid = self.assign_to_pattern(
+                self.type_check_pattern(
                     (sub_pattern, parse_src),
-                    value,
-                    warn,
+                    ty[i] if is_tuple and i < len(ty) else None,
                     "%s.%d" % (path or "<tuple>", i),
                     public,
                     certain=certain,
                     mutable=mutable,
                 )
-                if not valid:
-                    return False
         elif isinstance(pattern, EnumPattern):
-            if warn:
-                problem = False
-                if not isinstance(value_or_type, EnumType):
-                    if value_or_type is not None:
-                        self.errors.append(
-                            TypeCheckError(
-                                src,
-                                "I cannot destructure %s as an enum because it's a %s."
-                                % (path_name, display_type(value_or_type)),
-                            )
+            problem = False
+            if not isinstance(ty, EnumType):
+                if ty is not None:
+                    self.errors.append(
+                        TypeCheckError(
+                            src,
+                            "I cannot destructure %s as an enum because it's a %s."
+                            % (path_name, display_type(ty)),
                         )
-                    problem = True
-                else:
-                    variant_types = value_or_type.get_types(pattern.variant)
-                    if variant_types is None:
-                        self.errors.append(
-                            TypeCheckError(
-                                src,
-                                "%s has no variant %s because it's a %s."
-                                % (
-                                    path_name,
-                                    pattern.variant,
-                                    display_type(value_or_type),
-                                ),
-                            )
+                    )
+                problem = True
+            else:
+                variant_types = ty.get_types(pattern.variant)
+                if variant_types is None:
+                    self.errors.append(
+                        TypeCheckError(
+                            src,
+                            "%s has no variant %s because it's a %s."
+                            % (
+                                path_name,
+                                pattern.variant,
+                                display_type(ty),
+                            ),
                         )
-                        problem = True
-                    elif len(pattern.patterns) < len(variant_types):
-                        self.errors.append(
-                            TypeCheckError(
-                                src,
-                                "Variant %s has %d fields, but you only destructure %d of them."
-                                % (
-                                    pattern.variant,
-                                    len(variant_types),
-                                    len(pattern.patterns),
-                                ),
-                            )
+                    )
+                    problem = True
+                elif len(pattern.patterns) < len(variant_types):
+                    self.errors.append(
+                        TypeCheckError(
+                            src,
+                            "Variant %s has %d fields, but you only destructure %d of them."
+                            % (
+                                pattern.variant,
+                                len(variant_types),
+                                len(pattern.patterns),
+                            ),
                         )
-                        problem = True
-                    elif len(pattern.patterns) > len(variant_types):
-                        self.errors.append(
-                            TypeCheckError(
-                                pattern.patterns[len(variant_types)][1],
-                                "Variant %s only has %d fields."
-                                % (pattern.variant, len(variant_types)),
-                            )
+                    )
+                    problem = True
+                elif len(pattern.patterns) > len(variant_types):
+                    self.errors.append(
+                        TypeCheckError(
+                            pattern.patterns[len(variant_types)][1],
+                            "Variant %s only has %d fields."
+                            % (pattern.variant, len(variant_types)),
                         )
-                        problem = True
-            else:
-                if not isinstance(value_or_type, EnumValue):
-                    raise TypeError("Destructuring non-enum as enum.")
-                elif pattern.variant != value_or_type.variant:
-                    return False
-            if warn and not problem and certain and len(value_or_type.variants) > 1:
+                    )
+                    problem = True
+            if not problem and certain and len(ty.variants) > 1:
                 self.errors.append(
                     TypeCheckError(
                         src,
@@ -775,50 +963,36 @@ class Scope:
                             path_name,
                             pattern.variant,
                             (
-                                value_or_type.variants[1]
-                                if value_or_type.variants[0][0] == pattern.variant
-                                else value_or_type.variants[0]
+                                ty.variants[1]
+                                if ty.variants[0][0] == pattern.variant
+                                else ty.variants[0]
                             )[0],
                         ),
                     )
                 )
                 problem = True
             for i, (sub_pattern, parse_src) in enumerate(pattern.patterns):
-                if warn:
-                    value = None if problem else variant_types[i]
-                else:
-                    value = value_or_type.values[i]
-                valid = self.assign_to_pattern(
+                self.type_check_pattern(
                     (sub_pattern, parse_src),
-                    value,
-                    warn,
+                    None if problem else variant_types[i],
                     "%s.%s#%d" % (path or "<enum>", pattern.variant, i + 1),
                     public,
                     certain=certain,
                     mutable=mutable,
                 )
-                if not valid:
-                    return False
         elif isinstance(pattern, list):
-            if warn:
-                if (
-                    not isinstance(value_or_type, NTypeVars)
-                    or value_or_type.base_type is not n_list_type
-                ):
-                    if value_or_type is not None:
-                        self.errors.append(
-                            TypeCheckError(
-                                src,
-                                "I cannot destructure %s as a list because it's a %s."
-                                % (path_name, display_type(value_or_type)),
-                            )
+            if not isinstance(ty, NTypeVars) or ty.base_type is not n_list_type:
+                if ty is not None:
+                    self.errors.append(
+                        TypeCheckError(
+                            src,
+                            "I cannot destructure %s as a list because it's a %s."
+                            % (path_name, display_type(ty)),
                         )
-                    return True
-                contained_type = value_or_type.typevars[0]
-            else:
-                if not isinstance(value_or_type, list):
-                    raise TypeError("Destructuring non-list as list.")
-            if warn and certain:
+                    )
+                return
+            contained_type = ty.typevars[0]
+            if certain:
                 self.errors.append(
                     TypeCheckError(
                         src,
@@ -830,27 +1004,75 @@ class Scope:
                         ),
                     )
                 )
-            if not warn and len(value_or_type) != len(pattern):
-                return False
             for i, (sub_pattern, parse_src) in enumerate(pattern):
-                valid = self.assign_to_pattern(
+                self.type_check_pattern(
                     (sub_pattern, parse_src),
-                    contained_type if warn else value_or_type[i],
-                    warn,
+                    contained_type,
                     "%s[%d]" % (path or "<enum variant>", i),
                     public,
                     certain=certain,
                     mutable=mutable,
                 )
-                if not valid:
-                    return False
         elif pattern is not None:
             name = pattern
-            if warn and name in self.variables:
+            if name in self.variables:
                 self.errors.append(
                     TypeCheckError(src, "You've already defined `%s`." % name)
                 )
-            self.variables[name] = Variable(value_or_type, value_or_type, public, mutable)
+            self.variables[name] = Variable(ty, ty, public, mutable)
+
+    """
+    Sets variables from a pattern given a value while interpreting, and returns
+    whether the entire pattern matched. The type checker has already made sure
+    that the value has the right shape, so all that can fail is an enum
+    variant or list length not matching.
+
+    Note that this sets variables while checking the pattern, so it's possible
+    that variables are assigned even if the entire pattern doesn't match.
+    Fortunately, this is only used in cases where the conditional let would
+    create a new scope (such as in an if statement), so the extra variables can
+    be discarded if the pattern ends up not matching.
+    """
+
+    def bind_pattern(self, pattern_and_src, value, public=False, mutable=False):
+        pattern, _ = pattern_and_src
+        if isinstance(pattern, dict):
+            if not isinstance(value, dict):
+                raise TypeError("Destructuring non-record as record.")
+            for key, sub_pattern in pattern.items():
+                entry = value.get(key)
+                if entry is None:
+                    raise TypeError("Given record doesn't have a key %s." % key)
+                if not self.bind_pattern(sub_pattern, entry, public, mutable):
+                    return False
+        elif isinstance(pattern, tuple):
+            if not isinstance(value, tuple):
+                raise TypeError("Destructuring non-record as record.")
+            if len(pattern) != len(value):
+                raise TypeError(
+                    "Number of destructured values from tuple doesn't match tuple length."
+                )
+            for sub_pattern, item in zip(pattern, value):
+                if not self.bind_pattern(sub_pattern, item, public, mutable):
+                    return False
+        elif isinstance(pattern, EnumPattern):
+            if not isinstance(value, EnumValue):
+                raise TypeError("Destructuring non-enum as enum.")
+            elif pattern.variant != value.variant:
+                return False
+            for sub_pattern, item in zip(pattern.patterns, value.values):
+                if not self.bind_pattern(sub_pattern, item, public, mutable):
+                    return False
+        elif isinstance(pattern, list):
+            if not isinstance(value, (list, NList)):
+                raise TypeError("Destructuring non-list as list.")
+            if len(value) != len(pattern):
+                return False
+            for sub_pattern, item in zip(pattern, value):
+                if not self.bind_pattern(sub_pattern, item, public, mutable):
+                    return False
+        elif pattern is not None:
+            self.variables[pattern] = Variable(value, value, public, mutable)
         return True
 
     async def eval_record_entry(self, entry):
@@ -870,33 +1092,20 @@ class Scope:
             list_val.append(val)
 
     def eval_value(self, value):
-        if value.type == "HEX":
-            return int(value.value, 16)
-        if value.type == "BINARY":
-            return int(value.value, 2)
-        if value.type == "OCTAL":
-            return int(value.value, 8)
-        if value.type == "NUMBER":
-            if "." in str(value.value):
-                return float(value)
-            return int(value)
-        elif value.type == "STRING":
-            return unescape(value[1:-1])
-        elif value.type == "BOOLEAN":
-            if value.value == "false":
-                return False
-            elif value.value == "true":
-                return True
-            else:
-                raise SyntaxError("Unexpected boolean value %s" % value.value)
-        elif value.type == "NAME":
-            return self.get_variable(value.value).value
-        elif value.type == "UNIT":
-            return ()
-        else:
-            raise SyntaxError(
-                "Unexpected value type %s value %s" % (value.type, value.value)
-            )
+        if value.type == "NAME":
+            names = self.names
+            if names is None:
+                return self.get_variable(value.value).value
+            variable = names.variables.get(value.value)
+            if variable is None:
+                variable = self.get_variable(value.value)
+                if value.value not in names.bound:
+                    names.variables[value.value] = variable
+            return variable.value
+        literal = literal_values.get(value)
+        if literal is None:
+            literal = literal_values[value] = get_literal_value(value)
+        return literal
 
     """
     Evaluate a parsed expression with Trees and Tokens from Lark.
@@ -911,7 +1120,7 @@ class Scope:
             scope = self.new_scope()
             if condition.data == "conditional_let":
                 pattern, value = condition.children
-                if scope.assign_to_pattern(
+                if scope.bind_pattern(
                     get_destructure_pattern(pattern), await self.eval_expr(value)
                 ):
                     return await scope.eval_expr(if_true)
@@ -936,6 +1145,7 @@ class Scope:
                 [self.get_name_type(arg, get_type=False) for arg in arguments],
                 returntype,
                 codeblock,
+                uses_await=compiler.function_uses_await(expr),
             )
         elif expr.data == "function_callback" or expr.data == "function_callback_pipe":
             if expr.data == "function_callback":
@@ -953,18 +1163,7 @@ class Scope:
             if len(arg_values) == 0:
                 arg_values = [()]
             func = await self.eval_expr(function)
-            with open(self.file_path, "r", encoding="utf-8") as f:
-                self.stack_trace.append(
-                    (
-                        expr,
-                        File(
-                            f,
-                            name=os.path.relpath(
-                                self.file_path, start=self.base_path
-                            ),
-                        ),
-                    )
-                )
+            self.stack_trace.append((expr, self.trace_file))
             out = await func.run(arg_values)
             self.stack_trace.pop()
             return out
@@ -1139,34 +1338,18 @@ class Scope:
             else:
                 return self.eval_value(token_or_tree)
         elif expr.data == "impn":
-            if expr.children[0].type == "STRING":
-                rel_file_path = unescape(expr.children[0].value[1:-1])
-            else:
-                # Support old syntax
-                rel_file_path = expr.children[0].value + ".n"
+            rel_file_path = get_import_path(expr.children[0])
             file_path = os.path.join(os.path.dirname(self.file_path), rel_file_path)
-            with open(self.file_path, "r", encoding="utf-8") as f:
-                self.stack_trace.append(
-                    (
-                        expr,
-                        File(
-                            f,
-                            name=os.path.relpath(self.file_path, start=self.base_path),
-                        ),
-                    )
-                )
-            val = await eval_file(
+            self.stack_trace.append((expr, self.trace_file))
+            module = await eval_file(
                 file_path,
                 self.base_path,
                 self.parent_imports + [os.path.normpath(self.file_path)],
+                self.modules,
             )
-            holder = {}
-            for key in val.variables.keys():
-                if val.variables[key].public:
-                    holder[key] = val.variables[key].value
-            unit_test_results[rel_file_path] += val.unit_tests[:]
+            unit_test_results[rel_file_path] = module.unit_tests[:]
             self.stack_trace.pop()
-            return NModule(rel_file_path, holder)
+            return NModule(rel_file_path, module.public_values)
         elif expr.data == "record_access":
             method = False
 
@@ -1186,11 +1369,23 @@ class Scope:
             return tuple(values)
         elif expr.data == "listval":
             values = []
-            for e in expr.children:
+            children = expr.children
+            first = None
+            if (
+                len(children) > 0
+                and isinstance(children[0], lark.Tree)
+                and children[0].data == "spread"
+            ):
+                # Add to the end of the first spread list without copying it
+                first = await self.eval_expr(children[0].children[0])
+                children = children[1:]
+            for e in children:
                 if isinstance(e, lark.Tree) and e.data == "spread":
                     await self.eval_spread_list(e, values)
                 else:
                     values.append(await self.eval_expr(e))
+            if first is not None:
+                return NList.of(first).extended(values)
             return values
         elif expr.data == "recordval":
             record_type = {}
@@ -1212,10 +1407,11 @@ class Scope:
         elif expr.data == "await_expression":
             value, _ = expr.children
             command = await self.eval_expr(value)
-            _, using_await_future, cmd_resume_future = self.get_parent_function()
-            if not using_await_future.done():
-                using_await_future.set_result((True, None))
-                await cmd_resume_future
+            call = self.get_parent_function()
+            if not call.awaiting:
+                # Make the function call return a cmd that continues from here
+                call.awaiting = True
+                await pause_call()
             if isinstance(command, Cmd):
                 return await command.eval()
             else:
@@ -1257,9 +1453,7 @@ class Scope:
                     continue
 
                 scope = self.new_scope()
-                if scope.assign_to_pattern(
-                    get_destructure_pattern(i), inp
-                ):
+                if scope.bind_pattern(get_destructure_pattern(i), inp):
                     return await scope.eval_expr(o)
                 # else:
                 #     if isinstance(i, lark.Token) and i.type == "NAME":
@@ -1330,7 +1524,7 @@ class Scope:
             for i in iterval:
                 scope = self.new_scope()
 
-                scope.assign_to_pattern(pattern, i, certain=True)
+                scope.bind_pattern(pattern, i)
                 exit, value = await scope.eval_command(code)
                 if exit == "continue":
                     continue
@@ -1363,15 +1557,15 @@ class Scope:
             modifiers, name_type, value = command.children
             pattern, _ = self.get_name_type(name_type, get_type=False)
             public = any(modifier.type == "PUBLIC" for modifier in modifiers.children)
-            self.assign_to_pattern(
-                pattern, await self.eval_expr(value), False, None, public, certain=True
-            )
+            self.bind_pattern(pattern, await self.eval_expr(value), public)
+            if self.names is not None and isinstance(pattern[0], str):
+                self.names.declare(pattern[0], self.variables[pattern[0]])
         elif command.data == "if":
             condition, body = command.children
             scope = self.new_scope()
             if condition.data == "conditional_let":
                 pattern, value = condition.children
-                yes = scope.assign_to_pattern(
+                yes = scope.bind_pattern(
                     get_destructure_pattern(pattern), await self.eval_expr(value)
                 )
             else:
@@ -1385,7 +1579,7 @@ class Scope:
             scope = self.new_scope()
             if condition.data == "conditional_let":
                 pattern, value = condition.children
-                yes = scope.assign_to_pattern(
+                yes = scope.bind_pattern(
                     get_destructure_pattern(pattern), await self.eval_expr(value)
                 )
             else:
@@ -1584,9 +1778,7 @@ class Scope:
             if condition.data == "conditional_let":
                 pattern, value = condition.children
                 eval_type = self.type_check_expr(value)
-                scope.assign_to_pattern(
-                    get_destructure_pattern(pattern), eval_type, True
-                )
+                scope.type_check_pattern(get_destructure_pattern(pattern), eval_type)
             else:
                 cond_type = self.type_check_expr(condition)
                 if cond_type is not None and cond_type != "bool":
@@ -1655,11 +1847,15 @@ class Scope:
                 wrap_scope.parse_type(returntype, err=False),
                 codeblock,
                 generic_types,
+                uses_await=False,
             )
             scope = wrap_scope.new_scope(parent_function=dummy_function)
             for arg_pattern, arg_type in arguments:
-                scope.assign_to_pattern(arg_pattern, arg_type, True, certain=True)
+                scope.type_check_pattern(arg_pattern, arg_type, certain=True)
             returnvalue = scope.type_check_command(codeblock)
+            # Let the interpreter know whether the function can run without the
+            # event loop
+            expr.meta.uses_await = dummy_function.uses_await
             if returnvalue is None:
                 _, incompatible = resolve_equal_types(dummy_function.returntype, "unit")
                 if n_cmd_type.is_type(dummy_function.returntype):
@@ -1735,7 +1931,7 @@ class Scope:
                 )
                 return None
             *arg_types, return_type = func_type
-            generics = {}
+            generics = Generics()
             parameters_have_none = False
             for n, ((argument, arg_point), arg_type) in enumerate(
                 zip(arguments, arg_types), start=1
@@ -1855,7 +2051,7 @@ class Scope:
                 out = value_type[field.value].type if method else value_type[field.value]
                 if method:
                     # Apply generics
-                    generics = {}
+                    generics = Generics()
                     apply_generics(out[0], self.type_check_expr(value), generics)
                     out = tuple(
                         apply_generics_to(arg_type, generics)
@@ -1877,6 +2073,8 @@ class Scope:
                     )
                 )
             parent_function = self.get_parent_function()
+            if parent_function is not None:
+                parent_function.uses_await = True
             if parent_function is None:
                 self.errors.append(
                     TypeCheckError(
@@ -1973,8 +2171,8 @@ class Scope:
                 first_out_type = self.type_check_expr(first_value)
             else:
                 scope = self.new_scope(parent_type="match")
-                scope.assign_to_pattern(
-                    get_destructure_pattern(first_match), value_type, True
+                scope.type_check_pattern(
+                    get_destructure_pattern(first_match), value_type
                 )
                 first_out_type = scope.type_check_expr(first_value)
             for i, match_value in enumerate(match_block.children[1:]):
@@ -1984,9 +2182,7 @@ class Scope:
                     defaults = 1
                     typ = self.type_check_expr(value)
                 else:
-                    scope.assign_to_pattern(
-                        get_destructure_pattern(match), value_type, True
-                    )
+                    scope.type_check_pattern(get_destructure_pattern(match), value_type)
                     typ = scope.type_check_expr(value)
                 if typ != first_out_type:
                     self.errors.append(
@@ -2025,7 +2221,7 @@ class Scope:
                 # Treating each operation like a function until one of their
                 # types matches the operands' types.
                 for operand_type, result_type in types:
-                    generics = {}
+                    generics = Generics()
                     resolved_type = apply_generics(operand_type, value_type, generics)
                     _, incompatible = resolve_equal_types(value_type, resolved_type)
                     if incompatible:
@@ -2056,7 +2252,7 @@ class Scope:
                 # Treating each operation like a function until one of their
                 # types matches the operands' types.
                 for left_operand_type, right_operand_type, result_type in types:
-                    generics = {}
+                    generics = Generics()
                     resolved_type = apply_generics(
                         left_operand_type, left_type, generics
                     )
@@ -2161,11 +2357,7 @@ class Scope:
             else:
                 return n_list_type.with_typevars([contained_type])
         elif expr.data == "impn":
-            if expr.children[0].type == "STRING":
-                rel_file_path = unescape(expr.children[0].value[1:-1])
-            else:
-                # Support old syntax
-                rel_file_path = expr.children[0].value + ".n"
+            rel_file_path = get_import_path(expr.children[0])
             file_path = os.path.join(os.path.dirname(self.file_path), rel_file_path)
             if os.path.normpath(file_path) == os.path.normpath(self.file_path):
                 self.errors.append(
@@ -2182,19 +2374,17 @@ class Scope:
                         )
                     )
                     return None
-                impn, f = type_check_file(
+                module = type_check_file(
                     file_path,
                     self.base_path,
                     self.parent_imports + [os.path.normpath(self.file_path)],
+                    self.modules,
                 )
-                if len(impn.errors) != 0:
-                    self.errors.append(ImportedError(impn.errors[:], f))
-                if len(impn.warnings) != 0:
-                    self.warnings.append(ImportedError(impn.warnings[:], f))
-                holder = {}
-                for key in impn.variables.keys():
-                    if impn.variables[key].public:
-                        holder[key] = impn.variables[key].type
+                if len(module.errors) != 0:
+                    self.errors.append(ImportedError(module.errors[:], module.file))
+                if len(module.warnings) != 0:
+                    self.warnings.append(ImportedError(module.warnings[:], module.file))
+                holder = module.public_variable_types
                 if holder == {}:
                     self.warnings.append(
                         TypeCheckError(
@@ -2202,8 +2392,8 @@ class Scope:
                             "There was nothing to import from %s" % expr.children[0],
                         )
                     )
-                unit_test_results[rel_file_path] = impn.unit_tests[:]
-                return NModule(rel_file_path, holder, types=impn.public_types)
+                unit_test_results[rel_file_path] = module.unit_tests[:]
+                return NModule(rel_file_path, holder, types=module.public_types)
             else:
                 self.errors.append(
                     TypeCheckError(
@@ -2342,7 +2532,7 @@ class Scope:
             for ideal_iterable_type, ideal_iterated_type in iterable_types_src:
                 # Treating iteration like a function until one of their types
                 # matches the iterable's types.
-                generics = {}
+                generics = Generics()
                 resolved_type = apply_generics(
                     ideal_iterable_type, iterable_type, generics
                 )
@@ -2373,7 +2563,7 @@ class Scope:
                         )
                     )
             scope = self.new_scope(parent_type="for")
-            scope.assign_to_pattern(pattern, ty, True, certain=True)
+            scope.type_check_pattern(pattern, ty, certain=True)
             return scope.type_check_command(code)
         elif command.data == "while":
             var, code = command.children
@@ -2470,16 +2660,16 @@ class Scope:
 
             public = any(modifier.type == "PUBLIC" for modifier in modifiers.children)
             mutable = any(modifier.type == "MUTABLE" for modifier in modifiers.children)
-            self.assign_to_pattern(pattern, ty, True, None, public, certain=True, mutable=mutable)
+            self.type_check_pattern(
+                pattern, ty, None, public, certain=True, mutable=mutable
+            )
         elif command.data == "if":
             condition, body = command.children
             scope = self.new_scope(parent_type="if")
             if condition.data == "conditional_let":
                 pattern, value = condition.children
                 eval_type = self.type_check_expr(value)
-                scope.assign_to_pattern(
-                    get_destructure_pattern(pattern), eval_type, True
-                )
+                scope.type_check_pattern(get_destructure_pattern(pattern), eval_type)
             else:
                 cond_type = self.type_check_expr(condition)
                 if isinstance(condition.children[0], lark.Token):
@@ -2507,9 +2697,7 @@ class Scope:
             if condition.data == "conditional_let":
                 pattern, value = condition.children
                 eval_type = self.type_check_expr(value)
-                scope.assign_to_pattern(
-                    get_destructure_pattern(pattern), eval_type, True
-                )
+                scope.type_check_pattern(get_destructure_pattern(pattern), eval_type)
             else:
                 cond_type = self.type_check_expr(condition)
                 if isinstance(condition.children[0], lark.Token):
@@ -2543,7 +2731,16 @@ class Scope:
             modifiers, type_def, constructors = command.children
             type_name, scope, typevars = self.get_name_typevars(type_def)
             variants = []
-            enum_type = EnumType(type_name.value, variants, typevars)
+            enum_type = EnumType(
+                type_name.value,
+                variants,
+                typevars,
+                key=(
+                    os.path.normpath(self.file_path),
+                    type_name.line,
+                    type_name.column,
+                ),
+            )
             self.types[type_name] = enum_type
             if any(modifier.type == "PUBLIC" for modifier in modifiers.children):
                 self.public_types[type_name] = self.types[type_name]
@@ -2633,7 +2830,7 @@ class Scope:
                 parent_function=None, inherit_errors=False, parent_type="class"
             )
             for arg_pattern, arg_type in arguments:
-                scope.assign_to_pattern(arg_pattern, arg_type, True, certain=True)
+                scope.type_check_pattern(arg_pattern, arg_type, certain=True)
             scope.type_check_command(class_body)
 
             for prop_name, var in scope.variables.items():
@@ -2665,7 +2862,7 @@ class Scope:
 
             scope = self.new_scope(parent_function=None, parent_type="class")
             for arg_pattern, arg_type in arguments:
-                scope.assign_to_pattern(arg_pattern, arg_type, True, certain=True)
+                scope.type_check_pattern(arg_pattern, arg_type, certain=True)
             scope.type_check_command(class_body)
 
             for prop_name, var in scope.variables.items():
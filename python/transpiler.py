@@ -0,0 +1,972 @@
+import ast
+import hashlib
+import marshal
+import math
+import os
+import sys
+
+import lark
+
+import compiler
+import interface_cache
+import scope as n_scope
+import tree_cache
+from enums import EnumPattern
+from function import TailCall, TranspiledFunction, run_synchronously
+
+"""
+Transpiles the syntax tree of a type checked N file to the source code of a
+Python module, which is the `python` engine. Each top level instruction
+becomes a Python function that takes the Scope of the file, N functions become
+`def`s, and `for` and `while` loops become Python loops, so CPython runs the N
+code as its own bytecode. Records are dicts, enum values are EnumValues, and
+cmds are the usual Cmd objects, like in the other engines.
+
+Variables declared in functions and blocks become local variables of the
+Python functions, renamed for each block that the closure engine would give an
+Environment (`x` becomes `x_3`) so that shadowing works the same way. Loops
+whose bodies define functions run each iteration in its own `def`, because N
+functions capture the variables of the iteration they're defined in. Top level
+variables are kept in the Scope, like in the other engines.
+
+Top level instructions that the transpiler doesn't support, such as ones that
+use the await operator or define types or classes, are run by the closure
+engine instead. Use `n.py --emit-python` to print the generated module.
+
+The compiled module is cached as a `.pyc` file in the `__ncache__` folder next
+to the N file, along with a hash of the source code, the grammar, the
+interpreter, and the Python version, so a stale module is simply ignored and
+overwritten. Set the N_PYTHON_CACHE environment variable to "off" to disable
+the cache.
+"""
+
+extension = ".pyc"
+enabled = os.environ.get("N_PYTHON_CACHE") != "off"
+
+indent = "    "
+
+prelude = """from compiler import get_record as _get_record
+from compiler import get_value_at as _get_value_at
+from compiler import n_and as _n_and
+from compiler import n_divide as _n_divide
+from compiler import n_exponent as _n_exponent
+from compiler import n_not as _n_not
+from compiler import n_or as _n_or
+from enums import EnumValue as _EnumValue
+from native_types import none as _none
+from native_types import NList as _NList
+from transpiler import Area as _Area
+from transpiler import get_helpers as _helpers
+from variable import Variable as _Variable
+"""
+
+# What the transpiled instructions get from `get_helpers`
+helper_names = "_get, _variables, _call, _tail_call, _function, _get_field, _import"
+
+# N operators that behave like Python's
+python_operators = {
+    "ADD": "+",
+    "SUBTRACT": "-",
+    "MULTIPLY": "*",
+    "MODULO": "%",
+    "SHIFTL": "<<",
+    "SHIFTR": ">>",
+    "EQUALS": "==",
+    "GORE": ">=",
+    "LORE": "<=",
+    "LESS": "<",
+    "GREATER": ">",
+    "NEQUALS": "!=",
+}
+
+
+class Unsupported(Exception):
+    """
+    Raised while transpiling a top level instruction that has to be run by the
+    closure engine instead.
+    """
+
+
+class Area:
+    """
+    Where a function call is in the N file, for stack traces.
+    """
+
+    __slots__ = ("line", "column", "end_line", "end_column")
+
+    def __init__(self, line, column, end_line, end_column):
+        self.line = line
+        self.column = column
+        self.end_line = end_line
+        self.end_column = end_column
+
+
+def get_helpers(scope):
+    """
+    Returns the functions that a transpiled top level instruction uses to run
+    in the given Scope, in the order of `helper_names`.
+    """
+    stack_trace = scope.stack_trace
+    trace_file = scope.trace_file
+
+    def call(area, arguments, function):
+        stack_trace.append((area, trace_file))
+        value = function.run_sync(arguments)
+        stack_trace.pop()
+        return value
+
+    def tail_call(area, arguments, function):
+        return TailCall(function, arguments, area, scope)
+
+    def make_function(body, arity):
+        return TranspiledFunction(scope, body, arity)
+
+    def get_field(value, field):
+        return scope.get_value_internal_traits(value)[field].run_sync([value])
+
+    def import_file(area, rel_file_path):
+        # Like `compiler.compile_impn`, imported files never wait on the event
+        # loop
+        return run_synchronously(compiler.import_file(scope, area, rel_file_path))
+
+    return (
+        scope.get_variable,
+        scope.variables,
+        call,
+        tail_call,
+        make_function,
+        get_field,
+        import_file,
+    )
+
+
+def literal(value):
+    """
+    Returns a Python expression for a value known before running the program.
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return 'float("%r")' % value
+    if isinstance(value, tuple):
+        if len(value) == 1:
+            return "(%s,)" % literal(value[0])
+        return "(%s)" % ", ".join(literal(item) for item in value)
+    if isinstance(value, str):
+        # Tokens are strings too, but they have their own repr
+        return repr(str(value))
+    if value is None or isinstance(value, (bool, int, float)):
+        return repr(value)
+    raise Unsupported("%r can't be written as a literal" % (value,))
+
+
+def is_simple(expr):
+    """
+    Whether a Python expression is a variable or literal, which can be used
+    more than once without storing it in a variable first.
+    """
+    if expr.isidentifier():
+        return True
+    try:
+        ast.literal_eval(expr)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return False
+    return True
+
+
+class Block:
+    """
+    The variables of a block while transpiling, like `compiler.Environment`.
+    Each N name is mapped to a local variable of `function`, the
+    PythonFunction that the block is in.
+    """
+
+    def __init__(self, parent, function):
+        self.parent = parent
+        self.function = function
+        self.names = {}
+
+    def resolve(self, name):
+        """
+        Returns the Block that the variable was declared in, or None if it's a
+        top level or global variable.
+        """
+        block = self
+        while block is not None:
+            if name in block.names:
+                return block
+            block = block.parent
+        return None
+
+
+class PythonFunction:
+    """
+    A Python function being generated. `kind` is "command" for a top level
+    instruction, "function" for an N function, or "body" for an iteration of a
+    loop.
+    """
+
+    def __init__(self, kind, parent=None):
+        self.kind = kind
+        self.parent = parent
+        # The variables of enclosing functions that this function assigns to
+        self.nonlocals = set()
+        # For each loop this function is in, whether it's a Python loop in
+        # this function rather than one that calls a "body" function
+        self.loops = []
+
+
+class Transpiler:
+    def __init__(self):
+        self.count = 0
+        # The definitions of the Areas used for stack traces
+        self.areas = []
+        self.function = None
+
+    def unique(self, prefix):
+        self.count += 1
+        return "%s%d" % (prefix, self.count)
+
+    def area(self, tree):
+        name = self.unique("_a")
+        self.areas.append(
+            "%s = _Area(%d, %d, %d, %d)"
+            % (
+                name,
+                tree.meta.line,
+                tree.meta.column,
+                tree.meta.end_line,
+                tree.meta.end_column,
+            )
+        )
+        return name
+
+    def temp(self, expr, stmts):
+        """
+        Stores the value of an expression in a temporary variable, unless it's
+        simple, so that it can be used more than once.
+        """
+        if is_simple(expr):
+            return expr
+        name = self.unique("_t")
+        stmts.append("%s = %s" % (name, expr))
+        return name
+
+    def sequence(self, parts):
+        """
+        Joins a list of `(statements, expression)` tuples into one list of
+        statements and a list of expressions. Expressions that come before
+        another's statements are stored in temporary variables first, so
+        they're still evaluated in order.
+        """
+        last = max((i for i, (stmts, _) in enumerate(parts) if stmts), default=-1)
+        all_stmts = []
+        exprs = []
+        for i, (stmts, expr) in enumerate(parts):
+            all_stmts += stmts
+            if i < last:
+                expr = self.temp(expr, all_stmts)
+            exprs.append(expr)
+        return all_stmts, exprs
+
+    def new_block(self, env, body=None, pattern=None):
+        """
+        Returns a new Block where `compiler.get_block_environment` would create
+        a new Environment, or the enclosing Block otherwise.
+        """
+        if (pattern is not None and compiler.has_names(pattern)) or (
+            body is not None and compiler.declares_variables(body)
+        ):
+            return Block(env, self.function)
+        return env
+
+    def declare_name(self, name, env):
+        python_name = env.names.get(name)
+        if python_name is None:
+            python_name = env.names[name] = self.unique(name + "_")
+        return python_name
+
+    def load_name(self, name, env):
+        block = env.resolve(name) if env is not None else None
+        if block is None:
+            return "_get(%r).value" % name
+        return block.names[name]
+
+    def store_name(self, name, value, env):
+        """
+        Returns the statement that assigns a new value to a variable.
+        """
+        block = env.resolve(name) if env is not None else None
+        if block is None:
+            return "_get(%r).value = %s" % (name, value)
+        if block.function is not self.function:
+            self.function.nonlocals.add(block.names[name])
+        return "%s = %s" % (block.names[name], value)
+
+    def get_bindings(self, pattern_and_src, value, checks, binds):
+        """
+        Adds the conditions for a value to match a destructuring pattern to
+        `checks`, and each name in the pattern along with an expression for its
+        part of the value to `binds`, like `compiler.compile_binder`.
+        """
+        pattern, _ = pattern_and_src
+        if isinstance(pattern, dict):
+            for key, sub_pattern in pattern.items():
+                self.get_bindings(
+                    sub_pattern, "%s[%s]" % (value, literal(key)), checks, binds
+                )
+        elif isinstance(pattern, (tuple, list)):
+            if isinstance(pattern, list):
+                checks.append("len(%s) == %d" % (value, len(pattern)))
+            for i, sub_pattern in enumerate(pattern):
+                self.get_bindings(sub_pattern, "%s[%d]" % (value, i), checks, binds)
+        elif isinstance(pattern, EnumPattern):
+            checks.append("%s.variant == %s" % (value, literal(pattern.variant)))
+            for i, sub_pattern in enumerate(pattern.patterns):
+                self.get_bindings(
+                    sub_pattern, "%s.values[%d]" % (value, i), checks, binds
+                )
+        elif pattern is not None:
+            binds.append((pattern, value))
+
+    def bind_pattern(self, pattern_and_src, value, env, public=False):
+        """
+        Returns the condition for a value, which must be simple, to match a
+        destructuring pattern, and the statements that assign its variables.
+        """
+        checks = []
+        binds = []
+        self.get_bindings(pattern_and_src, value, checks, binds)
+        if env is None:
+            stmts = [
+                "_variables[%r] = _Variable(%s, %s, %r)" % (name, bound, bound, public)
+                for name, bound in binds
+            ]
+        else:
+            stmts = [
+                "%s = %s" % (self.declare_name(name, env), bound)
+                for name, bound in binds
+            ]
+        return " and ".join(checks) or "True", stmts
+
+    def declare_pattern(self, pattern_and_src, value, env, public=False):
+        """
+        Returns the statements that destructure a value for a declaration, an
+        argument, or a for loop.
+        """
+        condition, stmts = self.bind_pattern(pattern_and_src, value, env, public)
+        if condition != "True":
+            # The closure engine leaves the variables as they were if the
+            # value doesn't match
+            raise Unsupported("Declaring a pattern that might not match")
+        return stmts
+
+    def expr(self, expr, env):
+        """
+        Returns the statements to run before the Python expression for an N
+        expression, and the Python expression.
+        """
+        if isinstance(expr, lark.Token):
+            if expr.type == "NAME":
+                return [], self.load_name(expr.value, env)
+            return [], literal(n_scope.get_literal_value(expr))
+        value = getattr(expr.meta, "constant", compiler.not_constant)
+        if value is not compiler.not_constant:
+            return [], literal(value)
+        transpile = expression_transpilers.get(expr.data)
+        if transpile is None:
+            raise Unsupported(expr.data)
+        return transpile(self, expr, env)
+
+    def value(self, expr, env):
+        return self.expr(expr.children[0], env)
+
+    def char(self, expr, env):
+        return [], literal(compiler.get_char(expr))
+
+    def binary(self, expr, env):
+        left, operator_token, right = expr.children
+        stmts, (left, right) = self.sequence(
+            [self.expr(left, env), self.expr(right, env)]
+        )
+        if expr.data == "or_expression":
+            return stmts, "_n_or(%s, %s)" % (left, right)
+        elif expr.data == "and_expression":
+            return stmts, "_n_and(%s, %s)" % (left, right)
+        elif expr.data == "xor_expression":
+            return stmts, "(%s ^ %s)" % (left, right)
+        elif expr.data == "in_expression":
+            return stmts, "(%s in %s)" % (left, right)
+        elif expr.data == "exponent_expression":
+            return stmts, "_n_exponent(%s, %s)" % (left, right)
+        elif operator_token.type == "DIVIDE":
+            return stmts, "_n_divide(%s, %s)" % (left, right)
+        operator = python_operators.get(operator_token.type)
+        if operator is None:
+            raise SyntaxError(
+                "Unexpected operation for %s: %s" % (expr.data, operator_token)
+            )
+        return stmts, "(%s %s %s)" % (left, operator, right)
+
+    def compare_expression(self, expr, env):
+        left, comparison, right = expr.children
+        operator = python_operators.get(comparison.type)
+        if operator is None:
+            raise SyntaxError(
+                "Unexpected operation for compare_expression: %s" % comparison
+            )
+        if isinstance(left, lark.Tree) and left.data == "compare_expression":
+            # For `a < b < c`, `b` is evaluated again after `a < b`, like the
+            # other engines
+            chain_stmts, chain = self.expr(left, env)
+            stmts, (middle, right) = self.sequence(
+                [self.expr(left.children[2], env), self.expr(right, env)]
+            )
+            if stmts:
+                raise Unsupported("Statements in a chained comparison")
+            return chain_stmts, "(%s and (%s %s %s))" % (chain, middle, operator, right)
+        stmts, (left, right) = self.sequence(
+            [self.expr(left, env), self.expr(right, env)]
+        )
+        return stmts, "(%s %s %s)" % (left, operator, right)
+
+    def not_expression(self, expr, env):
+        stmts, value = self.expr(expr.children[1], env)
+        return stmts, "(not %s)" % value
+
+    def unary_expression(self, expr, env):
+        operation, value = expr.children
+        stmts, value = self.expr(value, env)
+        if operation.type == "SUBTRACT":
+            return stmts, "(-%s)" % value
+        elif operation.type == "NOT":
+            return stmts, "_n_not(%s)" % value
+        raise SyntaxError("Unexpected operation for unary_expression: %s" % operation)
+
+    def arguments(self, arguments, env):
+        """
+        Returns the statements to run before the Python expression for the
+        list of arguments of a function call, and the expression.
+        """
+        if len(arguments) == 0:
+            return [], "[()]"
+        spreads = [compiler.is_spread(arg) for arg in arguments]
+        stmts, exprs = self.sequence(
+            [
+                self.expr(arg.children[0] if spread else arg, env)
+                for arg, spread in zip(arguments, spreads)
+            ]
+        )
+        items = ", ".join(
+            "*" + expr if spread else expr for expr, spread in zip(exprs, spreads)
+        )
+        if any(spreads):
+            # Spreading empty tuples leaves no arguments
+            return stmts, "([%s] or [()])" % items
+        return stmts, "[%s]" % items
+
+    def call_parts(self, expr, env):
+        """
+        Returns the statements to run before a function call, and the Python
+        expressions for its arguments and the function.
+        """
+        function, arguments = compiler.get_call_parts(expr)
+        # The arguments are evaluated before the function, like the other
+        # engines
+        stmts, (arguments, function) = self.sequence(
+            [self.arguments(arguments, env), self.expr(function, env)]
+        )
+        return stmts, arguments, function
+
+    def function_callback(self, expr, env):
+        stmts, arguments, function = self.call_parts(expr, env)
+        return stmts, "_call(%s, %s, %s)" % (self.area(expr), arguments, function)
+
+    def function_def(self, expr, env):
+        if compiler.function_uses_await(expr):
+            raise Unsupported("Functions that use the await operator")
+        arguments, _, codeblock = compiler.get_function_parts(expr)
+        name = self.unique("_f")
+        outer_function = self.function
+        self.function = PythonFunction("function", outer_function)
+        function_env = Block(env, self.function)
+        parameters = []
+        body = []
+        for pattern, _ in arguments:
+            if isinstance(pattern[0], str):
+                parameters.append(self.declare_name(pattern[0], function_env))
+            else:
+                parameters.append(self.unique("_t"))
+                body += self.declare_pattern(pattern, parameters[-1], function_env)
+        body += self.command(codeblock, function_env)
+        stmts = ["def %s(%s):" % (name, ", ".join(parameters))]
+        stmts += self.function_body(body)
+        self.function = outer_function
+        return stmts, "_function(%s, %d)" % (name, len(arguments))
+
+    def function_body(self, body):
+        """
+        Indents the body of the Python function being generated, declaring the
+        variables of enclosing functions that it assigns to.
+        """
+        if self.function.nonlocals:
+            body = ["nonlocal %s" % ", ".join(sorted(self.function.nonlocals))] + body
+        return [indent + line for line in body or ["pass"]]
+
+    def value_access(self, expr, env):
+        left, _, right = expr.children
+        left_stmts, left = self.expr(left, env)
+        right_stmts, right = self.expr(right, env)
+        if right_stmts:
+            raise Unsupported("Statements in the key of a value access")
+        name = self.unique("_t")
+        return left_stmts, (
+            "(_none if isinstance(%s := %s, _EnumValue) and %s == _none "
+            "else _get_value_at(%s, %s))" % (name, left, name, name, right)
+        )
+
+    def impn(self, expr, env):
+        path = literal(compiler.get_impn_path(expr))
+        return [], "_import(%s, %s)" % (self.area(expr), path)
+
+    def record_access(self, expr, env):
+        stmts, value = self.expr(expr.children[0], env)
+        field = literal(expr.children[1].value)
+        name = self.unique("_t")
+        return stmts, (
+            "(%s[%s] if isinstance(%s := %s, dict) else _get_field(%s, %s))"
+            % (name, field, name, value, name, field)
+        )
+
+    def tupleval(self, expr, env):
+        stmts, items = self.sequence([self.expr(item, env) for item in expr.children])
+        if len(items) == 1:
+            return stmts, "(%s,)" % items[0]
+        return stmts, "(%s)" % ", ".join(items)
+
+    def listval(self, expr, env):
+        spreads = [compiler.is_spread(item) for item in expr.children]
+        stmts, items = self.sequence(
+            [
+                self.expr(item.children[0] if spread else item, env)
+                for item, spread in zip(expr.children, spreads)
+            ]
+        )
+        if len(items) > 0 and spreads[0]:
+            # Add to the end of the first spread list without copying it
+            return stmts, "_NList.of(%s).extended([%s])" % (
+                items[0],
+                ", ".join(
+                    "*" + item if spread else item
+                    for item, spread in zip(items[1:], spreads[1:])
+                ),
+            )
+        return stmts, "[%s]" % ", ".join(
+            "*" + item if spread else item for item, spread in zip(items, spreads)
+        )
+
+    def recordval(self, expr, env):
+        keys = []
+        parts = []
+        for entry in expr.children:
+            if isinstance(entry, lark.Token):
+                keys.append(entry.value)
+                parts.append(self.expr(entry, env))
+            elif entry.data == "spread":
+                keys.append(None)
+                parts.append(self.expr(entry.children[0], env))
+            else:
+                key, value = entry.children
+                keys.append(key.value)
+                parts.append(self.expr(value, env))
+        stmts, values = self.sequence(parts)
+        if None in keys:
+            # Explicit entries take precedence over spread ones, but the
+            # entries are still evaluated in order
+            for i, value in enumerate(values[:-1]):
+                values[i] = self.temp(value, stmts)
+        entries = ", ".join(
+            "%s: %s" % (literal(key), value)
+            for key, value in zip(keys, values)
+            if key is not None
+        )
+        if None not in keys:
+            return stmts, "{%s}" % entries
+        spreads = ", ".join(value for key, value in zip(keys, values) if key is None)
+        return stmts, "_get_record([%s], {%s})" % (spreads, entries)
+
+    def condition(self, condition, env, branch_env):
+        """
+        Returns the statements to run before the condition of an if, the
+        condition, and the statements to run once it's met, which assign the
+        variables of a conditional let.
+        """
+        if condition.data == "conditional_let":
+            pattern_tree, value = condition.children
+            stmts, value = self.expr(value, env)
+            value = self.temp(value, stmts)
+            check, binds = self.bind_pattern(
+                n_scope.get_destructure_pattern(pattern_tree), value, branch_env
+            )
+            return stmts, check, binds
+        stmts, check = self.expr(condition, env)
+        return stmts, check, []
+
+    def ifelse_expr(self, expr, env):
+        condition, if_true, if_false = expr.children
+        branch_env = self.new_block(
+            env, pattern=compiler.get_condition_pattern(condition)
+        )
+        stmts, check, binds = self.condition(condition, env, branch_env)
+        # Like the other engines, both branches are in the new block
+        true_stmts, if_true = self.expr(if_true, branch_env)
+        false_stmts, if_false = self.expr(if_false, branch_env)
+        if not binds and not true_stmts and not false_stmts:
+            return stmts, "(%s if %s else %s)" % (if_true, check, if_false)
+        name = self.unique("_t")
+        stmts.append("if %s:" % check)
+        stmts += [indent + line for line in binds + true_stmts]
+        stmts.append("%s%s = %s" % (indent, name, if_true))
+        stmts.append("else:")
+        stmts += [indent + line for line in false_stmts]
+        stmts.append("%s%s = %s" % (indent, name, if_false))
+        return stmts, name
+
+    def match(self, expr, env):
+        input_value, match_block = expr.children
+        by_value = match_block.data == "match_block"
+        stmts, value = self.expr(input_value, env)
+        value = self.temp(value, stmts)
+        name = self.unique("_t")
+        arms = match_block.children
+        for i, arm in enumerate(arms):
+            pattern, output = arm.children
+            if by_value:
+                is_default = compiler.is_default_value(pattern)
+            else:
+                is_default = isinstance(pattern, lark.Token) and pattern.value == "_"
+            if is_default and i < len(arms) - 1:
+                # Default arms are evaluated as soon as they're reached, even
+                # if a later arm matches
+                raise Unsupported("Default arm before other arms")
+            arm_env = env
+            binds = []
+            if is_default:
+                check = "True"
+            elif by_value:
+                check_stmts, check = self.expr(pattern, env)
+                if check_stmts:
+                    raise Unsupported("Statements in the value of a match arm")
+                check = "%s == %s" % (value, check)
+            else:
+                destructure_pattern = n_scope.get_destructure_pattern(pattern)
+                arm_env = self.new_block(env, pattern=destructure_pattern)
+                check, binds = self.bind_pattern(destructure_pattern, value, arm_env)
+            output_stmts, output = self.expr(output, arm_env)
+            if i == 0:
+                stmts.append("if %s:" % check)
+            elif check == "True":
+                stmts.append("else:")
+            else:
+                stmts.append("elif %s:" % check)
+            stmts += [indent + line for line in binds + output_stmts]
+            stmts.append("%s%s = %s" % (indent, name, output))
+            if check == "True":
+                return stmts, name
+        # Like the other engines, the value is None if no arm matches
+        if arms:
+            stmts.append("else:")
+            stmts.append("%s%s = None" % (indent, name))
+        else:
+            stmts.append("%s = None" % name)
+        return stmts, name
+
+    def command(self, tree, env):
+        """
+        Returns the Python statements for a command.
+        """
+        command = compiler.get_command(tree)
+        transpile = command_transpilers.get(command.data)
+        if transpile is not None:
+            return transpile(self, command, env)
+        if command.data in compiler.command_compilers:
+            raise Unsupported(command.data)
+        # The command is an expression whose value is discarded
+        stmts, value = self.expr(command, env)
+        if is_simple(value):
+            return stmts
+        return stmts + [value]
+
+    def code_block(self, command, env):
+        stmts = []
+        for instruction in command.children:
+            stmts += self.command(instruction, env)
+        return stmts
+
+    def in_function(self):
+        """
+        Whether a return command returns from an N function.
+        """
+        function = self.function
+        while function.kind == "body":
+            function = function.parent
+        return function.kind == "function"
+
+    def return_command(self, command, env):
+        tail_call = compiler.get_tail_call(command.children[0])
+        if tail_call is not None and self.in_function():
+            stmts, arguments, function = self.call_parts(tail_call, env)
+            area = self.area(tail_call)
+            value = "_tail_call(%s, %s, %s)" % (area, arguments, function)
+        else:
+            stmts, value = self.expr(command.children[0], env)
+        if self.function.kind == "body":
+            return stmts + ["return (True, %s)" % value]
+        elif self.function.kind == "command":
+            # The rest of the instruction is skipped, and the value is
+            # discarded like in the closure engine
+            return stmts + [value, "return"]
+        return stmts + ["return %s" % value]
+
+    def exit_loop(self, exit):
+        if not self.function.loops:
+            raise Unsupported("%s outside of a loop" % exit)
+        if self.function.loops[-1]:
+            return [exit]
+        # The iteration is a "body" function
+        return ['return "break"' if exit == "break" else "return"]
+
+    def if_command(self, command, env):
+        condition, body = command.children
+        branch_env = self.new_block(
+            env, body, compiler.get_condition_pattern(condition)
+        )
+        stmts, check, binds = self.condition(condition, env, branch_env)
+        body = binds + self.command(body, branch_env)
+        return stmts + ["if %s:" % check] + [indent + line for line in body or ["pass"]]
+
+    def ifelse_command(self, command, env):
+        condition, if_true, if_false = command.children
+        true_env = self.new_block(
+            env, if_true, compiler.get_condition_pattern(condition)
+        )
+        false_env = self.new_block(env, if_false)
+        stmts, check, binds = self.condition(condition, env, true_env)
+        body = binds + self.command(if_true, true_env)
+        stmts += ["if %s:" % check] + [indent + line for line in body or ["pass"]]
+        otherwise = self.command(if_false, false_env)
+        if otherwise and otherwise[0].startswith("if "):
+            # `else if` chains become `elif` so that they don't run into
+            # Python's limit on nested blocks
+            return stmts + ["el" + otherwise[0]] + otherwise[1:]
+        return stmts + ["else:"] + [indent + line for line in otherwise or ["pass"]]
+
+    def loop_body(self, pattern, code, loop_env, item):
+        """
+        Returns the indented statements for an iteration of a loop, which
+        assign `item` to the pattern of a for loop. If the loop body defines
+        functions, the iteration is run in its own Python function so that
+        they capture its variables.
+        """
+        if not any(subtree.data == "function_def" for subtree in code.iter_subtrees()):
+            self.function.loops.append(True)
+            stmts = []
+            if pattern is not None:
+                stmts += self.declare_pattern(pattern, item, loop_env)
+            stmts += self.command(code, loop_env)
+            self.function.loops.pop()
+            return [indent + line for line in stmts or ["pass"]]
+        name = self.unique("_body")
+        outer_function = self.function
+        self.function = PythonFunction("body", outer_function)
+        self.function.loops.append(False)
+        if loop_env is not None and loop_env.function is outer_function:
+            loop_env.function = self.function
+        body = []
+        if pattern is not None:
+            body += self.declare_pattern(pattern, item, loop_env)
+        body += self.command(code, loop_env)
+        stmts = ["def %s(%s):" % (name, item or "")] + self.function_body(body)
+        self.function = outer_function
+        exit = self.unique("_t")
+        stmts += [
+            "%s = %s(%s)" % (exit, name, item or ""),
+            "if %s is not None:" % exit,
+            indent + 'if %s == "break":' % exit,
+            indent * 2 + "break",
+        ]
+        # Otherwise a return command ran
+        if outer_function.kind == "function":
+            stmts.append(indent + "return %s[1]" % exit)
+        elif outer_function.kind == "body":
+            stmts.append(indent + "return %s" % exit)
+        else:
+            stmts.append(indent + "return")
+        return [indent + line for line in stmts]
+
+    def for_command(self, command, env):
+        var, iterable, code = command.children
+        pattern, _ = compiler.get_name_pattern(var)
+        stmts, iterable = self.expr(iterable, env)
+        loop_env = self.new_block(env, code, pattern)
+        item = self.unique("_t")
+        return (
+            stmts
+            + ["for %s in %s:" % (item, iterable)]
+            + self.loop_body(pattern, code, loop_env, item)
+        )
+
+    def while_command(self, command, env):
+        condition, code = command.children
+        stmts, check = self.expr(condition, env)
+        loop_env = self.new_block(env, code)
+        body = self.loop_body(None, code, loop_env, None)
+        if stmts:
+            return (
+                ["while True:"]
+                + [indent + line for line in stmts]
+                + [indent + "if not %s:" % check, indent * 2 + "break"]
+                + body
+            )
+        return ["while %s:" % check] + body
+
+    def declare(self, command, env):
+        modifiers, name_type, value = command.children
+        pattern, _ = compiler.get_name_pattern(name_type)
+        public = compiler.is_public(modifiers)
+        # The value is transpiled first because it can't use the declared
+        # variables
+        stmts, value = self.expr(value, env)
+        if env is not None and isinstance(pattern[0], str):
+            return stmts + ["%s = %s" % (self.declare_name(pattern[0], env), value)]
+        value = self.temp(value, stmts)
+        return stmts + self.declare_pattern(pattern, value, env, public)
+
+    def assert_command(self, command, env):
+        assert_type = command.children[0].children[0]
+        if assert_type.data != "assert_val":
+            # Type assertions are only checked by the type checker
+            return []
+        stmts, value = self.expr(assert_type.children[0], env)
+        return stmts + [
+            '_scope.unit_tests.append({"hasPassed": %s, "fileLine": %d, '
+            '"unitTestType": "value", "possibleTypes": _none})' % (value, command.line)
+        ]
+
+    def assign_value(self, command, env):
+        stmts, value = self.expr(compiler.get_assign_value_tree(command), env)
+        return stmts + [self.store_name(command.children[0].value, value, env)]
+
+    def top_level(self, index, tree):
+        """
+        Returns the lines of the Python function for a top level instruction,
+        or None if it has to be run by the closure engine.
+        """
+        count, areas = self.count, len(self.areas)
+        self.function = PythonFunction("command")
+        try:
+            body = self.command(tree, None)
+        except Unsupported:
+            self.count = count
+            del self.areas[areas:]
+            return None
+        body = ["%s = _helpers(_scope)" % helper_names] + body
+        return ["def _command_%d(_scope):" % index] + self.function_body(body)
+
+
+expression_transpilers = {
+    "ifelse_expr": Transpiler.ifelse_expr,
+    "function_def": Transpiler.function_def,
+    "function_callback": Transpiler.function_callback,
+    "function_callback_pipe": Transpiler.function_callback,
+    "or_expression": Transpiler.binary,
+    "and_expression": Transpiler.binary,
+    "xor_expression": Transpiler.binary,
+    "not_expression": Transpiler.not_expression,
+    "in_expression": Transpiler.binary,
+    "compare_expression": Transpiler.compare_expression,
+    "sum_expression": Transpiler.binary,
+    "product_expression": Transpiler.binary,
+    "exponent_expression": Transpiler.binary,
+    "unary_expression": Transpiler.unary_expression,
+    "value_access": Transpiler.value_access,
+    "char": Transpiler.char,
+    "value": Transpiler.value,
+    "impn": Transpiler.impn,
+    "record_access": Transpiler.record_access,
+    "tupleval": Transpiler.tupleval,
+    "listval": Transpiler.listval,
+    "recordval": Transpiler.recordval,
+    "match": Transpiler.match,
+}
+
+command_transpilers = {
+    "code_block": Transpiler.code_block,
+    "for": Transpiler.for_command,
+    "while": Transpiler.while_command,
+    "return": Transpiler.return_command,
+    "break": lambda self, command, env: self.exit_loop("break"),
+    "continue": lambda self, command, env: self.exit_loop("continue"),
+    "declare": Transpiler.declare,
+    "if": Transpiler.if_command,
+    "ifelse": Transpiler.ifelse_command,
+    "assert": Transpiler.assert_command,
+    "assign_value": Transpiler.assign_value,
+}
+
+
+def transpile(tree):
+    """
+    Returns the source code of the Python module for a parsed file whose
+    constants have been folded. The module has a `commands` dictionary with
+    the Python function for each transpiled top level instruction by its
+    index.
+    """
+    transpiler = Transpiler()
+    functions = []
+    indices = []
+    for index, child in enumerate(tree.children):
+        lines = transpiler.top_level(index, child)
+        if lines is not None:
+            functions.append("\n".join(lines))
+            indices.append(index)
+    return "%s\n%s\n\n\n%s\n\n\ncommands = {%s}\n" % (
+        prelude,
+        "\n".join(transpiler.areas),
+        "\n\n\n".join(functions),
+        ", ".join("%d: _command_%d" % (index, index) for index in indices),
+    )
+
+
+def get_key(text):
+    digest = hashlib.sha256()
+    for part in (
+        interface_cache.get_checker_hash(),
+        sys.version,
+        n_scope.n_parser.grammar,
+        text,
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def load_commands(tree, file=None):
+    """
+    Returns the Python function for each transpiled top level instruction of a
+    parsed file by its index, using the module cached for the File if there is
+    one.
+    """
+    path = file.path if file is not None else None
+    if not enabled or path is None:
+        code = compile(transpile(tree), path or "<n>", "exec")
+    else:
+        key = get_key(file.get_text())
+        cache_path = tree_cache.get_cache_path(path, extension)
+        code = tree_cache.load_entry(cache_path, key)
+        if code is not None:
+            code = marshal.loads(code)
+        else:
+            code = compile(transpile(tree), path, "exec")
+            tree_cache.save_entry(cache_path, key, marshal.dumps(code))
+    module = {}
+    exec(code, module)
+    return module["commands"]
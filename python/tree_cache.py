@@ -0,0 +1,111 @@
+import copyreg
+import hashlib
+import io
+import os
+import pickle
+
+import lark
+
+"""
+Parsed syntax trees are cached in a `__ncache__` folder next to each N file,
+like Python's `__pycache__`. Each cached tree is stored along with a hash of
+the source code, the grammar, and the Lark version, so a stale cache entry is
+simply ignored and overwritten.
+
+Set the N_TREE_CACHE environment variable to "off" to disable the cache.
+"""
+
+cache_dir_name = "__ncache__"
+enabled = os.environ.get("N_TREE_CACHE") != "off"
+
+
+def reduce_token(token):
+    # Lark's own Token.__reduce__ drops the end positions, which error messages
+    # need to underline the right range.
+    return (
+        lark.Token,
+        (
+            token.type,
+            token.value,
+            token.pos_in_stream,
+            token.line,
+            token.column,
+            token.end_line,
+            token.end_column,
+            token.end_pos,
+        ),
+    )
+
+
+dispatch_table = copyreg.dispatch_table.copy()
+dispatch_table[lark.Token] = reduce_token
+
+
+def dump_entry(key, value):
+    output = io.BytesIO()
+    pickler = pickle.Pickler(output, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = dispatch_table
+    pickler.dump((key, value))
+    return output.getvalue()
+
+
+def get_key(grammar, text):
+    digest = hashlib.sha256()
+    for part in (lark.__version__, grammar, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_cache_path(source_path, extension=".tree"):
+    directory, file_name = os.path.split(os.path.abspath(source_path))
+    return os.path.join(directory, cache_dir_name, file_name + extension)
+
+
+def load_entry(cache_path, key):
+    """
+    Returns the value cached in the given cache file, or None if there's no
+    value cached for this exact key.
+    """
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, value = pickle.load(f)
+    except Exception:
+        # A missing or corrupt cache file is just a cache miss
+        return None
+    return value if cached_key == key else None
+
+
+def save_entry(cache_path, key, value):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temporary file first so that another N process never
+        # reads a half-written cache file.
+        temp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(dump_entry(key, value))
+            os.replace(temp_path, cache_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    except Exception:
+        # The cache is only an optimization, so it's fine if the folder isn't
+        # writable or the value is too deep to pickle.
+        pass
+
+
+def load_tree(source_path, key):
+    """
+    Returns the cached tree for the given source file, or None if there's no
+    cached tree for this exact key.
+    """
+    if not enabled:
+        return None
+    return load_entry(get_cache_path(source_path), key)
+
+
+def save_tree(source_path, key, tree):
+    if not enabled:
+        return
+    save_entry(get_cache_path(source_path), key, tree)
@@ -1,9 +1,26 @@
 import lark
 
 
+# Types with a key by their key, so that a type sent to or from another process
+# while type checking files in parallel is the same object in this process
+shared_types = {}
+
+
+def load_shared_type(cls, key):
+    ty = shared_types.get(key)
+    if ty is None:
+        ty = cls.__new__(cls)
+        shared_types[key] = ty
+    return ty
+
+
 class NType:
-    def __init__(self, name):
+    def __init__(self, name, key=None):
         self.name = name
+        # Identifies the type in every process; see `shared_types`
+        self.key = key
+        if key is not None:
+            shared_types[key] = self
 
     def __hash__(self):
         return hash(id(self))
@@ -11,6 +28,19 @@ class NType:
     def __eq__(self, other):
         return self is other
 
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __reduce_ex__(self, protocol):
+        if getattr(self, "key", None) is None:
+            return super().__reduce_ex__(protocol)
+        return (load_shared_type, (type(self), self.key), self.__getstate__())
+
+    def __setstate__(self, state):
+        # A shared type that already exists in this process keeps its state
+        if "name" not in self.__dict__:
+            self.__dict__.update(state)
+
 
 class NGenericType(NType):
     def __init__(self, name):
@@ -44,36 +74,75 @@ class NAliasType(NType):
 
 
 class NTypeVars(NType):
-    def __init__(self, name, typevars=None, original=None):
-        super(NTypeVars, self).__init__(name)
+    def __init__(self, name, typevars=None, original=None, key=None):
+        super(NTypeVars, self).__init__(name, key)
         self.typevars = typevars or []
+        if key is not None:
+            # The typevars are shared too so that other processes can tell
+            # whether a typevar is from the base type
+            for i, typevar in enumerate(self.typevars):
+                if isinstance(typevar, NGenericType) and typevar.key is None:
+                    typevar.key = (key, i)
+                    shared_types[typevar.key] = typevar
         # Keep a reference to the original NTypeVars so that types can be
         # compared by reference
         self.base_type = original or self
+        if original is None:
+            # Children are interned by their typevars so that equal types are
+            # usually the same object
+            self.children = {}
+        # The generics used in the typevars and cached results of
+        # `apply_generics_to`, keyed by what the generics are replaced with
+        self.generics = None
+        self.substitutions = {}
+        # Children with different typevars hash differently, so they don't all
+        # collide when interning types that contain them
+        self.hash = None
 
     def with_typevars(self, typevars):
         if len(self.typevars) != len(typevars):
             raise TypeError(
                 "Expected %d typevars, not %d." % (len(self.typevars), len(typevars))
             )
-        return self.new_child(typevars)
+        children = self.base_type.children
+        key = type_key(typevars)
+        child = children.get(key)
+        if child is None:
+            child = self.new_child(list(typevars))
+            children[key] = child
+        return child
 
     def new_child(self, typevars):
         return type(self)(self.name, typevars, original=self.base_type)
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        # The caches are filled again in the other process
+        if "children" in state:
+            state["children"] = {}
+        state["generics"] = None
+        state["substitutions"] = {}
+        # The hash depends on the base type's identity in this process
+        state["hash"] = None
+        return state
+
     def is_type(self, other):
         return isinstance(other, NTypeVars) and self.base_type is other.base_type
 
     def __hash__(self):
         if self.base_type is self:
             return hash(id(self))
-        else:
-            return hash(self.base_type)
+        if self.hash is None:
+            self.hash = hash(
+                (hash(self.base_type), type_key(self.typevars, ordered=False))
+            )
+        return self.hash
 
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, NTypeVars)
             and self.base_type is other.base_type
+            and hash(self) == hash(other)
             and self.typevars == other.typevars
         )
 
@@ -81,6 +150,24 @@ class NTypeVars(NType):
         return "NTypeVars(%s, %s)" % (repr(self.name), repr(self.typevars))
 
 
+class TypeIdentity:
+    """
+    Wraps a type that can't be hashed, such as a module, so that it can be part
+    of a key from `type_key`, compared by reference.
+    """
+
+    __slots__ = ("type",)
+
+    def __init__(self, ty):
+        self.type = ty
+
+    def __hash__(self):
+        return hash(id(self.type))
+
+    def __eq__(self, other):
+        return isinstance(other, TypeIdentity) and self.type is other.type
+
+
 # N modules are kind of like records but different
 class NModule(dict):
     def __init__(self, name, *args, types=None, **kw):
@@ -106,6 +193,151 @@ class NClass(dict):
         return self.class_name
 
 
+"""
+Returns a hashable key for a type, such that equal types have equal keys. Lists
+(tuple types), tuples (function types) and records are converted to Python
+tuples tagged with what they were. Records with the same fields in a different
+order are equal, but they only get the same key if `ordered` is False, so that
+interned types keep the order their fields were written in.
+"""
+
+
+def type_key(ty, ordered=True):
+    if isinstance(ty, list):
+        return (list, tuple(type_key(item, ordered) for item in ty))
+    elif isinstance(ty, tuple):
+        return (tuple, tuple(type_key(item, ordered) for item in ty))
+    elif isinstance(ty, dict):
+        if isinstance(ty, NModule) or isinstance(ty, NClass):
+            return TypeIdentity(ty)
+        fields = [(key, type_key(value, ordered)) for key, value in ty.items()]
+        return (dict, tuple(fields if ordered else sorted(fields)))
+    elif ty is None or isinstance(ty, str) or isinstance(ty, NType):
+        return ty
+    return TypeIdentity(ty)
+
+
+"""
+Returns the generics used in a type, in the order they first appear.
+"""
+
+
+def get_generics(ty, generics=None):
+    if generics is None:
+        generics = []
+    if isinstance(ty, NGenericType):
+        if ty not in generics:
+            generics.append(ty)
+    elif isinstance(ty, NTypeVars):
+        if ty.generics is None:
+            ty.generics = tuple(get_generics(ty.typevars))
+        for generic in ty.generics:
+            if generic not in generics:
+                generics.append(generic)
+    elif isinstance(ty, list) or isinstance(ty, tuple):
+        for item in ty:
+            get_generics(item, generics)
+    elif isinstance(ty, dict) and not (
+        isinstance(ty, NModule) or isinstance(ty, NClass)
+    ):
+        for value in ty.values():
+            get_generics(value, generics)
+    return generics
+
+
+# What a type variable is bound to before it's bound to anything
+unbound = object()
+
+
+class TypeVariable:
+    """
+    A fresh type variable for a generic at one use of a generic function, trait
+    or operation. Type variables that have to be the same type are merged with
+    union-find, and the root of the merged variables holds the type they're all
+    bound to.
+    """
+
+    __slots__ = ("parent", "rank", "type", "generic")
+
+    def __init__(self, generic=None):
+        self.parent = self
+        self.rank = 0
+        self.type = unbound
+        # The generic from the actual type that the variables stand for while
+        # they're unbound
+        self.generic = generic
+
+    def find(self):
+        root = self
+        while root.parent is not root:
+            root = root.parent
+        # Path compression: point everything on the way straight at the root
+        while self.parent is not root:
+            self.parent, self = root, self.parent
+        return root
+
+    def union(self, other):
+        root, other_root = self.find(), other.find()
+        if root is other_root:
+            return root
+        if root.rank < other_root.rank:
+            root, other_root = other_root, root
+        elif root.rank == other_root.rank:
+            root.rank += 1
+        other_root.parent = root
+        if root.type is unbound:
+            root.type = other_root.type
+        if root.generic is None:
+            root.generic = other_root.generic
+        return root
+
+
+class Generics:
+    """
+    The type variables for the generics at one use of a generic function, trait
+    or operation, which `apply_generics` binds as it matches the expected types
+    against the actual types. Each use gets fresh variables, and the generics
+    in the actual types get variables separate from the expected type's, so a
+    generic function that calls itself with its generics swapped doesn't merge
+    them.
+
+    Like a dict of generics, `get` returns what a generic is replaced with, so
+    it can be passed to `apply_generics_to`.
+    """
+
+    def __init__(self):
+        self.expected = {}
+        self.actual = {}
+
+    def __len__(self):
+        return len(self.expected)
+
+    def get_variable(self, generic):
+        variable = self.expected.get(generic)
+        if variable is None:
+            variable = TypeVariable()
+            self.expected[generic] = variable
+        return variable.find()
+
+    def get_actual_variable(self, generic):
+        variable = self.actual.get(generic)
+        if variable is None:
+            variable = TypeVariable(generic)
+            self.actual[generic] = variable
+        return variable
+
+    def get(self, generic, default=None):
+        variable = self.expected.get(generic)
+        if variable is None:
+            return default
+        root = variable.find()
+        if root.type is unbound:
+            return root.generic
+        elif root.type is None:
+            return "none"
+        return root.type
+
+
 """
 `expected` is the type of the function's argument, the type with the
 generics/type variables.
@@ -116,25 +348,38 @@ Pass in `generics` to keep track of the generics across different matches.
 Returns a type with the generics swapped out to best fit the actual type. For
 example, `apply_generics(list[t], list[str])` (psuedocode) will return
 `list[str]`. This can then be compared with actual separately.
+
+A generic is bound to the first type it's matched with. If that was a generic
+in the actual type, the generic's type variable is merged with the actual
+generic's, and the first non-generic type either is matched with later binds
+them all.
 """
 
 
 def apply_generics(expected, actual, generics=None):
     if generics is None:
-        generics = {}
+        generics = Generics()
     if isinstance(expected, NGenericType):
-        generic = generics.get(expected)
-        if generic is None:
-            generics[expected] = "none" if actual is None else actual
-            return actual
-        elif generic == "none":
-            generic = None
-        if isinstance(generic, NGenericType) and not isinstance(actual, NGenericType):
-            generics[expected] = actual
-            return actual
+        variable = generics.get_variable(expected)
+        if variable.type is None:
+            return None
+        elif variable.type is not unbound:
+            return variable.type
+        elif isinstance(actual, NGenericType):
+            if variable.generic is None:
+                variable.union(generics.get_actual_variable(actual))
+                return actual
+            return variable.generic
         else:
-            return generic
+            variable.type = actual
+            return actual
     elif isinstance(expected, NTypeVars) and isinstance(actual, NTypeVars):
+        if expected.generics is None:
+            get_generics(expected)
+        if not expected.generics:
+            # There's nothing to infer, and matching the typevars would give
+            # back the same interned type
+            return expected
         if expected.base_type is actual.base_type:
             return expected.with_typevars(
                 [
@@ -188,9 +433,21 @@ def apply_generics_to(return_type, generics):
         else:
             return generic
     if isinstance(return_type, NTypeVars):
-        return return_type.with_typevars(
-            [apply_generics_to(typevar, generics) for typevar in return_type.typevars]
-        )
+        if return_type.generics is None:
+            get_generics(return_type)
+        key = tuple(type_key(generics.get(generic)) for generic in return_type.generics)
+        if all(generic is None for generic in key):
+            return return_type
+        substituted = return_type.substitutions.get(key)
+        if substituted is None:
+            substituted = return_type.with_typevars(
+                [
+                    apply_generics_to(typevar, generics)
+                    for typevar in return_type.typevars
+                ]
+            )
+            return_type.substitutions[key] = substituted
+        return substituted
     elif isinstance(return_type, tuple):
         return tuple(apply_generics_to(arg_type, generics) for arg_type in return_type)
     elif isinstance(return_type, list):
@@ -274,13 +531,16 @@ def resolve_equal_special_types(type_a, type_b):
     return None
 
 def resolve_equal_types(type_a, type_b):
-    type_a_special_resolved = resolve_equal_special_types(type_a, type_b)
-    type_b_special_resolved = resolve_equal_special_types(type_b, type_a)
     if type_a is None or type_b is None:
         return None, False
-    elif type_a_special_resolved:
+    elif type_a is type_b:
+        # Interned types are usually the same object
+        return type_a, False
+    type_a_special_resolved = resolve_equal_special_types(type_a, type_b)
+    if type_a_special_resolved:
         return type_a_special_resolved
-    elif type_b_special_resolved:
+    type_b_special_resolved = resolve_equal_special_types(type_b, type_a)
+    if type_b_special_resolved:
         return type_b_special_resolved
     elif type_a == type_b:
         return type_a, False
@@ -2,6 +2,8 @@ from type_check_error import display_type
 
 
 class Variable:
+    __slots__ = ("type", "value", "public", "mutable")
+
     def __init__(self, t, value, public=False, mutable=False):
         self.type = t
         self.value = value
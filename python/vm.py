@@ -0,0 +1,916 @@
+from array import array
+from functools import partial
+
+import lark
+
+import compiler
+import scope as n_scope
+from enums import EnumPattern, EnumValue
+from frame import Frame
+from function import TailCall
+
+"""
+Compiles commands to bytecode for a stack based virtual machine, which is the
+`vm` engine. Each compiled command is a Code object with its instructions in
+an `array("H")` of opcode and argument pairs, and the values that instructions
+refer to, such as literals, names, and operations, in a list of constants.
+`run` then evaluates the instructions in a single loop, keeping intermediate
+values on a stack rather than in nested Python calls.
+
+Variables are resolved to Frame slots with the same Environments as the
+closure engine, so bytecode and closures can run in the same Frames. The core
+language is compiled to bytecode: literals, variables, arithmetic and
+comparisons, lists, records, tuples, function calls, if/else, match, loops,
+and returns. Rarer commands and expressions, like conditional lets, imports,
+and type definitions, are compiled by the closure engine and called from the
+bytecode.
+
+Functions are CompiledFunctions whose code blocks are compiled to bytecode, so
+closures and currying work like in the closure engine. The code blocks of
+functions that use the await operator are compiled to bytecode too. At an
+AWAIT instruction, `run` returns a Suspension with its position, stack, and
+Frame, and `run_async` resumes it once the cmd has been performed.
+"""
+
+# Opcodes, roughly from most to least common since `run` checks them in order.
+# BINARY is also used for comparisons.
+LOAD_LOCAL = 0
+LOAD_CONST = 1
+STORE_LOCAL = 2
+BINARY = 3
+BINARY_LOCAL_CONST = 4
+JUMP_IF_FALSE = 5
+JUMP = 6
+CALL = 7
+LOAD_OUTER = 8
+LOAD_GLOBAL = 9
+FOR_ITER = 10
+POP = 11
+PUSH_FRAME = 12
+POP_FRAME = 13
+RETURN = 14
+TAIL_CALL = 15
+GET_FIELD = 16
+BUILD_LIST = 17
+BUILD_TUPLE = 18
+BUILD_RECORD = 19
+DUP = 20
+MATCH_BIND = 21
+MATCH_VARIANT = 22
+JUMP_IF_FALSE_OR_POP = 23
+NOT = 24
+UNARY = 25
+STORE_OUTER = 26
+STORE_GLOBAL = 27
+BIND = 28
+GET_ITER = 29
+POP_FRAMES = 30
+EVALUATE = 31
+RUN = 32
+EXIT = 33
+END = 34
+# Only used in the code blocks of functions that use the await operator
+AWAIT = 35
+AWAIT_EVALUATE = 36
+CHECK_EXIT = 37
+
+opcode_names = {
+    value: name
+    for name, value in globals().items()
+    if isinstance(value, int) and name.isupper()
+}
+
+literal_types = (bool, int, float, str, type(None))
+
+# Returned by `next` when a for loop runs out of items
+done = object()
+
+
+class Code:
+    """
+    The bytecode of a command. `ops` has an opcode followed by its argument for
+    each instruction, and jump arguments are indices in `ops`.
+    """
+
+    __slots__ = ("ops", "constants")
+
+    def __init__(self, ops, constants):
+        self.ops = ops
+        self.constants = constants
+
+    def disassemble(self):
+        """
+        Lists the instructions, for debugging.
+        """
+        lines = []
+        for pc in range(0, len(self.ops), 2):
+            op, arg = self.ops[pc], self.ops[pc + 1]
+            lines.append("%4d %-20s %d" % (pc, opcode_names[op], arg))
+        return "\n".join(lines)
+
+
+class Suspension:
+    """
+    Returned by `run` when the bytecode waits on an awaitable, with what `run`
+    needs to continue afterwards.
+    """
+
+    __slots__ = ("pc", "stack", "frame", "awaitable")
+
+    def __init__(self, pc, stack, frame, awaitable):
+        self.pc = pc
+        self.stack = stack
+        self.frame = frame
+        self.awaitable = awaitable
+
+
+class Loop:
+    """
+    A loop being compiled, for break and continue commands inside it.
+    """
+
+    def __init__(self, break_label, continue_label, frames, pops):
+        self.break_label = break_label
+        self.continue_label = continue_label
+        # How many Frames were pushed before the loop
+        self.frames = frames
+        # How many values the loop keeps on the stack, like a for loop's
+        # iterator
+        self.pops = pops
+
+
+class CodeBuilder:
+    """
+    Emits the instructions of a command while compiling it. Jumps refer to
+    labels until `assemble` replaces them with the index they're placed at.
+    Arguments have to fit in 16 bits, so `array` raises OverflowError for
+    commands too big for the virtual machine.
+    """
+
+    def __init__(self, is_async=False):
+        # Whether the command is in the code block of a function that uses the
+        # await operator
+        self.is_async = is_async
+        self.ops = array("H")
+        self.constants = []
+        self.constant_indices = {}
+        self.labels = []
+        # The indices of jump arguments and the labels to jump to
+        self.jumps = []
+        # Constants with jump tables, as `(constant index, labels by key,
+        # default label)` tuples
+        self.tables = []
+        self.loops = []
+        # How many Frames have been pushed at this point in the command
+        self.frames = 0
+
+    def emit(self, op, arg=0):
+        self.ops.append(op)
+        self.ops.append(arg)
+
+    def constant(self, value):
+        """
+        Returns the index of a constant, reusing the index of an equal literal.
+        """
+        # Trees are equal to trees at other positions in the file, which
+        # would show the wrong line in stack traces
+        key = (type(value), value) if isinstance(value, literal_types) else None
+        index = None if key is None else self.constant_indices.get(key)
+        if index is None:
+            index = len(self.constants)
+            self.constants.append(value)
+            if key is not None:
+                self.constant_indices[key] = index
+        return index
+
+    def reserve(self):
+        """
+        Returns the index of a constant that `assemble` fills in.
+        """
+        self.constants.append(None)
+        return len(self.constants) - 1
+
+    def new_label(self):
+        self.labels.append(None)
+        return len(self.labels) - 1
+
+    def place(self, label):
+        self.labels[label] = len(self.ops)
+
+    def emit_jump(self, op, label):
+        self.jumps.append((len(self.ops) + 1, label))
+        self.emit(op)
+
+    def push_frame(self, block_env, env):
+        """
+        Creates a Frame for a block if it needs one, returning the index of
+        the size argument, or None. The size isn't known until the block has
+        been compiled, so `pop_frame` fills it in.
+        """
+        if block_env is env:
+            return None
+        self.emit(PUSH_FRAME)
+        self.frames += 1
+        return len(self.ops) - 1
+
+    def pop_frame(self, size_index, block_env):
+        if size_index is not None:
+            self.ops[size_index] = len(block_env.slots)
+            self.emit(POP_FRAME)
+            self.frames -= 1
+
+    def assemble(self):
+        for index, label in self.jumps:
+            self.ops[index] = self.labels[label]
+        for index, table, default in self.tables:
+            self.constants[index] = (
+                {key: self.labels[label] for key, label in table.items()},
+                self.labels[default],
+            )
+        if len(self.constants) > 0xFFFF or len(self.ops) > 0xFFFF:
+            raise OverflowError("Command is too big for the virtual machine")
+        return Code(self.ops, self.constants)
+
+    def fallback_expr(self, expr, env):
+        if self.is_async and compiler.contains_await(expr):
+            evaluate = compiler.compile_async_expr(expr, env)
+            self.emit(AWAIT_EVALUATE, self.constant(evaluate))
+            return
+        self.emit(EVALUATE, self.constant(compiler.compile_expr(expr, env)))
+
+    def fallback_command(self, command, env):
+        """
+        Runs a command compiled by the closure engine. If it's in a loop and
+        can break or continue, the instructions after RUN jump to the code
+        that does that.
+        """
+        can_exit_loop = bool(self.loops) and any(
+            subtree.data in ("break", "continue") for subtree in command.iter_subtrees()
+        )
+        if self.is_async and compiler.contains_await(command):
+            # The command's `(exit, value)` tuple is checked after it's awaited
+            run_command = compiler.compile_closure_async_command(command, env)
+            self.emit(AWAIT_EVALUATE, self.constant(run_command))
+            self.emit(CHECK_EXIT, int(can_exit_loop))
+        else:
+            run_command = compiler.command_compilers[command.data](command, env)
+            self.emit(RUN, self.constant((run_command, can_exit_loop)))
+        if can_exit_loop:
+            after = self.new_label()
+            on_break = self.new_label()
+            on_continue = self.new_label()
+            self.emit_jump(JUMP, on_break)
+            self.emit_jump(JUMP, on_continue)
+            self.emit_jump(JUMP, after)
+            self.place(on_break)
+            self.exit_loop("break")
+            self.place(on_continue)
+            self.exit_loop("continue")
+            self.place(after)
+
+    def exit_loop(self, exit):
+        if not self.loops:
+            # The loop was compiled by the closure engine
+            self.emit(EXIT, self.constant(exit))
+            return
+        loop = self.loops[-1]
+        if self.frames > loop.frames:
+            self.emit(POP_FRAMES, self.frames - loop.frames)
+        if exit == "break":
+            for _ in range(loop.pops):
+                self.emit(POP)
+            self.emit_jump(JUMP, loop.break_label)
+        else:
+            self.emit_jump(JUMP, loop.continue_label)
+
+    def load_name(self, name, env):
+        location = env.resolve(name) if env is not None else None
+        if location is None:
+            self.emit(LOAD_GLOBAL, self.constant(name))
+        elif location[0] == 0:
+            self.emit(LOAD_LOCAL, location[1])
+        else:
+            self.emit(LOAD_OUTER, self.constant(location))
+
+    def store_name(self, name, env):
+        location = env.resolve(name) if env is not None else None
+        if location is None:
+            self.emit(STORE_GLOBAL, self.constant(name))
+        elif location[0] == 0:
+            self.emit(STORE_LOCAL, location[1])
+        else:
+            self.emit(STORE_OUTER, self.constant(location))
+
+    def expr(self, expr, env):
+        if isinstance(expr, lark.Token):
+            if expr.type == "NAME":
+                self.load_name(expr.value, env)
+            else:
+                value = n_scope.get_literal_value(expr)
+                self.emit(LOAD_CONST, self.constant(value))
+            return
+        value = getattr(expr.meta, "constant", compiler.not_constant)
+        if value is not compiler.not_constant:
+            self.emit(LOAD_CONST, self.constant(value))
+            return
+        compile_function = expression_compilers.get(expr.data)
+        if compile_function is None:
+            self.fallback_expr(expr, env)
+        else:
+            compile_function(self, expr, env)
+
+    def value(self, expr, env):
+        self.expr(expr.children[0], env)
+
+    def char(self, expr, env):
+        self.emit(LOAD_CONST, self.constant(compiler.get_char(expr)))
+
+    def binary(self, expr, env):
+        left, _, right = expr.children
+        self.operation(left, right, compiler.get_binary_operation(expr), env)
+
+    def operation(self, left, right, operation, env):
+        right_value = compiler.get_constant(right)
+        if right_value is not compiler.not_constant:
+            slot = self.get_local_slot(left, env)
+            if slot is not None:
+                # Like `i + 1`, which is common enough to be one instruction
+                self.emit(
+                    BINARY_LOCAL_CONST,
+                    self.constant((operation, slot, right_value)),
+                )
+                return
+        self.expr(left, env)
+        self.expr(right, env)
+        self.emit(BINARY, self.constant(operation))
+
+    def get_local_slot(self, expr, env):
+        """
+        Returns the slot of a variable in the current Frame, or None if the
+        expression isn't one.
+        """
+        while isinstance(expr, lark.Tree) and expr.data == "value":
+            expr = expr.children[0]
+        if not (isinstance(expr, lark.Token) and expr.type == "NAME"):
+            return None
+        location = env.resolve(expr.value) if env is not None else None
+        if location is None or location[0] != 0:
+            return None
+        return location[1]
+
+    def compare_expression(self, expr, env):
+        compare = compiler.get_comparison(expr)
+        left, _, right = expr.children
+        if isinstance(left, lark.Tree) and left.data == "compare_expression":
+            # For `a < b < c`, `a < b` is evaluated first and then `b` again
+            end = self.new_label()
+            self.expr(left, env)
+            self.emit_jump(JUMP_IF_FALSE_OR_POP, end)
+            self.operation(left.children[2], right, compare, env)
+            self.place(end)
+            return
+        self.operation(left, right, compare, env)
+
+    def not_expression(self, expr, env):
+        self.expr(expr.children[1], env)
+        self.emit(NOT)
+
+    def unary_expression(self, expr, env):
+        self.expr(expr.children[1], env)
+        self.emit(UNARY, self.constant(compiler.get_unary_operation(expr)))
+
+    def arguments(self, arguments, env):
+        """
+        Pushes the arguments of a function call and returns how many there
+        are, or None if there's a spread, which isn't compiled to bytecode.
+        """
+        if any(compiler.is_spread(arg) for arg in arguments):
+            return None
+        for arg in arguments:
+            self.expr(arg, env)
+        if len(arguments) == 0:
+            self.emit(LOAD_CONST, self.constant(()))
+            return 1
+        return len(arguments)
+
+    def function_callback(self, expr, env):
+        function, arguments = compiler.get_call_parts(expr)
+        if any(compiler.is_spread(arg) for arg in arguments):
+            self.fallback_expr(expr, env)
+            return
+        count = self.arguments(arguments, env)
+        self.expr(function, env)
+        self.emit(CALL, self.constant((expr, count)))
+
+    def await_expression(self, expr, env):
+        if not self.is_async:
+            self.fallback_expr(expr, env)
+            return
+        self.expr(expr.children[0], env)
+        self.emit(AWAIT)
+
+    def record_access(self, expr, env):
+        self.expr(expr.children[0], env)
+        self.emit(GET_FIELD, self.constant(expr.children[1].value))
+
+    def tupleval(self, expr, env):
+        for item in expr.children:
+            self.expr(item, env)
+        self.emit(BUILD_TUPLE, len(expr.children))
+
+    def listval(self, expr, env):
+        if any(compiler.is_spread(item) for item in expr.children):
+            self.fallback_expr(expr, env)
+            return
+        for item in expr.children:
+            self.expr(item, env)
+        self.emit(BUILD_LIST, len(expr.children))
+
+    def recordval(self, expr, env):
+        keys = []
+        for entry in expr.children:
+            if isinstance(entry, lark.Token):
+                keys.append(entry.value)
+            elif entry.data == "spread":
+                self.fallback_expr(expr, env)
+                return
+            else:
+                keys.append(entry.children[0].value)
+        for entry in expr.children:
+            if isinstance(entry, lark.Token):
+                self.expr(entry, env)
+            else:
+                self.expr(entry.children[1], env)
+        self.emit(BUILD_RECORD, self.constant(tuple(keys)))
+
+    def ifelse_expr(self, expr, env):
+        condition, if_true, if_false = expr.children
+        if condition.data == "conditional_let":
+            self.fallback_expr(expr, env)
+            return
+        otherwise = self.new_label()
+        end = self.new_label()
+        self.expr(condition, env)
+        self.emit_jump(JUMP_IF_FALSE, otherwise)
+        self.expr(if_true, env)
+        self.emit_jump(JUMP, end)
+        self.place(otherwise)
+        self.expr(if_false, env)
+        self.place(end)
+
+    def match(self, expr, env):
+        input_value, match_block = expr.children
+        by_value = match_block.data == "match_block"
+        arms = match_block.children
+        defaults = [
+            i
+            for i, arm in enumerate(arms)
+            if (
+                compiler.is_default_value(arm.children[0])
+                if by_value
+                else isinstance(arm.children[0], lark.Token)
+                and arm.children[0].value == "_"
+            )
+        ]
+        if defaults and defaults != [len(arms) - 1]:
+            # Default arms are evaluated as soon as they're reached, even if
+            # a later arm matches
+            self.fallback_expr(expr, env)
+            return
+        end = self.new_label()
+        no_match = self.new_label()
+        self.expr(input_value, env)
+        patterns = [
+            None
+            if by_value or i in defaults
+            else n_scope.get_destructure_pattern(arm.children[0])
+            for i, arm in enumerate(arms)
+        ]
+        arm_labels = [self.new_label() for _ in arms]
+        if not by_value and all(
+            pattern is None or isinstance(pattern[0], EnumPattern)
+            for pattern in patterns
+        ):
+            # Jump straight to the first arm with the input's variant
+            table = {}
+            for pattern, label in zip(patterns, arm_labels):
+                if pattern is not None:
+                    table.setdefault(pattern[0].variant, label)
+            index = self.reserve()
+            self.tables.append((index, table, no_match))
+            self.emit(MATCH_VARIANT, index)
+        for i, (arm, pattern, label) in enumerate(zip(arms, patterns, arm_labels)):
+            i_tree, output = arm.children
+            self.place(label)
+            if i in defaults:
+                self.place(no_match)
+                self.emit(POP)
+                self.expr(output, env)
+                self.emit_jump(JUMP, end)
+                continue
+            next_arm = self.new_label()
+            if by_value:
+                self.emit(DUP)
+                self.expr(i_tree, env)
+                equals = compiler.comparison_operations["EQUALS"]
+                self.emit(BINARY, self.constant(equals))
+                self.emit_jump(JUMP_IF_FALSE, next_arm)
+                self.emit(POP)
+                self.expr(output, env)
+                self.emit_jump(JUMP, end)
+                self.place(next_arm)
+                continue
+            arm_env = compiler.get_block_environment(env, pattern=pattern)
+            bind = compiler.compile_binder(pattern, arm_env)
+            size_index = self.push_frame(arm_env, env)
+            self.emit(MATCH_BIND, self.constant(bind))
+            self.emit_jump(JUMP_IF_FALSE, next_arm)
+            self.emit(POP)
+            self.expr(output, arm_env)
+            self.pop_frame(size_index, arm_env)
+            self.emit_jump(JUMP, end)
+            self.place(next_arm)
+            if size_index is not None:
+                self.emit(POP_FRAME)
+        if not defaults:
+            # Like the closure engine, nothing matching results in None
+            self.place(no_match)
+            self.emit(POP)
+            self.emit(LOAD_CONST, self.constant(None))
+        self.place(end)
+
+    def command(self, tree, env):
+        command = compiler.get_command(tree)
+        compile_function = command_compilers.get(command.data)
+        if compile_function is not None:
+            compile_function(self, command, env)
+        elif command.data in compiler.command_compilers:
+            self.fallback_command(command, env)
+        else:
+            # The command is an expression whose value is discarded
+            self.expr(command, env)
+            self.emit(POP)
+
+    def code_block(self, command, env):
+        for instruction in command.children:
+            self.command(instruction, env)
+
+    def block(self, body, block_env, env):
+        size_index = self.push_frame(block_env, env)
+        self.command(body, block_env)
+        self.pop_frame(size_index, block_env)
+
+    def if_command(self, command, env):
+        condition, body = command.children
+        if condition.data == "conditional_let":
+            self.fallback_command(command, env)
+            return
+        end = self.new_label()
+        self.expr(condition, env)
+        self.emit_jump(JUMP_IF_FALSE, end)
+        self.block(body, compiler.get_block_environment(env, body), env)
+        self.place(end)
+
+    def ifelse_command(self, command, env):
+        condition, if_true, if_false = command.children
+        if condition.data == "conditional_let":
+            self.fallback_command(command, env)
+            return
+        true_env = compiler.get_block_environment(env, if_true)
+        false_env = compiler.get_block_environment(env, if_false)
+        otherwise = self.new_label()
+        end = self.new_label()
+        self.expr(condition, env)
+        self.emit_jump(JUMP_IF_FALSE, otherwise)
+        self.block(if_true, true_env, env)
+        self.emit_jump(JUMP, end)
+        self.place(otherwise)
+        self.block(if_false, false_env, env)
+        self.place(end)
+
+    def for_command(self, command, env):
+        var, iterable, code = command.children
+        pattern, _ = compiler.get_name_pattern(var)
+        self.expr(iterable, env)
+        loop_env = compiler.get_block_environment(env, code, pattern)
+        slot = compiler.get_name_slot(pattern, loop_env)
+        bind = compiler.compile_binder(pattern, loop_env) if slot is None else None
+        top = self.new_label()
+        end = self.new_label()
+        self.emit(GET_ITER)
+        self.place(top)
+        self.emit_jump(FOR_ITER, end)
+        self.loops.append(Loop(end, top, self.frames, 1))
+        size_index = self.push_frame(loop_env, env)
+        if slot is None:
+            self.emit(BIND, self.constant(bind))
+        else:
+            self.emit(STORE_LOCAL, slot)
+        self.command(code, loop_env)
+        self.pop_frame(size_index, loop_env)
+        self.loops.pop()
+        self.emit_jump(JUMP, top)
+        self.place(end)
+
+    def while_command(self, command, env):
+        condition, code = command.children
+        top = self.new_label()
+        end = self.new_label()
+        self.place(top)
+        self.expr(condition, env)
+        self.emit_jump(JUMP_IF_FALSE, end)
+        self.loops.append(Loop(end, top, self.frames, 0))
+        self.block(code, compiler.get_block_environment(env, code), env)
+        self.loops.pop()
+        self.emit_jump(JUMP, top)
+        self.place(end)
+
+    def return_command(self, command, env):
+        tail_call = compiler.get_tail_call(command.children[0])
+        if tail_call is not None and compiler.in_function(env):
+            function, arguments = compiler.get_call_parts(tail_call)
+            count = self.arguments(arguments, env)
+            if count is None:
+                self.fallback_command(command, env)
+                return
+            self.expr(function, env)
+            self.emit(TAIL_CALL, self.constant((tail_call, count)))
+            return
+        self.expr(command.children[0], env)
+        self.emit(RETURN)
+
+    def declare(self, command, env):
+        modifiers, name_type, value = command.children
+        pattern, _ = compiler.get_name_pattern(name_type)
+        public = compiler.is_public(modifiers)
+        # The value is compiled first because it can't use the declared variables
+        self.expr(value, env)
+        slot = compiler.get_name_slot(pattern, env, public)
+        if slot is None:
+            bind = compiler.compile_binder(pattern, env, public)
+            self.emit(BIND, self.constant(bind))
+        else:
+            self.emit(STORE_LOCAL, slot)
+
+    def assign_value(self, command, env):
+        self.expr(compiler.get_assign_value_tree(command), env)
+        self.store_name(command.children[0].value, env)
+
+
+expression_compilers = {
+    "value": CodeBuilder.value,
+    "char": CodeBuilder.char,
+    "function_callback": CodeBuilder.function_callback,
+    "function_callback_pipe": CodeBuilder.function_callback,
+    "or_expression": CodeBuilder.binary,
+    "and_expression": CodeBuilder.binary,
+    "xor_expression": CodeBuilder.binary,
+    "in_expression": CodeBuilder.binary,
+    "sum_expression": CodeBuilder.binary,
+    "product_expression": CodeBuilder.binary,
+    "exponent_expression": CodeBuilder.binary,
+    "compare_expression": CodeBuilder.compare_expression,
+    "not_expression": CodeBuilder.not_expression,
+    "unary_expression": CodeBuilder.unary_expression,
+    "record_access": CodeBuilder.record_access,
+    "tupleval": CodeBuilder.tupleval,
+    "listval": CodeBuilder.listval,
+    "recordval": CodeBuilder.recordval,
+    "ifelse_expr": CodeBuilder.ifelse_expr,
+    "match": CodeBuilder.match,
+    "await_expression": CodeBuilder.await_expression,
+}
+
+command_compilers = {
+    "code_block": CodeBuilder.code_block,
+    "if": CodeBuilder.if_command,
+    "ifelse": CodeBuilder.ifelse_command,
+    "for": CodeBuilder.for_command,
+    "while": CodeBuilder.while_command,
+    "return": CodeBuilder.return_command,
+    "break": lambda builder, command, env: builder.exit_loop("break"),
+    "continue": lambda builder, command, env: builder.exit_loop("continue"),
+    "declare": CodeBuilder.declare,
+    "assign_value": CodeBuilder.assign_value,
+}
+
+
+def compile_command(tree, env):
+    """
+    Compiles a command to bytecode, returning a function that takes a Frame
+    and runs it like a command compiled by the closure engine.
+    """
+    builder = CodeBuilder()
+    try:
+        builder.command(tree, env)
+        builder.emit(END)
+        code = builder.assemble()
+    except OverflowError:
+        return compiler.compile_closure_command(tree, env)
+    return partial(run, code)
+
+
+def compile_async_command(tree, env):
+    """
+    Compiles the code block of a function that uses the await operator to
+    bytecode, returning an async function that takes a Frame and runs it like
+    a command compiled by `compiler.compile_async_command`.
+    """
+    builder = CodeBuilder(is_async=True)
+    try:
+        builder.command(tree, env)
+        builder.emit(END)
+        code = builder.assemble()
+    except OverflowError:
+        return compiler.compile_closure_async_command(tree, env)
+    return partial(run_async, code)
+
+
+async def run_async(code, frame):
+    """
+    Evaluates bytecode that can suspend in a Frame. Each time `run` suspends,
+    the awaitable's result is pushed onto the stack and `run` continues from
+    where it left off.
+    """
+    result = run(code, frame)
+    while type(result) is Suspension:
+        result.stack.append(await result.awaitable)
+        result = run(code, result.frame, result.pc, result.stack)
+    return result
+
+
+def run(code, frame, pc=0, stack=None):
+    """
+    Evaluates bytecode in a Frame, returning an `(exit, value)` tuple like
+    `Scope.eval_command`, or a Suspension if it waits on an awaitable. `pc` and
+    `stack` continue from a Suspension.
+    """
+    ops = code.ops
+    constants = code.constants
+    if stack is None:
+        stack = []
+    push = stack.append
+    pop = stack.pop
+    values = frame.values
+    while True:
+        op = ops[pc]
+        arg = ops[pc + 1]
+        pc += 2
+        if op == LOAD_LOCAL:
+            push(values[arg])
+        elif op == LOAD_CONST:
+            push(constants[arg])
+        elif op == STORE_LOCAL:
+            values[arg] = pop()
+        elif op == BINARY:
+            right = pop()
+            stack[-1] = constants[arg](stack[-1], right)
+        elif op == BINARY_LOCAL_CONST:
+            operation, slot, right = constants[arg]
+            push(operation(values[slot], right))
+        elif op == JUMP_IF_FALSE:
+            if not pop():
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == CALL:
+            expr, count = constants[arg]
+            function = pop()
+            arguments = stack[-count:]
+            del stack[-count:]
+            scope = frame.scope
+            scope.stack_trace.append((expr, scope.trace_file))
+            push(function.run_sync(arguments))
+            scope.stack_trace.pop()
+        elif op == LOAD_OUTER:
+            depth, slot = constants[arg]
+            outer = frame
+            for _ in range(depth):
+                outer = outer.parent
+            push(outer.values[slot])
+        elif op == LOAD_GLOBAL:
+            push(frame.scope.get_variable(constants[arg]).value)
+        elif op == FOR_ITER:
+            item = next(stack[-1], done)
+            if item is done:
+                pop()
+                pc = arg
+            else:
+                push(item)
+        elif op == POP:
+            pop()
+        elif op == PUSH_FRAME:
+            frame = Frame(frame, arg)
+            values = frame.values
+        elif op == POP_FRAME:
+            frame = frame.parent
+            values = frame.values
+        elif op == RETURN:
+            return (True, pop())
+        elif op == TAIL_CALL:
+            expr, count = constants[arg]
+            function = pop()
+            arguments = stack[-count:]
+            return (True, TailCall(function, arguments, expr, frame.scope))
+        elif op == GET_FIELD:
+            value = stack[-1]
+            field = constants[arg]
+            if isinstance(value, dict):
+                stack[-1] = value[field]
+            else:
+                internal_traits = frame.scope.get_value_internal_traits(value)
+                stack[-1] = internal_traits[field].run_sync([value])
+        elif op == BUILD_LIST:
+            if arg == 0:
+                push([])
+            else:
+                items = stack[-arg:]
+                del stack[-arg:]
+                push(items)
+        elif op == BUILD_TUPLE:
+            if arg == 0:
+                push(())
+            else:
+                items = tuple(stack[-arg:])
+                del stack[-arg:]
+                push(items)
+        elif op == BUILD_RECORD:
+            keys = constants[arg]
+            if len(keys) == 0:
+                push({})
+            else:
+                fields = stack[-len(keys) :]
+                del stack[-len(keys) :]
+                push(dict(zip(keys, fields)))
+        elif op == DUP:
+            push(stack[-1])
+        elif op == MATCH_BIND:
+            push(constants[arg](frame, stack[-1]))
+        elif op == MATCH_VARIANT:
+            table, default = constants[arg]
+            value = stack[-1]
+            if isinstance(value, EnumValue):
+                pc = table.get(value.variant, default)
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if not stack[-1]:
+                pc = arg
+            else:
+                pop()
+        elif op == NOT:
+            stack[-1] = not stack[-1]
+        elif op == UNARY:
+            stack[-1] = constants[arg](stack[-1])
+        elif op == STORE_OUTER:
+            depth, slot = constants[arg]
+            outer = frame
+            for _ in range(depth):
+                outer = outer.parent
+            outer.values[slot] = pop()
+        elif op == STORE_GLOBAL:
+            frame.scope.get_variable(constants[arg]).value = pop()
+        elif op == BIND:
+            constants[arg](frame, pop())
+        elif op == GET_ITER:
+            stack[-1] = iter(stack[-1])
+        elif op == POP_FRAMES:
+            for _ in range(arg):
+                frame = frame.parent
+            values = frame.values
+        elif op == EVALUATE:
+            push(constants[arg](frame))
+        elif op == RUN:
+            run_command, can_exit_loop = constants[arg]
+            exit, value = run_command(frame)
+            if exit is True:
+                return (True, value)
+            if can_exit_loop:
+                # Go to the jump for break, continue, or neither
+                if not exit:
+                    pc += 4
+                elif exit == "continue":
+                    pc += 2
+            elif exit:
+                return (exit, value)
+        elif op == EXIT:
+            return (constants[arg], None)
+        elif op == END:
+            return (False, None)
+        elif op == AWAIT:
+            awaitable = compiler.await_value(frame, pop())
+            return Suspension(pc, stack, frame, awaitable)
+        elif op == AWAIT_EVALUATE:
+            return Suspension(pc, stack, frame, constants[arg](frame))
+        elif op == CHECK_EXIT:
+            # Like RUN after the command has been awaited
+            exit, value = pop()
+            if exit is True:
+                return (True, value)
+            if arg:
+                if not exit:
+                    pc += 4
+                elif exit == "continue":
+                    pc += 2
+            elif exit:
+                return (exit, value)
+        else:
+            raise SyntaxError("Unknown opcode %d" % op)